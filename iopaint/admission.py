@@ -0,0 +1,324 @@
+import contextlib
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from iopaint.const import TILE_BATCH_SIZE
+from iopaint.helper import boxes_from_mask, crop_box, merge_crop_boxes, tile_boxes
+from iopaint.job_queue import raise_if_cancelled
+from iopaint.metrics import stage
+from iopaint.schema import (
+    AdmissionPolicy,
+    HDStrategy,
+    InpaintRequest,
+    ModelInfo,
+    ModelType,
+    RequestCost,
+)
+
+# model type -> (seconds per megapixel per step, peak activation MB per megapixel)
+# Rough numbers of a fp16 model on a consumer GPU, latency is recalibrated from
+# the observed process time of each model.
+MODEL_TYPE_COSTS: Dict[ModelType, Tuple[float, float]] = {
+    ModelType.INPAINT: (0.15, 600),
+    ModelType.DIFFUSERS_SD: (0.1, 1500),
+    ModelType.DIFFUSERS_SD_INPAINT: (0.1, 1500),
+    ModelType.DIFFUSERS_SDXL: (0.25, 2500),
+    ModelType.DIFFUSERS_SDXL_INPAINT: (0.25, 2500),
+    ModelType.DIFFUSERS_OTHER: (0.15, 2000),
+}
+# (compute factor, memory factor) of the extra network
+CONTROLNET_COST = (1.4, 1.3)
+BRUSHNET_COST = (1.5, 1.4)
+
+# diffusion models pad small images up to 512px
+DIFFUSION_MIN_SIZE = 512
+# never downscale the longer side below this
+MIN_DOWNSCALE_SIZE = 256
+
+
+def _crop_pixels(mask: np.ndarray, config: InpaintRequest) -> int:
+    """Pixels of the crops InpaintModel runs for hd_strategy=CROP"""
+    img_h, img_w = mask.shape[:2]
+    margin = config.hd_strategy_crop_margin
+    boxes = merge_crop_boxes(
+        boxes_from_mask(mask),
+        img_h,
+        img_w,
+        margin,
+        max_size=config.hd_strategy_crop_trigger_size,
+    )
+    pixels = 0
+    for box in boxes:
+        l, t, r, b = crop_box(box, img_h, img_w, margin)
+        pixels += (r - l) * (b - t)
+    return pixels
+
+
+def _tile_pixels(mask: np.ndarray, config: InpaintRequest) -> Tuple[int, int]:
+    img_h, img_w = mask.shape[:2]
+    pixels, long_side = 0, 0
+    for row in tile_boxes(
+        img_h, img_w, config.hd_strategy_tile_size, config.hd_strategy_tile_overlap
+    ):
+        for l, t, r, b in row:
+            if (mask[t:b, l:r] > 127).any():
+                pixels += (r - l) * (b - t)
+                long_side = max(long_side, r - l, b - t)
+    return pixels, long_side
+
+
+def forward_size(
+    model_info: ModelInfo, mask: np.ndarray, config: InpaintRequest
+) -> Tuple[int, int]:
+    """
+    (pixels, longer side) of the image the model actually runs on, following the
+    hd_strategy of erase models and sd_scale/croper/extender of diffusion models
+    """
+    img_h, img_w = mask.shape[:2]
+    long_side = max(img_h, img_w)
+    if model_info.model_type == ModelType.INPAINT:
+        if (
+            config.hd_strategy == HDStrategy.CROP
+            and long_side > config.hd_strategy_crop_trigger_size
+        ):
+            return _crop_pixels(mask, config), long_side
+        if (
+            config.hd_strategy == HDStrategy.TILE
+            and long_side > config.hd_strategy_tile_size
+        ):
+            return _tile_pixels(mask, config)
+        if (
+            config.hd_strategy == HDStrategy.RESIZE
+            and long_side > config.hd_strategy_resize_limit
+        ):
+            scale = config.hd_strategy_resize_limit / long_side
+            return int(img_h * img_w * scale**2), config.hd_strategy_resize_limit
+        return img_h * img_w, long_side
+
+    if config.use_croper:
+        img_h, img_w = config.croper_height, config.croper_width
+    elif config.use_extender:
+        img_h, img_w = config.extender_height, config.extender_width
+    h = max(int(img_h * config.sd_scale), 1)
+    w = max(int(img_w * config.sd_scale), 1)
+    if max(h, w) < DIFFUSION_MIN_SIZE:
+        scale = DIFFUSION_MIN_SIZE / max(h, w)
+        h, w = int(h * scale), int(w * scale)
+    return h * w, max(img_h, img_w)
+
+
+class CostModel:
+    """
+    Estimate compute, peak memory and latency of an inpaint request.
+
+    Compute is megapixels * denoising steps * extra network factor. Latency is
+    compute times seconds per unit, starting from MODEL_TYPE_COSTS and updated
+    with an exponential moving average of the observed forward time of each model.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        # model name -> observed seconds per compute unit
+        self._seconds_per_unit: Dict[str, float] = {}
+
+    def estimate(
+        self, model_info: ModelInfo, mask: np.ndarray, config: InpaintRequest
+    ) -> RequestCost:
+        pixels, _ = forward_size(model_info, mask, config)
+        seconds_per_unit, memory_per_mp = MODEL_TYPE_COSTS[model_info.model_type]
+        steps = 1
+        compute_factor, memory_factor = 1.0, 1.0
+        if model_info.model_type != ModelType.INPAINT:
+            steps = max(int(config.sd_steps * config.sd_strength), 1)
+            if config.enable_controlnet and model_info.support_controlnet:
+                compute_factor, memory_factor = CONTROLNET_COST
+            elif (config.enable_brushnet and model_info.support_brushnet) or (
+                config.enable_powerpaint_v2 and model_info.support_powerpaint_v2
+            ):
+                compute_factor, memory_factor = BRUSHNET_COST
+
+        megapixels = pixels / 1e6
+        compute = megapixels * steps * compute_factor
+        memory_megapixels = megapixels
+        if (
+            model_info.model_type == ModelType.INPAINT
+            and config.hd_strategy == HDStrategy.TILE
+        ):
+            # peak memory is bounded by the tiles run at once(TILE_BATCH_SIZE)
+            tile_pixels = config.hd_strategy_tile_size**2 * TILE_BATCH_SIZE
+            memory_megapixels = min(pixels, tile_pixels) / 1e6
+        with self._lock:
+            seconds_per_unit = self._seconds_per_unit.get(
+                model_info.name, seconds_per_unit
+            )
+        return RequestCost(
+            pixels=pixels,
+            steps=steps,
+            compute=compute,
+            memory=memory_megapixels * memory_per_mp * memory_factor,
+            latency=compute * seconds_per_unit,
+        )
+
+    def observe(self, model_name: str, cost: RequestCost, seconds: float):
+        if cost.compute <= 0:
+            return
+        value = seconds / cost.compute
+        with self._lock:
+            prev = self._seconds_per_unit.get(model_name)
+            if prev is not None:
+                value = prev + self.alpha * (value - prev)
+            self._seconds_per_unit[model_name] = value
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, cost: RequestCost, reason: str):
+        super().__init__(reason)
+        self.cost = cost
+        self.status_code = 413
+        self.detail = (
+            f"{reason}, estimated memory: {cost.memory:.0f}MB, "
+            f"estimated latency: {cost.latency:.1f}s. "
+            f"Reduce the image size, sd_scale or sd_steps"
+        )
+
+
+class AdmissionTimeoutError(Exception):
+    def __init__(self, cost: RequestCost, retry_after: float):
+        super().__init__("Not enough memory budget for the request")
+        self.status_code = 503
+        self.detail = (
+            f"Request needs {cost.memory:.0f}MB memory budget, "
+            f"waited {retry_after:.0f}s for running requests to finish"
+        )
+        self.headers = {"Retry-After": str(math.ceil(retry_after))}
+
+
+class AdmissionController:
+    """
+    Keep requests within the memory and latency budgets of the server.
+
+    A request that exceeds a budget on its own is rejected, or downscaled when the
+    policy is ``downscale``. A request that fits on its own but not together with
+    the running requests is deferred until enough memory budget is released.
+    Budgets of 0 are disabled.
+    """
+
+    def __init__(
+        self,
+        memory_budget: float = 0,
+        latency_budget: float = 0,
+        policy: AdmissionPolicy = AdmissionPolicy.downscale,
+        defer_timeout: float = 60,
+        cost_model: Optional[CostModel] = None,
+    ):
+        self.memory_budget = memory_budget
+        self.latency_budget = latency_budget
+        self.policy = policy
+        self.defer_timeout = defer_timeout
+        self.cost_model = cost_model or CostModel()
+        self._cond = threading.Condition()
+        self._reserved_memory = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_budget > 0 or self.latency_budget > 0
+
+    @property
+    def reserved_memory(self) -> float:
+        return self._reserved_memory
+
+    def _over_budget(self, cost: RequestCost) -> Optional[str]:
+        if self.memory_budget > 0 and cost.memory > self.memory_budget:
+            return f"Request exceeds memory budget({self.memory_budget}MB)"
+        if self.latency_budget > 0 and cost.latency > self.latency_budget:
+            return f"Request exceeds latency budget({self.latency_budget}s)"
+        return None
+
+    def _downscale_ratio(self, cost: RequestCost) -> float:
+        """Ratio of pixels to keep so that the request fits the budgets"""
+        ratio = 1.0
+        if self.memory_budget > 0 and cost.memory > 0:
+            ratio = min(ratio, self.memory_budget / cost.memory)
+        if self.latency_budget > 0 and cost.latency > 0:
+            ratio = min(ratio, self.latency_budget / cost.latency)
+        return ratio
+
+    def _downscale(
+        self, model_info: ModelInfo, mask: np.ndarray, config: InpaintRequest
+    ) -> Optional[InpaintRequest]:
+        cost = self.cost_model.estimate(model_info, mask, config)
+        # cost is roughly linear in pixels, margin for the rounding of sizes
+        ratio = self._downscale_ratio(cost) * 0.9
+        if model_info.model_type == ModelType.INPAINT:
+            # resize the whole image, crop boxes may cover most of it after resize
+            img_h, img_w = mask.shape[:2]
+            scale = math.sqrt(cost.pixels * ratio / (img_h * img_w))
+            limit = int(max(img_h, img_w) * min(scale, 1))
+            if limit < MIN_DOWNSCALE_SIZE:
+                return None
+            update = {
+                "hd_strategy": HDStrategy.RESIZE,
+                "hd_strategy_resize_limit": limit,
+            }
+        else:
+            _, long_side = forward_size(model_info, mask, config)
+            scale = math.sqrt(ratio)
+            sd_scale = config.sd_scale * scale
+            if long_side * sd_scale < MIN_DOWNSCALE_SIZE:
+                return None
+            update = {"sd_scale": sd_scale}
+        return config.model_copy(update=update)
+
+    def admit(
+        self, model_info: ModelInfo, mask: np.ndarray, config: InpaintRequest
+    ) -> Tuple[InpaintRequest, RequestCost]:
+        """
+        Returns:
+            the request to run, downscaled if needed, and its estimated cost
+        """
+        cost = self.cost_model.estimate(model_info, mask, config)
+        reason = self._over_budget(cost)
+        if reason is None:
+            return config, cost
+        if self.policy == AdmissionPolicy.downscale:
+            downscaled = self._downscale(model_info, mask, config)
+            if downscaled is not None:
+                new_cost = self.cost_model.estimate(model_info, mask, downscaled)
+                if self._over_budget(new_cost) is None:
+                    logger.info(
+                        f"{reason}, downscale request: "
+                        f"{cost.pixels} -> {new_cost.pixels} pixels"
+                    )
+                    return downscaled, new_cost
+        raise AdmissionRejectedError(cost, reason)
+
+    @contextlib.contextmanager
+    def reserve(self, cost: Optional[RequestCost]):
+        """Hold the memory budget of the request, wait for running requests"""
+        if cost is None or self.memory_budget <= 0:
+            yield
+            return
+        deadline = time.time() + self.defer_timeout
+        with stage("admission_wait"), self._cond:
+            while (
+                self._reserved_memory > 0
+                and self._reserved_memory + cost.memory > self.memory_budget
+            ):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AdmissionTimeoutError(cost, self.defer_timeout)
+                self._cond.wait(min(remaining, 1))
+                raise_if_cancelled()
+            self._reserved_memory += cost.memory
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._reserved_memory -= cost.memory
+                self._cond.notify_all()
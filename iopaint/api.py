@@ -1,8 +1,13 @@
 import asyncio
+import contextlib
+import json
+import math
 import os
+import secrets
 import threading
 import time
 import traceback
+import uuid
 from pathlib import Path
 from typing import Optional, Dict, List
 
@@ -22,30 +27,57 @@ except:
 
 import uvicorn
 from PIL import Image
-from fastapi import APIRouter, FastAPI, Request, UploadFile
+from fastapi import APIRouter, FastAPI, Form, Header, Query, Request, UploadFile
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
+from pydantic import ValidationError
 from socketio import AsyncServer
 
+from iopaint.admission import AdmissionController, AdmissionRejectedError
+from iopaint.download import scan_loras
 from iopaint.file_manager import FileManager
+from iopaint.job_queue import (
+    JobCancelledError,
+    JobQueue,
+    QueueFullError,
+    current_job,
+    raise_if_cancelled,
+)
+from iopaint.metrics import (
+    Gauge,
+    Metrics,
+    StageTimer,
+    current_timer,
+    size_bucket,
+    stage,
+)
+from iopaint.progress_bus import ProgressBus
+from iopaint.result_cache import ResultCache, request_fields_json, result_cache_key
+from iopaint.session_store import ImageSession, SessionStore
+from iopaint.single_flight import SingleFlight, single_flight_key
+from iopaint.warmup import Warmup, parse_warmup_hd_strategies, parse_warmup_sizes
+from iopaint.worker_pool import WorkerPool
 from iopaint.helper import (
     load_img,
     decode_base64_to_image,
+    decode_bytes_to_image,
+    numpy_to_raw_bytes,
     pil_to_bytes,
     numpy_to_bytes,
     concat_alpha_channel,
     gen_frontend_mask,
     adjust_mask,
 )
+from iopaint.model.helper.latent_preview import is_sdxl_pipeline, latents_to_preview
 from iopaint.model.utils import torch_gc
+from iopaint.model_loader import ModelLoader
 from iopaint.model_manager import ModelManager
-from iopaint.plugins import build_plugins, RealESRGANUpscaler, InteractiveSeg
+from iopaint.plugins import build_plugins
 from iopaint.plugins.base_plugin import BasePlugin
-from iopaint.plugins.remove_bg import RemoveBG
 from iopaint.schema import (
     GenInfoResponse,
     ApiConfig,
@@ -58,9 +90,20 @@ from iopaint.schema import (
     AdjustMaskRequest,
     RemoveBGModel,
     SwitchPluginModelRequest,
+    ModelCacheStats,
+    ModelLoadInfo,
+    ModelLoadRequest,
     ModelInfo,
+    ModelType,
     InteractiveSegModel,
     RealESRGANModel,
+    JobInfo,
+    ImageSessionInfo,
+    ProfileMode,
+    ResponseFormat,
+    ResultCacheStats,
+    WarmupInfo,
+    WorkerInfo,
 )
 
 # 导入认证相关模块
@@ -108,7 +151,9 @@ def api_middleware(app: FastAPI):
             else:
                 traceback.print_exc()
         return JSONResponse(
-            status_code=vars(e).get("status_code", 500), content=jsonable_encoder(err)
+            status_code=vars(e).get("status_code", 500),
+            content=jsonable_encoder(err),
+            headers=vars(e).get("headers", None),
         )
 
     @app.middleware("http")
@@ -131,21 +176,56 @@ def api_middleware(app: FastAPI):
         "allow_headers": ["*"],
         "allow_origins": ["*"],
         "allow_credentials": True,
-        "expose_headers": ["X-Seed"],
+        "expose_headers": [
+            "X-Seed",
+            "X-Width",
+            "X-Height",
+            "X-Channels",
+            "X-Session-Version",
+            "Server-Timing",
+            "X-Profile-Trace",
+            "X-Admission",
+        ],
     }
     app.add_middleware(CORSMiddleware, **cors_options)
 
 
 global_sio: AsyncServer = None
+global_progress_bus: ProgressBus = None
+global_preview_interval: int = 0
+
+SOCKET_ID_HEADER_HELP = (
+    "socket.io sid of the client, progress events are only sent to this client"
+)
+PROFILE_HELP = (
+    "Return wall/cpu time of each stage in Server-Timing header. "
+    "trace also saves a torch profiler trace, requires admin token"
+)
+ADMIN_TOKEN_HEADER_HELP = "Token set by --admin-token"
+
+# plugin name -> ApiConfig field of its model, plugin classes are imported lazily
+PLUGIN_MODEL_CONFIG_FIELDS = {
+    "RemoveBG": "remove_bg_model",
+    "RealESRGAN": "realesrgan_model",
+    "InteractiveSeg": "interactive_seg_model",
+}
 
 
 def diffuser_callback(pipe, step: int, timestep: int, callback_kwargs: Dict = {}):
     # self: DiffusionPipeline, step: int, timestep: int, callback_kwargs: Dict
     # logger.info(f"diffusion callback: step={step}, timestep={timestep}")
-
-    # We use asyncio loos for task processing. Perhaps in the future, we can add a processing queue similar to InvokeAI,
-    # but for now let's just start a separate event loop. It shouldn't make a difference for single person use
-    asyncio.run(global_sio.emit("diffusion_progress", {"step": step}))
+    # stop the pipeline loop of a cancelled job
+    raise_if_cancelled()
+    global_progress_bus.emit("diffusion_progress", {"step": step})
+    latents = callback_kwargs.get("latents")
+    if (
+        global_preview_interval > 0
+        and latents is not None
+        and step % global_preview_interval == 0
+    ):
+        # bytes are sent as binary socket.io attachment
+        preview = latents_to_preview(latents, sdxl=is_sdxl_pipeline(pipe))
+        global_progress_bus.emit("diffusion_preview", {"step": step, "image": preview})
     return {}
 
 
@@ -155,6 +235,59 @@ class Api:
         self.config = config
         self.router = APIRouter()
         self.queue_lock = threading.Lock()
+        # fail fast on invalid options, before loading the model
+        warmup_sizes = parse_warmup_sizes(config.warmup_sizes)
+        warmup_hd_strategies = parse_warmup_hd_strategies(config.warmup_hd_strategies)
+        # with micro-batching or worker pool, requests run concurrently so they can be batched
+        # or dispatched to different model workers
+        self.job_queue = JobQueue(
+            max_queue_size=config.max_queue_size,
+            num_workers=max(config.batch_size, config.num_workers),
+        )
+        self.result_cache = ResultCache(
+            memory_budget=config.result_cache_size * 1024 * 1024,
+            disk_dir=config.result_cache_dir,
+            disk_budget=config.result_cache_disk_size * 1024 * 1024,
+        )
+        self.session_store = SessionStore(
+            memory_budget=config.session_cache_size * 1024 * 1024,
+            max_versions=config.session_max_versions,
+        )
+        self.admission = AdmissionController(
+            memory_budget=config.admission_memory_budget,
+            latency_budget=config.admission_latency_budget,
+            policy=config.admission_policy,
+        )
+        self.single_flight = SingleFlight()
+        self.metrics = Metrics()
+        self.metrics.add(
+            Gauge(
+                "iopaint_job_queue_depth",
+                "Jobs waiting in the queue",
+                lambda: self.job_queue.depth,
+            )
+        )
+        self.metrics.add(
+            Gauge(
+                "iopaint_jobs_in_flight",
+                "Jobs being processed",
+                lambda: self.job_queue.in_flight,
+            )
+        )
+        self.metrics.add(
+            Gauge(
+                "iopaint_ready",
+                "1 once the startup warm-up finished",
+                lambda: int(self.warmup.ready),
+            )
+        )
+        self.metrics.add(
+            Gauge(
+                "iopaint_admission_reserved_memory_megabytes",
+                "Estimated memory of running inpaint requests",
+                lambda: self.admission.reserved_memory,
+            )
+        )
         api_middleware(self.app)
 
         # 注册认证路由
@@ -166,7 +299,31 @@ class Api:
 
         self.file_manager = self._build_file_manager()
         self.plugins = self._build_plugins()
-        self.model_manager = self._build_model_manager()
+        with self.metrics.model_load_seconds.time(model=config.model, kind="load"):
+            self.model_manager = self._build_model_manager()
+        self.model_loader = None
+        if isinstance(self.model_manager, ModelManager):
+            self.model_loader = ModelLoader(
+                self.model_manager,
+                on_update=lambda info: self.progress_bus.emit(
+                    "model_load", jsonable_encoder(info)
+                ),
+                load_timer=self.metrics.model_load_seconds.time,
+            )
+            self.metrics.add(
+                Gauge(
+                    "iopaint_model_cache_device_megabytes",
+                    "Weights of the cached models in GPU memory",
+                    lambda: self.model_manager.cache_stats().device_bytes / 1024 / 1024,
+                )
+            )
+            self.metrics.add(
+                Gauge(
+                    "iopaint_model_cache_host_megabytes",
+                    "Weights of the cached models in CPU memory",
+                    lambda: self.model_manager.cache_stats().host_bytes / 1024 / 1024,
+                )
+            )
 
         # 数据库初始化
         self._init_database()
@@ -177,26 +334,81 @@ class Api:
                            response_model=ServerConfigResponse)
         self.add_api_route("/api/v1/model", self.api_current_model, methods=["GET"], response_model=ModelInfo)
         self.add_api_route("/api/v1/model", self.api_switch_model, methods=["POST"], response_model=ModelInfo)
+        self.add_api_route("/api/v1/model/load", self.api_load_model, methods=["POST"], response_model=ModelLoadInfo)
+        self.add_api_route("/api/v1/model/load", self.api_model_loads, methods=["GET"], response_model=List[ModelLoadInfo])
         self.add_api_route("/api/v1/inputimage", self.api_input_image, methods=["GET"])
+        self.add_api_route("/api/v1/sessions", self.api_create_session, methods=["POST"], response_model=ImageSessionInfo)
+        self.add_api_route("/api/v1/sessions/{session_id}", self.api_session_info, methods=["GET"], response_model=ImageSessionInfo)
+        self.add_api_route("/api/v1/sessions/{session_id}", self.api_delete_session, methods=["DELETE"])
+        self.add_api_route("/api/v1/sessions/{session_id}/image", self.api_session_image, methods=["GET"])
         self.add_api_route("/api/v1/inpaint", self.api_inpaint, methods=["POST"])
+        self.add_api_route("/api/v1/inpaint_bytes", self.api_inpaint_bytes, methods=["POST"])
+        self.add_api_route("/api/v1/jobs/inpaint", self.api_submit_inpaint_job, methods=["POST"], response_model=JobInfo)
+        self.add_api_route("/api/v1/jobs/{job_id}", self.api_job_info, methods=["GET"], response_model=JobInfo)
+        self.add_api_route("/api/v1/jobs/{job_id}/result", self.api_job_result, methods=["GET"])
+        self.add_api_route("/api/v1/profiles/{name}", self.api_profile_trace, methods=["GET"])
+        self.add_api_route("/api/v1/jobs/{job_id}/cancel", self.api_cancel_job, methods=["POST"], response_model=JobInfo)
         self.add_api_route("/api/v1/switch_plugin_model", self.api_switch_plugin_model, methods=["POST"])
         self.add_api_route("/api/v1/run_plugin_gen_mask", self.api_run_plugin_gen_mask, methods=["POST"])
         self.add_api_route("/api/v1/run_plugin_gen_image", self.api_run_plugin_gen_image, methods=["POST"])
+        self.add_api_route("/api/v1/run_plugin_gen_mask_bytes", self.api_run_plugin_gen_mask_bytes, methods=["POST"])
+        self.add_api_route("/api/v1/run_plugin_gen_image_bytes", self.api_run_plugin_gen_image_bytes, methods=["POST"])
         self.add_api_route("/api/v1/samplers", self.api_samplers, methods=["GET"])
+        self.add_api_route("/api/v1/loras", self.api_loras, methods=["GET"])
+        self.add_api_route("/api/v1/result_cache", self.api_result_cache, methods=["GET"], response_model=ResultCacheStats)
+        self.add_api_route("/api/v1/workers", self.api_workers, methods=["GET"], response_model=List[WorkerInfo])
+        self.add_api_route("/api/v1/model_cache", self.api_model_cache, methods=["GET"], response_model=ModelCacheStats)
+        self.add_api_route("/metrics", self.api_metrics, methods=["GET"])
+        self.add_api_route("/api/v1/health/live", self.api_health_live, methods=["GET"], response_model=WarmupInfo)
+        self.add_api_route("/api/v1/health/ready", self.api_health_ready, methods=["GET"], response_model=WarmupInfo)
         self.add_api_route("/api/v1/adjust_mask", self.api_adjust_mask, methods=["POST"])
         self.add_api_route("/api/v1/save_image", self.api_save_image, methods=["POST"])
         self.app.mount("/", StaticFiles(directory=WEB_APP_DIR, html=True), name="assets")
         # fmt: on
 
-        global global_sio
+        global global_sio, global_progress_bus, global_preview_interval
         self.sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
         self.combined_asgi_app = socketio.ASGIApp(self.sio, self.app)
         self.app.mount("/ws", self.combined_asgi_app)
+        self.progress_bus = ProgressBus(self.sio)
+        self.sio.on("connect", self.sio_connect)
+        self.sio.on("join_job", self.sio_join_job)
+        self.sio.on("cancel_job", self.sio_cancel_job)
+        self.sio.on("disconnect", self.sio_disconnect)
         global_sio = self.sio
+        global_progress_bus = self.progress_bus
+        global_preview_interval = config.preview_interval
+
+        # after the globals are set, diffusion callbacks emit progress events
+        self.warmup = Warmup(
+            self.model_manager,
+            self.plugins,
+            warmup_sizes,
+            warmup_hd_strategies,
+            self._model_lock,
+        )
+        self.warmup.start()
 
     def add_api_route(self, path: str, endpoint, **kwargs):
         return self.app.add_api_route(path, endpoint, **kwargs)
 
+    async def sio_connect(self, sid, environ, auth=None):
+        # progress events are emitted from job threads to the loop serving socket.io
+        self.progress_bus.bind_loop(asyncio.get_running_loop())
+
+    async def sio_join_job(self, sid, data):
+        # receive progress events of a job submitted by /api/v1/jobs/inpaint
+        await self.sio.enter_room(sid, data["job_id"])
+
+    async def sio_cancel_job(self, sid, data):
+        self.job_queue.cancel(data["job_id"])
+
+    async def sio_disconnect(self, sid):
+        # nobody is waiting for the result of a closed tab
+        for job in self.job_queue.active_jobs():
+            if job.owner == sid:
+                self.job_queue.cancel(job.job_id)
+
     def api_save_image(self, file: UploadFile):
         # Sanitize filename to prevent path traversal
         safe_filename = Path(file.filename).name  # Get just the filename component
@@ -222,18 +434,50 @@ class Api:
     def api_switch_model(self, req: SwitchModelRequest) -> ModelInfo:
         if req.name == self.model_manager.name:
             return self.model_manager.current_model
-        self.model_manager.switch(req.name)
+        if self.model_loader is not None:
+            self.model_loader.cancel_switch()
+        with self.queue_lock:
+            with self.metrics.model_load_seconds.time(model=req.name, kind="switch"):
+                self.model_manager.switch(req.name)
         return self.model_manager.current_model
 
+    def api_load_model(self, req: ModelLoadRequest) -> ModelLoadInfo:
+        if self.model_loader is None:
+            raise HTTPException(
+                404,
+                detail="Background model loading is not available with model workers",
+            )
+        if req.name not in self.model_manager.available_models:
+            raise HTTPException(400, detail=f"Model {req.name} not found")
+        cache = self.model_manager.cache
+        if (
+            not req.switch
+            and req.name != self.model_manager.name
+            and cache.device_budget == 0
+            and cache.host_budget == 0
+        ):
+            # the prefetched model would be evicted as soon as it is loaded
+            raise HTTPException(
+                409,
+                detail="Model cache budgets of 0 keep a single model, set "
+                "--model-cache-device-budget or --model-cache-host-budget to prefetch",
+            )
+        return self.model_loader.load(req.name, switch=req.switch)
+
+    def api_model_loads(self) -> List[ModelLoadInfo]:
+        if self.model_loader is None:
+            return []
+        return self.model_loader.infos()
+
     def api_switch_plugin_model(self, req: SwitchPluginModelRequest):
         if req.plugin_name in self.plugins:
             self.plugins[req.plugin_name].switch_model(req.model_name)
-            if req.plugin_name == RemoveBG.name:
-                self.config.remove_bg_model = req.model_name
-            if req.plugin_name == RealESRGANUpscaler.name:
-                self.config.realesrgan_model = req.model_name
-            if req.plugin_name == InteractiveSeg.name:
-                self.config.interactive_seg_model = req.model_name
+            if req.plugin_name in PLUGIN_MODEL_CONFIG_FIELDS:
+                setattr(
+                    self.config,
+                    PLUGIN_MODEL_CONFIG_FIELDS[req.plugin_name],
+                    req.model_name,
+                )
             torch_gc()
 
     def api_server_config(self) -> ServerConfigResponse:
@@ -282,91 +526,798 @@ class Api:
             negative_prompt = parts[1].split("\n")[0].strip()
         return GenInfoResponse(prompt=prompt, negative_prompt=negative_prompt)
 
-    def api_inpaint(self, req: InpaintRequest):
-        image, alpha_channel, infos, ext = decode_base64_to_image(req.image)
-        mask, _, _, _ = decode_base64_to_image(req.mask, gray=True)
-        logger.info(f"image ext: {ext}")
+    def api_create_session(self, file: UploadFile) -> ImageSessionInfo:
+        if not self.session_store.enabled:
+            raise HTTPException(status_code=422, detail="Image session is disabled")
+        image, alpha_channel, infos, ext = decode_bytes_to_image(file.file.read())
+        return self.session_store.create(image, alpha_channel, infos, ext).info()
 
-        mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
-        if image.shape[:2] != mask.shape[:2]:
-            raise HTTPException(
-                400,
-                detail=f"Image size({image.shape[:2]}) and mask size({mask.shape[:2]}) not match.",
+    def api_session_info(self, session_id: str) -> ImageSessionInfo:
+        return self._get_session(session_id).info()
+
+    def api_delete_session(self, session_id: str):
+        self._get_session(session_id)
+        self.session_store.delete(session_id)
+
+    def api_session_image(
+        self,
+        session_id: str,
+        version: Optional[int] = None,
+        response_format: ResponseFormat = ResponseFormat.image,
+    ):
+        session = self._get_session(session_id)
+        image = self._get_session_version(session, version)
+        return self._image_response(
+            concat_alpha_channel(image.image, image.alpha_channel),
+            image.ext,
+            session.infos,
+            response_format,
+            headers={"X-Session-Version": str(image.version)},
+        )
+
+    def api_inpaint(
+        self,
+        req: InpaintRequest,
+        x_socket_id: Optional[str] = Header(None, description=SOCKET_ID_HEADER_HELP),
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        self._check_profile(profile, x_admin_token)
+        self._check_loras(req)
+
+        def run():
+            job = self._submit_job(
+                self._process_inpaint, req, profile, sid=x_socket_id
             )
+            return self._wait_job(job)
 
-        start = time.time()
-        rgb_np_img = self.model_manager(image, mask, req)
-        logger.info(f"process time: {(time.time() - start) * 1000:.2f}ms")
-        torch_gc()
-
-        rgb_np_img = cv2.cvtColor(rgb_np_img.astype(np.uint8), cv2.COLOR_BGR2RGB)
-        rgb_res = concat_alpha_channel(rgb_np_img, alpha_channel)
-
-        res_img_bytes = pil_to_bytes(
-            Image.fromarray(rgb_res),
-            ext=ext,
-            quality=self.config.quality,
-            infos=infos,
+        return self._coalesce(
+            "inpaint",
+            profile,
+            run,
+            req.image,
+            req.mask,
+            req.session_id,
+            str(req.session_version),
+            *self._inpaint_key_parts(req),
         )
 
-        asyncio.run(self.sio.emit("diffusion_finish"))
+    def api_inpaint_bytes(
+        self,
+        image: UploadFile,
+        mask: UploadFile,
+        params: str = Form("{}", description="InpaintRequest fields as json"),
+        response_format: ResponseFormat = Form(ResponseFormat.image),
+        x_socket_id: Optional[str] = Header(None, description=SOCKET_ID_HEADER_HELP),
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        """Same as /api/v1/inpaint, image and mask are uploaded as binary files"""
+        self._check_profile(profile, x_admin_token)
+        req = self._parse_form_params(
+            InpaintRequest, params, session_id=None, session_version=None
+        )
+        self._check_loras(req)
+        image_bytes, mask_bytes = image.file.read(), mask.file.read()
+
+        def run():
+            job = self._submit_job(
+                self._process_inpaint_bytes,
+                image_bytes,
+                mask_bytes,
+                req,
+                response_format,
+                profile,
+                sid=x_socket_id,
+            )
+            return self._wait_job(job)
 
+        return self._coalesce(
+            "inpaint_bytes",
+            profile,
+            run,
+            image_bytes,
+            mask_bytes,
+            *self._inpaint_key_parts(req),
+            response_format.value,
+        )
+
+    def api_submit_inpaint_job(
+        self,
+        req: InpaintRequest,
+        x_socket_id: Optional[str] = Header(None, description=SOCKET_ID_HEADER_HELP),
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ) -> JobInfo:
+        self._check_profile(profile, x_admin_token)
+        self._check_loras(req)
+        job = self._submit_job(self._process_inpaint, req, profile, sid=x_socket_id)
+        return self.job_queue.info(job)
+
+    def api_job_info(self, job_id: str) -> JobInfo:
+        return self.job_queue.info(self._get_job(job_id))
+
+    def api_job_result(self, job_id: str):
+        job = self._get_job(job_id)
+        if not job.done:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Job {job_id} is {job.status.value}",
+                headers={
+                    "Retry-After": str(
+                        math.ceil(self.job_queue.info(job).estimated_wait)
+                    )
+                },
+            )
+        if job.error is not None:
+            raise HTTPException(
+                status_code=vars(job.error).get("status_code", 500),
+                detail=vars(job.error).get("detail", str(job.error)),
+            )
+        return job.result
+
+    def api_cancel_job(self, job_id: str) -> JobInfo:
+        self._get_job(job_id)
+        return self.job_queue.info(self.job_queue.cancel(job_id))
+
+    def _wait_job(self, job):
+        job.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _coalesce(self, endpoint: str, profile: Optional[ProfileMode], fn, *key_parts):
+        """Identical concurrent requests share the response of the first one"""
+        if profile is not None:
+            # profiled requests want their own timings
+            return fn()
+        key = single_flight_key(endpoint, *key_parts)
+        response, shared = self.single_flight.do(key, fn)
+        if not shared:
+            return response
+        self.metrics.coalesced_requests.inc(endpoint=endpoint)
         return Response(
-            content=res_img_bytes,
-            media_type=f"image/{ext}",
-            headers={"X-Seed": str(req.sd_seed)},
+            content=response.body,
+            status_code=response.status_code,
+            headers=dict(response.headers),
         )
 
-    def api_run_plugin_gen_image(self, req: RunPluginRequest):
-        ext = "png"
-        if req.name not in self.plugins:
-            raise HTTPException(status_code=422, detail="Plugin not found")
-        if not self.plugins[req.name].support_gen_image:
+    def _inpaint_key_parts(self, req: InpaintRequest):
+        """Model and the request fields the result depends on, e.g. not the seed
+        picked for sd_seed=-1, so double submits of the web app are coalesced"""
+        model_name = self._model_name(req)
+        erase_model = (
+            model_name in self.model_manager.available_models
+            and self._is_erase_model(model_name)
+        )
+        return model_name, request_fields_json(req, erase_model)
+
+    def _plugin_key_parts(self, req: RunPluginRequest, method: str):
+        plugin = self.plugins[req.name]
+        return req.name, method, getattr(plugin, "model_name", None)
+
+    def _submit_job(self, fn, *args, sid: Optional[str] = None):
+        try:
+            job = self.job_queue.submit(self._run_job, fn, args, sid)
+            job.owner = sid
+            return job
+        except QueueFullError as e:
             raise HTTPException(
-                status_code=422, detail="Plugin does not support output image"
+                status_code=429,
+                detail=f"Too many requests in queue({e.depth}), please retry later",
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+
+    def api_profile_trace(
+        self,
+        name: str,
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        self._check_admin(x_admin_token)
+        if Path(name).name != name or not name.endswith(".json"):
+            raise HTTPException(status_code=400, detail="Invalid trace name")
+        path = self._profile_dir() / name
+        if not path.exists():
+            raise HTTPException(status_code=404, detail=f"Trace {name} not found")
+        return FileResponse(path, media_type="application/json", filename=name)
+
+    def _check_admin(self, admin_token: Optional[str]):
+        if self.config.admin_token is None or not secrets.compare_digest(
+            admin_token or "", self.config.admin_token
+        ):
+            raise HTTPException(status_code=403, detail="Admin token required")
+
+    def _check_loras(self, req: InpaintRequest):
+        if not req.sd_loras:
+            return
+        model_info = self.model_manager.available_models.get(self._model_name(req))
+        if model_info is not None and not model_info.support_lcm_lora:
+            raise HTTPException(
+                status_code=422, detail=f"Model {model_info.name} doesn't support LoRAs"
+            )
+        lora_files = scan_loras()
+        for it in req.sd_loras:
+            if it.name not in lora_files:
+                raise HTTPException(
+                    status_code=422, detail=f"LoRA {it.name} not found"
+                )
+            it._path = str(lora_files[it.name])
+
+    def _check_profile(
+        self, profile: Optional[ProfileMode], admin_token: Optional[str]
+    ):
+        if profile != ProfileMode.trace:
+            return
+        self._check_admin(admin_token)
+        self._profile_dir()
+
+    def _profile_dir(self) -> Path:
+        if self.config.profile_dir is None:
+            raise HTTPException(status_code=422, detail="--profile-dir is not set")
+        return self.config.profile_dir
+
+    @contextlib.contextmanager
+    def _profile_request(self, profile: Optional[ProfileMode]):
+        """Bind a StageTimer to the current thread, and run torch profiler for trace"""
+        timer = StageTimer()
+        if profile != ProfileMode.trace:
+            with timer.bind():
+                yield timer
+            return
+
+        from torch.profiler import ProfilerActivity
+        from torch.profiler import profile as torch_profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        timer.trace_name = f"{uuid.uuid4().hex}.json"
+        with torch_profile(activities=activities, record_shapes=True) as prof:
+            with timer.bind():
+                yield timer
+        profile_dir = self._profile_dir()
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        prof.export_chrome_trace(str(profile_dir / timer.trace_name))
+        logger.info(f"Save torch profiler trace: {profile_dir / timer.trace_name}")
+
+    def _add_profile_headers(
+        self, response: Response, profile: Optional[ProfileMode], timer: StageTimer
+    ) -> Response:
+        if profile is not None:
+            response.headers["Server-Timing"] = timer.server_timing()
+        if timer.trace_name is not None:
+            response.headers["X-Profile-Trace"] = f"/api/v1/profiles/{timer.trace_name}"
+        return response
+
+    def _run_job(self, fn, args, sid: Optional[str]):
+        # without client sid, events are broadcast as before
+        job = current_job()
+        rooms = [sid, job.job_id] if sid is not None else None
+        with self.progress_bus.scope(rooms):
+            return fn(*args)
+
+    def _parse_form_params(self, model_cls, params: str, **fields):
+        try:
+            return model_cls.model_validate({**json.loads(params), **fields})
+        except (ValueError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid params: {e}")
+
+    def _model_lock(self, model_name: Optional[str] = None):
+        # MicroBatcher runs the batched forward in its own thread and WorkerPool dispatches
+        # to worker processes, requests must not hold the lock
+        if isinstance(self.model_manager, WorkerPool):
+            return contextlib.nullcontext()
+        if self.model_manager.is_batching_model(model_name or self.model_manager.name):
+            return contextlib.nullcontext()
+        return self.queue_lock
+
+    def _model_name(self, req: InpaintRequest) -> str:
+        return req.model or self.model_manager.name
+
+    def _is_erase_model(self, model_name: str) -> bool:
+        model_info = self.model_manager.available_models[model_name]
+        return model_info.model_type == ModelType.INPAINT
+
+    def _get_session(self, session_id: str) -> ImageSession:
+        try:
+            return self.session_store.get(session_id)
+        except KeyError:
+            raise HTTPException(
+                status_code=404, detail=f"Image session {session_id} not found"
+            )
+
+    def _get_session_version(self, session: ImageSession, version: Optional[int]):
+        try:
+            return session.get_version(version)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=e.args[0])
+
+    def _load_image(
+        self,
+        image: Optional[str],
+        session_id: Optional[str],
+        session_version: Optional[int],
+    ):
+        """decode base64 image or get the image from image session"""
+        if session_id is not None:
+            session = self._get_session(session_id)
+            version = self._get_session_version(session, session_version)
+            return version.image, version.alpha_channel, session.infos, version.ext
+        if image is None:
+            raise HTTPException(
+                status_code=422, detail="image or session_id is required"
+            )
+        return decode_base64_to_image(image)
+
+    def _load_mask(self, mask: Optional[str], session_id: Optional[str]) -> np.ndarray:
+        if mask is not None:
+            return decode_base64_to_image(mask, gray=True)[0]
+        if session_id is not None:
+            session_mask = self._get_session(session_id).mask
+            if session_mask is not None:
+                return session_mask
+        raise HTTPException(status_code=422, detail="mask is required")
+
+    def _add_session_version(
+        self,
+        session_id: str,
+        rgb_np_img: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        ext: str,
+    ) -> Dict[str, str]:
+        try:
+            version = self.session_store.add_version(
+                session_id, rgb_np_img, alpha_channel, ext
+            )
+        except KeyError:
+            logger.warning(f"Image session {session_id} was evicted, result not saved")
+            return {}
+        return {"X-Session-Version": str(version.version)}
+
+    def _get_job(self, job_id: str):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        return job
+
+    def _process_inpaint(
+        self, req: InpaintRequest, profile: Optional[ProfileMode] = None
+    ) -> Response:
+        with self._profile_request(profile) as timer:
+            with stage("decode"):
+                image, alpha_channel, infos, ext = self._load_image(
+                    req.image, req.session_id, req.session_version
+                )
+                mask = self._load_mask(req.mask, req.session_id)
+            response = self._inpaint(image, alpha_channel, infos, ext, mask, req)
+        return self._add_profile_headers(response, profile, timer)
+
+    def _process_inpaint_bytes(
+        self,
+        image_bytes: bytes,
+        mask_bytes: bytes,
+        req: InpaintRequest,
+        response_format: ResponseFormat,
+        profile: Optional[ProfileMode] = None,
+    ) -> Response:
+        with self._profile_request(profile) as timer:
+            with stage("decode"):
+                image, alpha_channel, infos, ext = decode_bytes_to_image(image_bytes)
+                mask, _, _, _ = decode_bytes_to_image(mask_bytes, gray=True)
+            response = self._inpaint(
+                image, alpha_channel, infos, ext, mask, req, response_format
+            )
+        return self._add_profile_headers(response, profile, timer)
+
+    def _inpaint(
+        self,
+        image: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        infos: Dict,
+        ext: str,
+        mask: np.ndarray,
+        req: InpaintRequest,
+        response_format: ResponseFormat = ResponseFormat.image,
+    ) -> Response:
+        logger.info(f"image ext: {ext}")
+        timer = current_timer() or StageTimer()
+        model_name = self._model_name(req)
+        status = "failed"
+        try:
+            response, status = self._run_inpaint(
+                image, alpha_channel, infos, ext, mask, req, response_format, timer
+            )
+            return response
+        except JobCancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self.metrics.inpaint_requests.inc(model=model_name, status=status)
+            self.metrics.observe_stages(
+                timer, model_name, req.hd_strategy, size_bucket(*image.shape[:2])
             )
-        rgb_np_img, alpha_channel, infos, _ = decode_base64_to_image(req.image)
-        bgr_or_rgba_np_img = self.plugins[req.name].gen_image(rgb_np_img, req)
-        torch_gc()
 
-        if bgr_or_rgba_np_img.shape[2] == 4:
-            rgba_np_img = bgr_or_rgba_np_img
+    def _run_inpaint(
+        self,
+        image: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        infos: Dict,
+        ext: str,
+        mask: np.ndarray,
+        req: InpaintRequest,
+        response_format: ResponseFormat,
+        timer: StageTimer,
+    ):
+        with timer.stage("preprocess"):
+            mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+            if image.shape[:2] != mask.shape[:2]:
+                raise HTTPException(
+                    400,
+                    detail=f"Image size({image.shape[:2]}) and mask size({mask.shape[:2]}) not match.",
+                )
+            model_name = self._model_name(req)
+            if model_name not in self.model_manager.available_models:
+                raise HTTPException(400, detail=f"Model {model_name} not found")
+
+            cache_key, rgb_np_img = None, None
+            erase_model = self._is_erase_model(model_name)
+            # a random seed asks for a new result
+            if self.result_cache.enabled and (erase_model or not req._random_seed):
+                cache_key = result_cache_key(
+                    model_name, image, mask, req, erase_model=erase_model
+                )
+                rgb_np_img = self.result_cache.get(cache_key)
+
+        start = time.time()
+        status = "cache_hit"
+        headers = {}
+        if rgb_np_img is None:
+            cost, decision = None, "admitted"
+            if self.admission.enabled:
+                with timer.stage("admission"):
+                    req, cost, decision = self._admit(mask, req)
+                headers["X-Admission"] = decision
+            try:
+                with self.admission.reserve(cost):
+                    with self._model_lock(model_name), timer.stage("forward"):
+                        rgb_np_img = self.model_manager(image, mask, req)
+                if cost is not None:
+                    self.admission.cost_model.observe(
+                        model_name, cost, timer.durations["forward"]
+                    )
+            finally:
+                # also release memory of cancelled or failed jobs
+                with timer.stage("torch_gc"):
+                    torch_gc()
+            # the key is the requested size, a downscaled result doesn't match it
+            if cache_key is not None and decision == "admitted":
+                self.result_cache.put(cache_key, rgb_np_img)
+            logger.info(f"process time: {(time.time() - start) * 1000:.2f}ms")
+            status = "finished"
         else:
-            rgba_np_img = cv2.cvtColor(bgr_or_rgba_np_img, cv2.COLOR_BGR2RGB)
-            rgba_np_img = concat_alpha_channel(rgba_np_img, alpha_channel)
+            logger.info(f"result cache hit: {(time.time() - start) * 1000:.2f}ms")
+
+        with timer.stage("postprocess"):
+            rgb_np_img = cv2.cvtColor(rgb_np_img.astype(np.uint8), cv2.COLOR_BGR2RGB)
+            rgb_res = concat_alpha_channel(rgb_np_img, alpha_channel)
+
+            headers["X-Seed"] = str(req.sd_seed)
+            if req.session_id is not None:
+                headers.update(
+                    self._add_session_version(
+                        req.session_id, rgb_np_img, alpha_channel, ext
+                    )
+                )
 
+        with timer.stage("emit"):
+            self.progress_bus.emit("diffusion_finish")
+
+        with timer.stage("encode"):
+            response = self._image_response(
+                rgb_res, ext, infos, response_format, headers=headers
+            )
+        return response, status
+
+    def _admit(self, mask: np.ndarray, req: InpaintRequest):
+        model_info = self.model_manager.available_models[self._model_name(req)]
+        try:
+            admitted, cost = self.admission.admit(model_info, mask, req)
+        except AdmissionRejectedError:
+            self.metrics.admission_decisions.inc(decision="rejected")
+            raise
+        decision = "admitted" if admitted is req else "downscaled"
+        self.metrics.admission_decisions.inc(decision=decision)
+        return admitted, cost, decision
+
+    def _image_response(
+        self,
+        np_img: np.ndarray,
+        ext: str,
+        infos: Dict,
+        response_format: ResponseFormat,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        headers = dict(headers or {})
+        if response_format == ResponseFormat.raw:
+            content, shape_headers = numpy_to_raw_bytes(np_img)
+            headers.update(shape_headers)
+            return Response(
+                content=content,
+                media_type="application/octet-stream",
+                headers=headers,
+            )
         return Response(
             content=pil_to_bytes(
-                Image.fromarray(rgba_np_img),
+                Image.fromarray(np_img),
                 ext=ext,
                 quality=self.config.quality,
                 infos=infos,
             ),
             media_type=f"image/{ext}",
+            headers=headers,
         )
 
-    def api_run_plugin_gen_mask(self, req: RunPluginRequest):
-        if req.name not in self.plugins:
+    def api_run_plugin_gen_image(
+        self,
+        req: RunPluginRequest,
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        self._check_plugin(req.name, "gen_image")
+        self._check_profile(profile, x_admin_token)
+
+        def run():
+            with self._profile_request(profile) as timer:
+                with stage("decode"):
+                    rgb_np_img, alpha_channel, infos, _ = self._load_image(
+                        req.image, req.session_id, req.session_version
+                    )
+                response = self._run_plugin_gen_image(
+                    rgb_np_img, alpha_channel, infos, req
+                )
+            return self._add_profile_headers(response, profile, timer)
+
+        return self._coalesce(
+            "run_plugin_gen_image",
+            profile,
+            run,
+            *self._plugin_key_parts(req, "gen_image"),
+            req.model_dump_json(),
+        )
+
+    def api_run_plugin_gen_image_bytes(
+        self,
+        image: UploadFile,
+        params: str = Form(..., description="RunPluginRequest fields as json"),
+        response_format: ResponseFormat = Form(ResponseFormat.image),
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        req = self._parse_form_params(
+            RunPluginRequest, params, session_id=None, session_version=None
+        )
+        self._check_plugin(req.name, "gen_image")
+        self._check_profile(profile, x_admin_token)
+        image_bytes = image.file.read()
+
+        def run():
+            with self._profile_request(profile) as timer:
+                with stage("decode"):
+                    rgb_np_img, alpha_channel, infos, _ = decode_bytes_to_image(
+                        image_bytes
+                    )
+                response = self._run_plugin_gen_image(
+                    rgb_np_img, alpha_channel, infos, req, response_format
+                )
+            return self._add_profile_headers(response, profile, timer)
+
+        return self._coalesce(
+            "run_plugin_gen_image_bytes",
+            profile,
+            run,
+            *self._plugin_key_parts(req, "gen_image"),
+            image_bytes,
+            req.model_dump_json(),
+            response_format.value,
+        )
+
+    def _run_plugin_gen_image(
+        self,
+        rgb_np_img: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        infos: Dict,
+        req: RunPluginRequest,
+        response_format: ResponseFormat = ResponseFormat.image,
+    ) -> Response:
+        with stage("plugin"), self.metrics.plugin_seconds.time(
+            plugin=req.name, method="gen_image"
+        ):
+            bgr_or_rgba_np_img = self.plugins[req.name].gen_image(rgb_np_img, req)
+        with stage("torch_gc"):
+            torch_gc()
+
+        with stage("postprocess"):
+            if bgr_or_rgba_np_img.shape[2] == 4:
+                rgba_np_img = bgr_or_rgba_np_img
+            else:
+                rgba_np_img = cv2.cvtColor(bgr_or_rgba_np_img, cv2.COLOR_BGR2RGB)
+                rgba_np_img = concat_alpha_channel(rgba_np_img, alpha_channel)
+
+            headers = {}
+            if req.session_id is not None:
+                if rgba_np_img.shape[2] == 4:
+                    headers = self._add_session_version(
+                        req.session_id,
+                        rgba_np_img[:, :, :3],
+                        rgba_np_img[:, :, 3],
+                        "png",
+                    )
+                else:
+                    headers = self._add_session_version(
+                        req.session_id, rgba_np_img, None, "png"
+                    )
+
+        with stage("encode"):
+            return self._image_response(
+                rgba_np_img, "png", infos, response_format, headers=headers
+            )
+
+    def api_run_plugin_gen_mask(
+        self,
+        req: RunPluginRequest,
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        self._check_plugin(req.name, "gen_mask")
+        self._check_profile(profile, x_admin_token)
+
+        def run():
+            with self._profile_request(profile) as timer:
+                with stage("decode"):
+                    rgb_np_img, _, _, _ = self._load_image(
+                        req.image, req.session_id, req.session_version
+                    )
+                response = self._run_plugin_gen_mask(rgb_np_img, req)
+            return self._add_profile_headers(response, profile, timer)
+
+        return self._coalesce(
+            "run_plugin_gen_mask",
+            profile,
+            run,
+            *self._plugin_key_parts(req, "gen_mask"),
+            req.model_dump_json(),
+        )
+
+    def api_run_plugin_gen_mask_bytes(
+        self,
+        image: UploadFile,
+        params: str = Form(..., description="RunPluginRequest fields as json"),
+        response_format: ResponseFormat = Form(ResponseFormat.image),
+        profile: Optional[ProfileMode] = Query(None, description=PROFILE_HELP),
+        x_admin_token: Optional[str] = Header(
+            None, description=ADMIN_TOKEN_HEADER_HELP
+        ),
+    ):
+        req = self._parse_form_params(
+            RunPluginRequest, params, session_id=None, session_version=None
+        )
+        self._check_plugin(req.name, "gen_mask")
+        self._check_profile(profile, x_admin_token)
+        image_bytes = image.file.read()
+
+        def run():
+            with self._profile_request(profile) as timer:
+                with stage("decode"):
+                    rgb_np_img, _, _, _ = decode_bytes_to_image(image_bytes)
+                response = self._run_plugin_gen_mask(rgb_np_img, req, response_format)
+            return self._add_profile_headers(response, profile, timer)
+
+        return self._coalesce(
+            "run_plugin_gen_mask_bytes",
+            profile,
+            run,
+            *self._plugin_key_parts(req, "gen_mask"),
+            image_bytes,
+            req.model_dump_json(),
+            response_format.value,
+        )
+
+    def _run_plugin_gen_mask(
+        self,
+        rgb_np_img: np.ndarray,
+        req: RunPluginRequest,
+        response_format: ResponseFormat = ResponseFormat.image,
+    ) -> Response:
+        with stage("plugin"), self.metrics.plugin_seconds.time(
+            plugin=req.name, method="gen_mask"
+        ):
+            bgr_or_gray_mask = self.plugins[req.name].gen_mask(rgb_np_img, req)
+        with stage("torch_gc"):
+            torch_gc()
+        with stage("postprocess"):
+            res_mask = gen_frontend_mask(bgr_or_gray_mask)
+            if req.session_id is not None:
+                self._set_session_mask(req.session_id, res_mask[:, :, 3] > 0)
+        with stage("encode"):
+            if response_format == ResponseFormat.raw:
+                return self._image_response(res_mask, "png", {}, response_format)
+            return Response(
+                content=numpy_to_bytes(res_mask, "png"),
+                media_type="image/png",
+            )
+
+    def _set_session_mask(self, session_id: str, mask: np.ndarray):
+        if mask.dtype == bool:
+            mask = mask.astype(np.uint8) * 255
+        try:
+            self.session_store.set_mask(session_id, mask)
+        except KeyError:
+            logger.warning(f"Image session {session_id} was evicted, mask not saved")
+
+    def _check_plugin(self, name: str, method: str):
+        if name not in self.plugins:
             raise HTTPException(status_code=422, detail="Plugin not found")
-        if not self.plugins[req.name].support_gen_mask:
+        if not getattr(self.plugins[name], f"support_{method}"):
             raise HTTPException(
                 status_code=422, detail="Plugin does not support output image"
             )
-        rgb_np_img, _, _, _ = decode_base64_to_image(req.image)
-        bgr_or_gray_mask = self.plugins[req.name].gen_mask(rgb_np_img, req)
-        torch_gc()
-        res_mask = gen_frontend_mask(bgr_or_gray_mask)
+
+    def api_metrics(self):
         return Response(
-            content=numpy_to_bytes(res_mask, "png"),
-            media_type="image/png",
+            content=self.metrics.render(), media_type="text/plain; version=0.0.4"
         )
 
+    def api_health_live(self) -> WarmupInfo:
+        return self.warmup.info()
+
+    def api_health_ready(self):
+        info = self.warmup.info()
+        if not info.ready:
+            # load balancer should not send traffic to a cold instance
+            return JSONResponse(status_code=503, content=jsonable_encoder(info))
+        return info
+
+    def api_result_cache(self) -> ResultCacheStats:
+        return self.result_cache.stats()
+
+    def api_model_cache(self) -> ModelCacheStats:
+        if isinstance(self.model_manager, WorkerPool):
+            raise HTTPException(
+                404, detail="Model cache stats are not available with model workers"
+            )
+        return self.model_manager.cache_stats()
+
+    def api_workers(self) -> List[WorkerInfo]:
+        if isinstance(self.model_manager, WorkerPool):
+            return self.model_manager.workers_info()
+        return []
+
     def api_samplers(self) -> List[str]:
         return [member.value for member in SDSampler.__members__.values()]
 
+    def api_loras(self) -> List[str]:
+        return list(scan_loras())
+
     def api_adjust_mask(self, req: AdjustMaskRequest):
-        mask, _, _, _ = decode_base64_to_image(req.mask, gray=True)
+        # adjust_mask modifies the mask inplace
+        mask = self._load_mask(req.mask, req.session_id).copy()
         mask = adjust_mask(mask, req.kernel_size, req.operate)
+        if req.session_id is not None:
+            self._set_session_mask(req.session_id, mask[:, :, 3] > 0)
         return Response(content=numpy_to_bytes(mask, "png"), media_type="image/png")
 
     def launch(self):
@@ -412,17 +1363,39 @@ class Api:
         )
 
     def _build_model_manager(self):
-        return ModelManager(
-            name=self.config.model,
-            device=torch.device(self.config.device),
+        kwargs = dict(
             no_half=self.config.no_half,
             low_mem=self.config.low_mem,
+            jit_optimize=self.config.jit_optimize,
             disable_nsfw=self.config.disable_nsfw_checker,
             sd_cpu_textencoder=self.config.cpu_textencoder,
             local_files_only=self.config.local_files_only,
             cpu_offload=self.config.cpu_offload,
             callback=diffuser_callback,
+            batch_size=self.config.batch_size,
+            batch_wait_ms=self.config.batch_wait_ms,
+            model_cache_device_budget=self.config.model_cache_device_budget,
+            model_cache_host_budget=self.config.model_cache_host_budget,
+            lora_cache_size=self.config.lora_cache_size,
         )
+        if self.config.num_workers > 1:
+            devices = self._worker_devices()
+            logger.info(f"Start {len(devices)} model workers: {devices}")
+            return WorkerPool(name=self.config.model, devices=devices, **kwargs)
+        return ModelManager(
+            name=self.config.model, device=torch.device(self.config.device), **kwargs
+        )
+
+    def _worker_devices(self) -> List[str]:
+        if self.config.worker_devices:
+            return [it.strip() for it in self.config.worker_devices.split(",")]
+        device = self.config.device.value
+        if device == "cuda" and torch.cuda.device_count() > 1:
+            return [
+                f"cuda:{i % torch.cuda.device_count()}"
+                for i in range(self.config.num_workers)
+            ]
+        return [device] * self.config.num_workers
 
     def _init_database(self):
         """初始化数据库"""
@@ -11,7 +11,13 @@ from typer_config import use_json_config
 
 from iopaint.const import *
 from iopaint.runtime import setup_model_dir, dump_environment_info, check_device
-from iopaint.schema import InteractiveSegModel, Device, RealESRGANModel, RemoveBGModel
+from iopaint.schema import (
+    InteractiveSegModel,
+    Device,
+    RealESRGANModel,
+    RemoveBGModel,
+    AdmissionPolicy,
+)
 
 typer_app = typer.Typer(pretty_exceptions_show_locals=False, add_completion=False)
 
@@ -132,6 +138,7 @@ def start(
         callback=setup_model_dir,
     ),
     low_mem: bool = Option(False, help=LOW_MEM_HELP),
+    jit_optimize: bool = Option(False, help=JIT_OPTIMIZE_HELP),
     no_half: bool = Option(False, help=NO_HALF_HELP),
     cpu_offload: bool = Option(False, help=CPU_OFFLOAD_HELP),
     disable_nsfw_checker: bool = Option(False, help=DISABLE_NSFW_HELP),
@@ -162,6 +169,33 @@ def start(
     gfpgan_device: Device = Option(Device.cpu),
     enable_restoreformer: bool = Option(False),
     restoreformer_device: Device = Option(Device.cpu),
+    max_queue_size: int = Option(8, help=MAX_QUEUE_SIZE_HELP),
+    batch_size: int = Option(1, help=BATCH_SIZE_HELP),
+    batch_wait_ms: float = Option(5, help=BATCH_WAIT_MS_HELP),
+    num_workers: int = Option(1, help=NUM_WORKERS_HELP),
+    worker_devices: Optional[str] = Option(None, help=WORKER_DEVICES_HELP),
+    result_cache_size: int = Option(256, help=RESULT_CACHE_SIZE_HELP),
+    result_cache_dir: Optional[Path] = Option(
+        None, help=RESULT_CACHE_DIR_HELP, dir_okay=True, file_okay=False
+    ),
+    result_cache_disk_size: int = Option(2048, help=RESULT_CACHE_DISK_SIZE_HELP),
+    session_cache_size: int = Option(1024, help=SESSION_CACHE_SIZE_HELP),
+    session_max_versions: int = Option(8, help=SESSION_MAX_VERSIONS_HELP),
+    preview_interval: int = Option(0, help=PREVIEW_INTERVAL_HELP),
+    admin_token: Optional[str] = Option(None, help=ADMIN_TOKEN_HELP),
+    profile_dir: Optional[Path] = Option(
+        None, help=PROFILE_DIR_HELP, dir_okay=True, file_okay=False
+    ),
+    admission_memory_budget: int = Option(0, help=ADMISSION_MEMORY_BUDGET_HELP),
+    admission_latency_budget: float = Option(0, help=ADMISSION_LATENCY_BUDGET_HELP),
+    admission_policy: AdmissionPolicy = Option(
+        AdmissionPolicy.downscale, help=ADMISSION_POLICY_HELP
+    ),
+    warmup_sizes: Optional[str] = Option(None, help=WARMUP_SIZES_HELP),
+    warmup_hd_strategies: str = Option("Original", help=WARMUP_HD_STRATEGIES_HELP),
+    model_cache_device_budget: int = Option(0, help=MODEL_CACHE_DEVICE_BUDGET_HELP),
+    model_cache_host_budget: int = Option(0, help=MODEL_CACHE_HOST_BUDGET_HELP),
+    lora_cache_size: int = Option(2, help=LORA_CACHE_SIZE_HELP),
 ):
     # 加载环境变量文件
     load_env_file()
@@ -223,6 +257,7 @@ def start(
         model=model,
         no_half=no_half,
         low_mem=low_mem,
+        jit_optimize=jit_optimize,
         cpu_offload=cpu_offload,
         disable_nsfw_checker=disable_nsfw_checker,
         local_files_only=local_files_only,
@@ -246,6 +281,27 @@ def start(
         gfpgan_device=gfpgan_device,
         enable_restoreformer=enable_restoreformer,
         restoreformer_device=restoreformer_device,
+        max_queue_size=max_queue_size,
+        batch_size=batch_size,
+        batch_wait_ms=batch_wait_ms,
+        num_workers=num_workers,
+        worker_devices=worker_devices,
+        result_cache_size=result_cache_size,
+        result_cache_dir=result_cache_dir,
+        result_cache_disk_size=result_cache_disk_size,
+        session_cache_size=session_cache_size,
+        session_max_versions=session_max_versions,
+        preview_interval=preview_interval,
+        admin_token=admin_token,
+        profile_dir=profile_dir,
+        admission_memory_budget=admission_memory_budget,
+        admission_latency_budget=admission_latency_budget,
+        admission_policy=admission_policy,
+        warmup_sizes=warmup_sizes,
+        warmup_hd_strategies=warmup_hd_strategies,
+        model_cache_device_budget=model_cache_device_budget,
+        model_cache_host_budget=model_cache_host_budget,
+        lora_cache_size=lora_cache_size,
     )
     print(api_config.model_dump_json(indent=4))
     api = Api(app, api_config)
@@ -37,6 +37,10 @@ DIFFUSION_MODELS = [
     ANYTEXT_NAME,
 ]
 
+# hd_strategy=TILE runs at most this many tiles at once with models supporting
+# batches, peak memory of a TILE request is about this many tiles
+TILE_BATCH_SIZE = 1
+
 NO_HALF_HELP = """
 Using full precision(fp32) model.
 If your diffusion model generate result is always black or green, use this argument.
@@ -48,6 +52,10 @@ Offloads diffusion model's weight to CPU RAM, significantly reducing vRAM usage.
 
 LOW_MEM_HELP = "Enable attention slicing and vae tiling to save memory."
 
+JIT_OPTIMIZE_HELP = """
+Freeze and optimize TorchScript erase models(lama, anime-lama, migan, manga, ldm) for inference. Frozen models are cached in the jit folder of the model directory, models that fail to optimize run as before.
+"""
+
 DISABLE_NSFW_HELP = """
 Disable NSFW checker for diffusion model.
 """
@@ -133,4 +141,78 @@ GFPGAN_HELP = "Enable GFPGAN face restore. To also enhance background, use with
 RESTOREFORMER_HELP = "Enable RestoreFormer face restore. To also enhance background, use with --enable-realesrgan"
 GIF_HELP = "Enable GIF plugin. Make GIF to compare original and cleaned image"
 
+MAX_QUEUE_SIZE_HELP = """
+Maximum number of inpaint jobs waiting in the queue. Requests beyond this limit are rejected with 429 and a Retry-After header.
+"""
+
+BATCH_SIZE_HELP = """
+Maximum number of concurrent erase model(lama/migan/mat) requests batched into one forward. 1 disables micro-batching.
+"""
+
+BATCH_WAIT_MS_HELP = """
+How long(ms) the micro-batcher waits for more requests before running a batch.
+"""
+
+NUM_WORKERS_HELP = """
+Number of model replicas, each running in its own process. On CPU the available cores are split between the replicas.
+"""
+
+WORKER_DEVICES_HELP = """
+Comma separated devices for model replicas, e.g: cuda:0,cuda:1. By default all replicas use --device, cuda replicas are spread over all GPUs.
+"""
+
+RESULT_CACHE_SIZE_HELP = """
+Memory budget(MB) of the inpaint result cache, identical requests(same image, mask and params) return the cached result. 0 to disable.
+"""
+
+RESULT_CACHE_DIR_HELP = """
+Directory of the on-disk inpaint result cache, entries evicted from memory are kept here. Disabled by default.
+"""
+
+RESULT_CACHE_DISK_SIZE_HELP = "Disk budget(MB) of the inpaint result cache"
+
+SESSION_CACHE_SIZE_HELP = """
+Memory budget(MB) of server side image sessions. Images uploaded to /api/v1/sessions are decoded once and referred by session id. 0 to disable.
+"""
+
+SESSION_MAX_VERSIONS_HELP = "Max number of image versions(inpaint results) kept in an image session"
+
+PREVIEW_INTERVAL_HELP = """
+Send a low resolution preview of diffusion latents every N steps with socket.io diffusion_preview event. The preview is a linear projection of the latents, no VAE decode. 0 to disable.
+"""
+
+ADMIN_TOKEN_HELP = """
+Token for admin only api, e.g. torch profiler trace of a request(?profile=trace), pass it with X-Admin-Token header.
+"""
+
+PROFILE_DIR_HELP = "Directory to save torch profiler traces of requests with ?profile=trace"
+
+ADMISSION_MEMORY_BUDGET_HELP = """
+Estimated peak memory budget(MB) of running inpaint requests, on top of the model weights. Larger requests are downscaled or rejected, requests that don't fit beside the running ones wait. 0 to disable.
+"""
+
+ADMISSION_LATENCY_BUDGET_HELP = """
+Estimated process time budget(seconds) of one inpaint request, larger requests are downscaled or rejected. 0 to disable.
+"""
+
+ADMISSION_POLICY_HELP = "What to do with requests over the admission budgets"
+
+WARMUP_SIZES_HELP = """
+Comma separated image sizes(512 or WIDTHxHEIGHT) to run through the model and plugins at startup, e.g: 512,1024x768. /api/v1/health/ready returns 503 until warm-up finished. Disabled by default.
+"""
+
+WARMUP_HD_STRATEGIES_HELP = "Comma separated hd strategies(Original,Resize,Crop,Tile) to warm up"
+
+MODEL_CACHE_DEVICE_BUDGET_HELP = """
+GPU memory budget(MB) of loaded models. Switching models or requests with another model keep the previous models loaded, least recently used models over the budget are moved to CPU memory. 0 keeps only one model loaded.
+"""
+
+MODEL_CACHE_HOST_BUDGET_HELP = """
+CPU memory budget(MB) of loaded models, least recently used models over the budget are unloaded. Models running on CPU count towards this budget.
+"""
+
+LORA_CACHE_SIZE_HELP = """
+Number of LoRA combinations(sd_loras and sd_lcm_lora of the requests) whose fused weights are kept in CPU memory, switching back to one of them doesn't recompute the weights. 0 disables the cache.
+"""
+
 INBROWSER_HELP = "Automatically launch IOPaint in a new tab on the default browser"
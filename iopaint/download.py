@@ -2,7 +2,7 @@ import glob
 import json
 import os
 from functools import lru_cache
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from iopaint.schema import ModelType, ModelInfo
 from loguru import logger
@@ -16,7 +16,6 @@ from iopaint.const import (
     DIFFUSERS_SDXL_INPAINT_CLASS_NAME,
     ANYTEXT_NAME,
 )
-from iopaint.model.original_sd_configs import get_config_files
 
 
 def cli_download_model(model: str):
@@ -52,6 +51,7 @@ def get_sd_model_type(model_abs_path: str) -> Optional[ModelType]:
     else:
         # load once to check num_in_channels
         from diffusers import StableDiffusionInpaintPipeline
+        from iopaint.model.original_sd_configs import get_config_files
 
         try:
             StableDiffusionInpaintPipeline.from_single_file(
@@ -80,6 +80,7 @@ def get_sdxl_model_type(model_abs_path: str) -> Optional[ModelType]:
     else:
         # load once to check num_in_channels
         from diffusers import StableDiffusionXLInpaintPipeline
+        from iopaint.model.original_sd_configs import get_config_files
 
         try:
             model = StableDiffusionXLInpaintPipeline.from_single_file(
@@ -181,12 +182,12 @@ def scan_single_file_diffusion_models(cache_dir) -> List[ModelInfo]:
 
 def scan_inpaint_models(model_dir: Path) -> List[ModelInfo]:
     res = []
-    from iopaint.model import models
+    from iopaint.model import erase_models
 
     # logger.info(f"Scanning inpaint models in {model_dir}")
 
-    for name, m in models.items():
-        if m.is_erase_model and m.is_downloaded():
+    for name, m in erase_models.items():
+        if m.is_downloaded():
             res.append(
                 ModelInfo(
                     name=name,
@@ -304,6 +305,13 @@ def scan_converted_diffusers_models(cache_dir) -> List[ModelInfo]:
     return available_models
 
 
+def scan_loras() -> Dict[str, Path]:
+    """LoRA name(file name without extension) -> path of the .safetensors files in
+    the lora folder of the model directory"""
+    lora_dir = Path(os.getenv("XDG_CACHE_HOME", DEFAULT_MODEL_DIR)) / "lora"
+    return {it.stem: it for it in sorted(lora_dir.glob("*.safetensors"))}
+
+
 def scan_models() -> List[ModelInfo]:
     model_dir = os.getenv("XDG_CACHE_HOME", DEFAULT_MODEL_DIR)
     available_models = []
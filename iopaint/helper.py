@@ -1,6 +1,7 @@
 import base64
 import imghdr
 import io
+import json
 import os
 import sys
 from typing import List, Optional, Dict, Tuple
@@ -10,7 +11,7 @@ import cv2
 from PIL import Image, ImageOps, PngImagePlugin
 import numpy as np
 import torch
-from iopaint.const import MPS_UNSUPPORT_MODELS
+from iopaint.const import DEFAULT_MODEL_DIR, MPS_UNSUPPORT_MODELS
 from loguru import logger
 from torch.hub import download_url_to_file, get_dir
 import hashlib
@@ -98,13 +99,119 @@ def handle_error(model_path, model_md5, e):
     exit(-1)
 
 
-def load_jit_model(url_or_path, device, model_md5: str):
+# extra file of frozen TorchScript models, identifies the source checkpoint
+JIT_SOURCE_FILE = "iopaint_source.json"
+
+
+def _jit_source(model_path: str, model_md5: Optional[str], device) -> str:
+    stat = os.stat(model_path)
+    return json.dumps(
+        {
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "source_md5": model_md5 or "",
+            "device": torch.device(device).type,
+            "torch": torch.__version__,
+        }
+    )
+
+
+def jit_cache_path(model_path: str, device, model_md5: Optional[str] = None) -> str:
+    """
+    Path of the frozen copy of a TorchScript checkpoint, in the jit folder of the
+    model directory, see safetensors_cache_path. There is one for each checkpoint,
+    device type and torch version.
+    """
+    device = torch.device(device)
+    source = model_md5 or os.path.abspath(model_path)
+    key = hashlib.sha1(
+        f"{source}:{device.type}:{torch.__version__}".encode()
+    ).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    model_dir = os.getenv("XDG_CACHE_HOME", DEFAULT_MODEL_DIR)
+    return os.path.join(model_dir, "jit", f"{stem}-{key}.pt")
+
+
+def load_optimized_jit_model(
+    model_path: str, device, model_md5: Optional[str] = None
+) -> Optional[torch.jit.ScriptModule]:
+    """
+    Freeze a TorchScript model(weights inlined as constants, conv-bn folded) and
+    apply optimize_for_inference. The frozen model is cached in jit_cache_path, it is
+    converted again when the checkpoint changes. optimize_for_inference output can't
+    be serialized, it runs after loading the frozen model.
+
+    The returned model has a ``frozen_bytes`` attribute, the size of its weights.
+
+    Returns:
+        None if freezing failed or the frozen model can't be cached, the plain
+        model should be used
+    """
+    device = torch.device(device)
+    cache_path = jit_cache_path(model_path, device, model_md5)
+    source = _jit_source(model_path, model_md5, device)
+
+    frozen = None
+    if os.path.exists(cache_path):
+        extra_files = {JIT_SOURCE_FILE: ""}
+        try:
+            frozen = torch.jit.load(
+                cache_path, map_location=device, _extra_files=extra_files
+            )
+            if extra_files[JIT_SOURCE_FILE] != source:
+                frozen = None
+        except Exception as e:
+            logger.warning(f"Failed to load {cache_path}: {e}")
+
+    if frozen is None:
+        try:
+            model = torch.jit.load(model_path, map_location="cpu").to(device)
+            frozen = torch.jit.freeze(model.eval())
+        except Exception as e:
+            logger.warning(f"Failed to freeze {model_path}, use the plain model: {e}")
+            return None
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            torch.jit.save(frozen, tmp_path, _extra_files={JIT_SOURCE_FILE: source})
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved frozen model to {cache_path}")
+        except Exception as e:
+            # freezing again on every load would cost more than it saves
+            logger.warning(f"Failed to save {cache_path}, use the plain model: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+    else:
+        logger.info(f"Loaded frozen model from {cache_path}")
+
+    try:
+        model = torch.jit.optimize_for_inference(frozen)
+    except Exception as e:
+        logger.warning(f"optimize_for_inference failed, use the frozen model: {e}")
+        model = frozen
+    # weights are constants of the graph now, not parameters or buffers. ModelCache
+    # accounts the size of the checkpoint instead and can't move the model
+    model.frozen_bytes = os.path.getsize(model_path)
+    return model
+
+
+def load_jit_model(url_or_path, device, model_md5: str, optimize: bool = False):
+    """
+    Args:
+        optimize: freeze and optimize the model for inference, see
+            load_optimized_jit_model
+    """
     if os.path.exists(url_or_path):
         model_path = url_or_path
     else:
         model_path = download_model(url_or_path, model_md5)
 
     logger.info(f"Loading model from: {model_path}")
+    if optimize:
+        model = load_optimized_jit_model(model_path, device, model_md5)
+        if model is not None:
+            return model
     try:
         model = torch.jit.load(model_path, map_location="cpu").to(device)
     except Exception as e:
@@ -113,6 +220,130 @@ def load_jit_model(url_or_path, device, model_md5: str):
     return model
 
 
+def safetensors_cache_path(model_path: str, model_md5: Optional[str] = None) -> str:
+    """
+    Path of the safetensors copy of a checkpoint, in the safetensors folder of the
+    model directory. Checkpoints may live in directories not owned by iopaint, e.g.
+    HuggingFace snapshots, nothing is written next to them.
+    """
+    model_path = os.path.abspath(model_path)
+    key = hashlib.sha1(f"{model_path}:{model_md5 or ''}".encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    model_dir = os.getenv("XDG_CACHE_HOME", DEFAULT_MODEL_DIR)
+    return os.path.join(model_dir, "safetensors", f"{stem}-{key}.safetensors")
+
+
+def _safetensors_metadata(model_path: str, model_md5: Optional[str]) -> Dict:
+    stat = os.stat(model_path)
+    return {
+        "source_size": str(stat.st_size),
+        "source_mtime_ns": str(stat.st_mtime_ns),
+        "source_md5": model_md5 or "",
+    }
+
+
+def _select_state_dict(checkpoint, keys: Optional[List[str]]):
+    for key in keys or []:
+        if key in checkpoint:
+            return checkpoint[key]
+    return checkpoint
+
+
+def convert_to_safetensors(
+    model_path: str, model_md5: Optional[str] = None, keys: Optional[List[str]] = None
+) -> Optional[str]:
+    """
+    Store the state dict of a pickled checkpoint as safetensors(see
+    safetensors_cache_path), the source size/mtime/md5 are kept in the metadata to
+    detect stale copies.
+
+    Returns:
+        path of the safetensors file, None if the checkpoint can't be converted
+    """
+    from safetensors.torch import save_file
+
+    if model_md5:
+        # only verified checkpoints are converted, the copy is trusted afterwards
+        _md5 = md5sum(model_path)
+        if _md5 != model_md5:
+            logger.warning(
+                f"Model md5: {_md5}, expected md5: {model_md5}, "
+                f"{model_path} is not converted to safetensors"
+            )
+            return None
+
+    state_dict = _select_state_dict(
+        torch.load(model_path, map_location="cpu"), keys
+    )
+    if not isinstance(state_dict, dict) or not all(
+        isinstance(v, torch.Tensor) for v in state_dict.values()
+    ):
+        return None
+
+    tensors = {}
+    storages = set()
+    for k, v in state_dict.items():
+        # safetensors doesn't store tensors sharing memory
+        ptr = v.untyped_storage().data_ptr()
+        if ptr in storages:
+            v = v.clone()
+        storages.add(ptr)
+        tensors[k] = v.contiguous()
+
+    cache_path = safetensors_cache_path(model_path, model_md5)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        save_file(
+            tensors, tmp_path, metadata=_safetensors_metadata(model_path, model_md5)
+        )
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to write {cache_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    logger.info(f"Converted {model_path} to {cache_path}")
+    return cache_path
+
+
+def load_state_dict(
+    model_path: str,
+    device="cpu",
+    model_md5: Optional[str] = None,
+    keys: Optional[List[str]] = None,
+) -> Dict[str, torch.Tensor]:
+    """
+    Load the state dict of a pickled checkpoint from its safetensors copy, converted
+    on first use. safetensors files are memory mapped and tensors are loaded to
+    ``device`` one by one, without a full copy of the checkpoint in host memory.
+
+    Args:
+        keys: the state dict is the first of these keys in the checkpoint,
+            e.g. ["params_ema", "params"], or the checkpoint itself
+    """
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+
+    cache_path = safetensors_cache_path(model_path, model_md5)
+    try:
+        with safe_open(cache_path, framework="pt") as f:
+            metadata = f.metadata()
+        if metadata != _safetensors_metadata(model_path, model_md5):
+            cache_path = None
+    except Exception:
+        cache_path = None
+
+    if cache_path is None:
+        cache_path = convert_to_safetensors(model_path, model_md5, keys)
+    if cache_path is not None:
+        try:
+            return load_file(cache_path, device=str(device))
+        except Exception as e:
+            logger.warning(f"Failed to load {cache_path}, fall back to torch.load: {e}")
+    return _select_state_dict(torch.load(model_path, map_location="cpu"), keys)
+
+
 def load_model(model: torch.nn.Module, url_or_path, device, model_md5):
     if os.path.exists(url_or_path):
         model_path = url_or_path
@@ -121,9 +352,10 @@ def load_model(model: torch.nn.Module, url_or_path, device, model_md5):
 
     try:
         logger.info(f"Loading model from: {model_path}")
-        state_dict = torch.load(model_path, map_location="cpu")
-        model.load_state_dict(state_dict, strict=True)
+        # weights are copied from the device tensors of the state dict
         model.to(device)
+        state_dict = load_state_dict(model_path, device, model_md5)
+        model.load_state_dict(state_dict, strict=True)
     except Exception as e:
         handle_error(model_path, model_md5, e)
     model.eval()
@@ -267,6 +499,128 @@ def boxes_from_mask(mask: np.ndarray) -> List[np.ndarray]:
     return boxes
 
 
+def crop_box(box, img_h: int, img_w: int, margin: int) -> List[int]:
+    """
+    Crop around box with margin, shifted inwards at the image border to keep
+    its size
+
+    Args:
+        box: [left,top,right,bottom]
+
+    Returns:
+        [left,top,right,bottom]
+    """
+    box_h = box[3] - box[1]
+    box_w = box[2] - box[0]
+    cx = (box[0] + box[2]) // 2
+    cy = (box[1] + box[3]) // 2
+
+    w = box_w + margin * 2
+    h = box_h + margin * 2
+
+    _l = cx - w // 2
+    _r = cx + w // 2
+    _t = cy - h // 2
+    _b = cy + h // 2
+
+    l = max(_l, 0)
+    r = min(_r, img_w)
+    t = max(_t, 0)
+    b = min(_b, img_h)
+
+    # try to get more context when crop around image edge
+    if _l < 0:
+        r += abs(_l)
+    if _r > img_w:
+        l -= _r - img_w
+    if _t < 0:
+        b += abs(_t)
+    if _b > img_h:
+        t -= _b - img_h
+
+    l = max(l, 0)
+    r = min(r, img_w)
+    t = max(t, 0)
+    b = min(b, img_h)
+    return [l, t, r, b]
+
+
+def merge_crop_boxes(
+    boxes, img_h: int, img_w: int, margin: int, max_size: Optional[int] = None
+) -> List[np.ndarray]:
+    """
+    Merge two boxes when the crop around both is not larger than their two
+    crops, e.g. overlapping crops or nearby small boxes of scattered text
+
+    Args:
+        max_size: crops are not merged beyond this size
+
+    Returns:
+        list of [left,top,right,bottom]
+    """
+
+    def crop_area(box):
+        l, t, r, b = crop_box(box, img_h, img_w, margin)
+        if max_size is not None and max(r - l, b - t) > max_size:
+            return float("inf")
+        return (r - l) * (b - t)
+
+    boxes = list(boxes)
+    areas = [crop_area(it) for it in boxes]
+    merged = True
+    while merged:
+        merged = False
+        i = 0
+        while i < len(boxes):
+            j = i + 1
+            while j < len(boxes):
+                union = np.concatenate(
+                    [
+                        np.minimum(boxes[i][:2], boxes[j][:2]),
+                        np.maximum(boxes[i][2:], boxes[j][2:]),
+                    ]
+                )
+                area = crop_area(union)
+                if area != float("inf") and area <= areas[i] + areas[j]:
+                    boxes[i], areas[i] = union, area
+                    del boxes[j], areas[j]
+                    merged = True
+                    # the grown box may merge with boxes already checked
+                    j = i + 1
+                else:
+                    j += 1
+            i += 1
+    return boxes
+
+
+def _tile_starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    stride = max(tile_size - overlap, 1)
+    # the last tile ends at the image border, all tiles have the same size
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def tile_boxes(
+    height: int, width: int, tile_size: int, overlap: int
+) -> List[List[np.ndarray]]:
+    """
+    Overlapping tiles covering the image, tiles on the image border are shifted
+    inwards so that all tiles have the same size
+
+    Returns:
+        rows of [left,top,right,bottom]
+    """
+    tile_h, tile_w = min(tile_size, height), min(tile_size, width)
+    return [
+        [
+            np.array([left, top, left + tile_w, top + tile_h])
+            for left in _tile_starts(width, tile_size, overlap)
+        ]
+        for top in _tile_starts(height, tile_size, overlap)
+    ]
+
+
 def only_keep_largest_contour(mask: np.ndarray) -> List[np.ndarray]:
     """
     Args:
@@ -312,6 +666,12 @@ def decode_base64_to_image(
     ):
         encoding = encoding.split(";")[1].split(",")[1]
     image_bytes = base64.b64decode(encoding)
+    return decode_bytes_to_image(image_bytes, gray=gray)
+
+
+def decode_bytes_to_image(
+    image_bytes: bytes, gray=False
+) -> Tuple[np.array, Optional[np.array], Dict, str]:
     ext = get_image_ext(image_bytes)
     image = Image.open(io.BytesIO(image_bytes))
 
@@ -348,6 +708,18 @@ def encode_pil_to_base64(image: Image, quality: int, infos: Dict) -> bytes:
     return base64.b64encode(img_bytes)
 
 
+def numpy_to_raw_bytes(np_img: np.ndarray) -> Tuple[bytes, Dict[str, str]]:
+    """Raw uint8 buffer in row-major HWC order and headers describing its shape"""
+    if len(np_img.shape) == 2:
+        np_img = np_img[:, :, np.newaxis]
+    headers = {
+        "X-Width": str(np_img.shape[1]),
+        "X-Height": str(np_img.shape[0]),
+        "X-Channels": str(np_img.shape[2]),
+    }
+    return np.ascontiguousarray(np_img, dtype=np.uint8).tobytes(), headers
+
+
 def concat_alpha_channel(rgb_np_img, alpha_channel) -> np.ndarray:
     if alpha_channel is not None:
         if alpha_channel.shape[:2] != rgb_np_img.shape[:2]:
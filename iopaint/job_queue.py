@@ -0,0 +1,240 @@
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from loguru import logger
+
+from iopaint.schema import JobInfo, JobStatus
+
+
+_local = threading.local()
+
+
+def current_job() -> Optional["Job"]:
+    """Job running in the current thread"""
+    return getattr(_local, "job", None)
+
+
+def raise_if_cancelled():
+    """Called from long running job code, e.g. diffusion step callback"""
+    job = current_job()
+    if job is not None and job.cancel_requested:
+        raise JobCancelledError(job.job_id)
+
+
+class JobCancelledError(Exception):
+    def __init__(self, job_id: str):
+        super().__init__(f"Job {job_id} cancelled")
+        self.status_code = 409
+        self.detail = f"Job {job_id} cancelled"
+
+
+class QueueFullError(Exception):
+    def __init__(self, depth: int, retry_after: float):
+        super().__init__(f"Job queue is full, depth: {depth}")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, fn: Callable, args, kwargs):
+        self.job_id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = JobStatus.pending
+        self.result = None
+        self.error: Optional[Exception] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # socket.io sid of the client that submitted the job
+        self.owner: Optional[str] = None
+        self.cancel_requested = False
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+
+class JobQueue:
+    """
+    In-process FIFO scheduler for model work.
+
+    Jobs are executed by ``num_workers`` daemon threads in submission order. Once
+    ``max_queue_size`` jobs are waiting, ``submit`` raises ``QueueFullError`` with
+    an estimate of how long the caller should wait before retrying.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        num_workers: int = 1,
+        max_finished_jobs: int = 256,
+        finished_job_ttl: float = 600,
+    ):
+        self.max_queue_size = max_queue_size
+        self.num_workers = num_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_job_ttl = finished_job_ttl
+
+        self._pending: Deque[Job] = deque()
+        self._running: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._cond = threading.Condition()
+        # exponential moving average of job process time, in seconds
+        self._avg_process_time: Optional[float] = None
+
+        self._workers: List[threading.Thread] = []
+        for i in range(num_workers):
+            t = threading.Thread(
+                target=self._worker_loop, name=f"iopaint-job-worker-{i}", daemon=True
+            )
+            t.start()
+            self._workers.append(t)
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    @property
+    def avg_process_time(self) -> float:
+        return self._avg_process_time or 1.0
+
+    def estimate_wait(self, position: int) -> float:
+        """Seconds until a job at ``position`` in the pending queue finishes"""
+        rounds = math.ceil((position + 1 + self.in_flight) / self.num_workers)
+        return rounds * self.avg_process_time
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Job:
+        with self._cond:
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(
+                    len(self._pending), self.estimate_wait(len(self._pending))
+                )
+            job = Job(fn, args, kwargs)
+            self._pending.append(job)
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            for job in self._pending:
+                if job.job_id == job_id:
+                    return job
+            if job_id in self._running:
+                return self._running[job_id]
+            return self._finished.get(job_id)
+
+    def active_jobs(self) -> List[Job]:
+        with self._cond:
+            return [*self._pending, *self._running.values()]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Pending jobs are removed from the queue. Running jobs are only flagged, the
+        job code stops at the next ``raise_if_cancelled`` check.
+        """
+        with self._cond:
+            job = self.get(job_id)
+            if job is None or job.done:
+                return job
+            job.cancel_requested = True
+            if job.status == JobStatus.pending:
+                self._pending.remove(job)
+                job.error = JobCancelledError(job.job_id)
+                job.status = JobStatus.cancelled
+                job.finished_at = time.time()
+                job.fn = job.args = job.kwargs = None
+                self._finished[job.job_id] = job
+                job._done.set()
+        logger.info(f"Cancel job {job_id}")
+        return job
+
+    def position(self, job: Job) -> int:
+        with self._cond:
+            try:
+                return self._pending.index(job)
+            except ValueError:
+                return 0
+
+    def info(self, job: Job) -> JobInfo:
+        position = self.position(job) if job.status == JobStatus.pending else 0
+        error = None
+        if job.error is not None:
+            error = f"{type(job.error).__name__}: {job.error}"
+        process_time = None
+        if job.started_at is not None and job.finished_at is not None:
+            process_time = job.finished_at - job.started_at
+        return JobInfo(
+            job_id=job.job_id,
+            status=job.status,
+            queue_position=position,
+            estimated_wait=self.estimate_wait(position) if not job.done else 0,
+            process_time=process_time,
+            error=error,
+        )
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                job.status = JobStatus.running
+                job.started_at = time.time()
+                self._running[job.job_id] = job
+
+            _local.job = job
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.status = JobStatus.finished
+            except JobCancelledError as e:
+                logger.info(f"Job {job.job_id} cancelled")
+                job.error = e
+                job.status = JobStatus.cancelled
+            except Exception as e:
+                logger.exception(f"Job {job.job_id} failed")
+                job.error = e
+                job.status = JobStatus.failed
+            finally:
+                _local.job = None
+                job.finished_at = time.time()
+                job.fn = job.args = job.kwargs = None
+                self._on_finished(job)
+                job._done.set()
+
+    def _on_finished(self, job: Job):
+        with self._cond:
+            self._running.pop(job.job_id, None)
+            self._finished[job.job_id] = job
+
+            process_time = job.finished_at - job.started_at
+            if self._avg_process_time is None:
+                self._avg_process_time = process_time
+            else:
+                self._avg_process_time = (
+                    0.8 * self._avg_process_time + 0.2 * process_time
+                )
+
+            now = time.time()
+            while self._finished:
+                oldest = next(iter(self._finished.values()))
+                if (
+                    len(self._finished) > self.max_finished_jobs
+                    or now - oldest.finished_at > self.finished_job_ttl
+                ):
+                    self._finished.popitem(last=False)
+                else:
+                    break
@@ -0,0 +1,301 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)  # fmt: skip
+
+def size_bucket(height: int, width: int) -> str:
+    """Group images by their long side, keeps label cardinality low"""
+    long_side = max(height, width)
+    for limit in [512, 1024, 2048, 4096]:
+        if long_side <= limit:
+            return f"le{limit}"
+    return "gt4096"
+
+
+def process_rss() -> Optional[float]:
+    """Resident memory in bytes, None without psutil on platforms without procfs"""
+    try:
+        import psutil
+
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def _format_labels(labelnames: Tuple[str, ...], labels: Tuple[str, ...], **extra):
+    items = list(zip(labelnames, labels)) + list(extra.items())
+    if not items:
+        return ""
+    escaped = [
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: List[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}, "
+                f"got {list(labels)}"
+            )
+        values = [labels[it] for it in self.labelnames]
+        return tuple(str(it.value if isinstance(it, Enum) else it) for it in values)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge without labels, the value is read from ``fn`` at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.fn())}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> (bucket counts, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, le=_format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+_local = threading.local()
+
+
+class StageTimer:
+    """
+    Wall and CPU time of the stages of one request. Stages with the same name are
+    summed, e.g. ``pad_forward`` runs once per crop box.
+
+    CPU time is process wide, it includes other threads running at the same time.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.cpu_times: Dict[str, float] = {}
+        # file name of the torch profiler trace of this request
+        self.trace_name: Optional[str] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(
+                name,
+                time.perf_counter() - start,
+                time.process_time() - cpu_start,
+            )
+
+    def add(self, name: str, duration: float, cpu_time: float = 0):
+        self.durations[name] = self.durations.get(name, 0) + duration
+        self.cpu_times[name] = self.cpu_times.get(name, 0) + cpu_time
+
+    @contextlib.contextmanager
+    def bind(self):
+        """Record ``stage()`` calls of the current thread, e.g. from model code"""
+        prev_timer = getattr(_local, "timer", None)
+        _local.timer = self
+        try:
+            yield self
+        finally:
+            _local.timer = prev_timer
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        items = []
+        for name, duration in self.durations.items():
+            cpu_time = self.cpu_times[name] * 1000
+            items.append(
+                f'{name};dur={duration * 1000:.2f};desc="cpu={cpu_time:.2f}ms"'
+            )
+        return ", ".join(items)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return getattr(_local, "timer", None)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a stage into the StageTimer bound to the current thread, if any"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+class Metrics:
+    """Metrics exported by the api server in prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self.inpaint_stage_seconds = self.add(
+            Histogram(
+                "iopaint_inpaint_stage_seconds",
+                "Duration of each stage of an inpaint request",
+                ["stage", "model", "hd_strategy", "size"],
+            )
+        )
+        self.inpaint_requests = self.add(
+            Counter(
+                "iopaint_inpaint_requests_total",
+                "Inpaint requests by result",
+                ["model", "status"],
+            )
+        )
+        self.model_load_seconds = self.add(
+            Histogram(
+                "iopaint_model_load_seconds",
+                "Duration of model load and switch",
+                ["model", "kind"],
+                buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+            )
+        )
+        self.plugin_seconds = self.add(
+            Histogram(
+                "iopaint_plugin_seconds",
+                "Duration of plugin calls",
+                ["plugin", "method"],
+            )
+        )
+        self.admission_decisions = self.add(
+            Counter(
+                "iopaint_admission_decisions_total",
+                "Inpaint requests admitted, downscaled or rejected by cost",
+                ["decision"],
+            )
+        )
+        self.coalesced_requests = self.add(
+            Counter(
+                "iopaint_coalesced_requests_total",
+                "Requests that shared the response of an identical in-flight request",
+                ["endpoint"],
+            )
+        )
+        if process_rss() is not None:
+            self.add(
+                Gauge(
+                    "process_resident_memory_bytes",
+                    "Resident memory size",
+                    process_rss,
+                )
+            )
+
+    def add(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def observe_stages(
+        self, timer: StageTimer, model: str, hd_strategy: str, size: str
+    ):
+        for stage, duration in timer.durations.items():
+            self.inpaint_stage_seconds.observe(
+                duration, stage=stage, model=model, hd_strategy=hd_strategy, size=size
+            )
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
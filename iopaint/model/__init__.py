@@ -1,38 +1,76 @@
-from .anytext.anytext_model import AnyText
-from .controlnet import ControlNet
-from .fcf import FcF
-from .instruct_pix2pix import InstructPix2Pix
-from .kandinsky import Kandinsky22
-from .lama import LaMa, AnimeLaMa
-from .ldm import LDM
-from .manga import Manga
-from .mat import MAT
-from .mi_gan import MIGAN
-from .opencv2 import OpenCV2
-from .paint_by_example import PaintByExample
-from .power_paint.power_paint import PowerPaint
-from .sd import SD15, SD2, Anything4, RealisticVision14, SD
-from .sdxl import SDXL
-from .zits import ZITS
-
-models = {
-    LaMa.name: LaMa,
-    AnimeLaMa.name: AnimeLaMa,
-    LDM.name: LDM,
-    ZITS.name: ZITS,
-    MAT.name: MAT,
-    FcF.name: FcF,
-    OpenCV2.name: OpenCV2,
-    Manga.name: Manga,
-    MIGAN.name: MIGAN,
-    SD15.name: SD15,
-    Anything4.name: Anything4,
-    RealisticVision14.name: RealisticVision14,
-    SD2.name: SD2,
-    PaintByExample.name: PaintByExample,
-    InstructPix2Pix.name: InstructPix2Pix,
-    Kandinsky22.name: Kandinsky22,
-    SDXL.name: SDXL,
-    PowerPaint.name: PowerPaint,
-    AnyText.name: AnyText,
+import importlib
+from typing import Dict, Iterator, Mapping, Tuple
+
+# Model classes are imported on first access, importing iopaint.model doesn't load
+# torch/diffusers/transformers until a model is actually used.
+
+# model name -> (module, class name)
+ERASE_MODELS: Dict[str, Tuple[str, str]] = {
+    "lama": (".lama", "LaMa"),
+    "anime-lama": (".lama", "AnimeLaMa"),
+    "ldm": (".ldm", "LDM"),
+    "zits": (".zits", "ZITS"),
+    "mat": (".mat", "MAT"),
+    "fcf": (".fcf", "FcF"),
+    "cv2": (".opencv2", "OpenCV2"),
+    "manga": (".manga", "Manga"),
+    "migan": (".mi_gan", "MIGAN"),
+}
+DIFFUSION_MODELS: Dict[str, Tuple[str, str]] = {
+    "runwayml/stable-diffusion-inpainting": (".sd", "SD15"),
+    "Sanster/anything-4.0-inpainting": (".sd", "Anything4"),
+    "Sanster/Realistic_Vision_V1.4-inpainting": (".sd", "RealisticVision14"),
+    "stabilityai/stable-diffusion-2-inpainting": (".sd", "SD2"),
+    "Fantasy-Studio/Paint-by-Example": (".paint_by_example", "PaintByExample"),
+    "timbrooks/instruct-pix2pix": (".instruct_pix2pix", "InstructPix2Pix"),
+    "kandinsky-community/kandinsky-2-2-decoder-inpaint": (
+        ".kandinsky",
+        "Kandinsky22",
+    ),
+    "diffusers/stable-diffusion-xl-1.0-inpainting-0.1": (".sdxl", "SDXL"),
+    "Sanster/PowerPaint-V1-stable-diffusion-inpainting": (
+        ".power_paint.power_paint",
+        "PowerPaint",
+    ),
+    "Sanster/AnyText": (".anytext.anytext_model", "AnyText"),
+}
+
+# class name -> module, for `from iopaint.model import LaMa`
+_CLASS_MODULES: Dict[str, str] = {
+    class_name: module
+    for module, class_name in [*ERASE_MODELS.values(), *DIFFUSION_MODELS.values()]
 }
+_CLASS_MODULES.update({"ControlNet": ".controlnet", "SD": ".sd"})
+
+
+def _import_class(module: str, class_name: str):
+    return getattr(importlib.import_module(module, __name__), class_name)
+
+
+class _LazyModels(Mapping):
+    """model name -> model class, the class is imported on first access"""
+
+    def __init__(self, registry: Dict[str, Tuple[str, str]]):
+        self._registry = registry
+
+    def __getitem__(self, name: str):
+        return _import_class(*self._registry[name])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._registry)
+
+    def __len__(self) -> int:
+        return len(self._registry)
+
+    def __contains__(self, name) -> bool:
+        return name in self._registry
+
+
+models = _LazyModels({**ERASE_MODELS, **DIFFUSION_MODELS})
+erase_models = _LazyModels(ERASE_MODELS)
+
+
+def __getattr__(name: str):
+    if name in _CLASS_MODULES:
+        return _import_class(_CLASS_MODULES[name], name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
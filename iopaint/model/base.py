@@ -1,20 +1,28 @@
 import abc
-from typing import Optional
+from typing import Dict, List, Optional
 
 import cv2
 import torch
 import numpy as np
 from loguru import logger
 
+from iopaint.const import TILE_BATCH_SIZE
 from iopaint.helper import (
     boxes_from_mask,
+    ceil_modulo,
+    crop_box,
+    merge_crop_boxes,
     resize_max_size,
     pad_img_to_modulo,
     switch_mps_device,
+    tile_boxes,
 )
+from iopaint.metrics import stage
 from iopaint.schema import InpaintRequest, HDStrategy, SDSampler
+from .components import component_key
 from .helper.g_diffuser_bot import expand_image
-from .utils import get_scheduler
+from .helper.prompt_cache import prompt_embeds_cache
+from .utils import scheduler_cache
 
 
 class InpaintModel:
@@ -23,6 +31,12 @@ class InpaintModel:
     pad_mod = 8
     pad_to_square = False
     is_erase_model = False
+    # forward result does not depend on request config, so concurrent requests can be batched
+    supports_batch = False
+    # crops of HDStrategy.CROP are padded to a multiple of crop_bucket_mod and run
+    # through forward_batch, at most crop_batch_size at once
+    crop_bucket_mod = 64
+    crop_batch_size = 8
 
     def __init__(self, device, **kwargs):
         """
@@ -32,6 +46,7 @@ class InpaintModel:
         """
         device = switch_mps_device(self.name, device)
         self.device = device
+        self.batcher = kwargs.get("batcher", None)
         self.init_model(device, **kwargs)
 
     @abc.abstractmethod
@@ -51,23 +66,72 @@ class InpaintModel:
         """
         ...
 
+    def forward_batch(self, images, masks, config: InpaintRequest):
+        """All images in the batch have same size
+        images: list of [H, W, C] RGB
+        masks: list of [H, W, 1] 255 为 masks 区域
+        return: list of BGR IMAGE
+        """
+        return [self.forward(image, mask, config) for image, mask in zip(images, masks)]
+
     @staticmethod
     def download(): ...
 
-    def _pad_forward(self, image, mask, config: InpaintRequest):
-        origin_height, origin_width = image.shape[:2]
-        pad_image = pad_img_to_modulo(
-            image, mod=self.pad_mod, square=self.pad_to_square, min_size=self.min_size
+    def _pad(self, img):
+        return pad_img_to_modulo(
+            img,
+            mod=self.pad_mod,
+            square=self.pad_to_square,
+            min_size=self.min_size,
         )
-        pad_mask = pad_img_to_modulo(
-            mask, mod=self.pad_mod, square=self.pad_to_square, min_size=self.min_size
-        )
-
-        # logger.info(f"final forward pad size: {pad_image.shape}")
 
-        image, mask = self.forward_pre_process(image, mask, config)
-
-        result = self.forward(pad_image, pad_mask, config)
+    def _pad_forward(self, image, mask, config: InpaintRequest):
+        with stage("pad_forward"):
+            pad_image = self._pad(image)
+            pad_mask = self._pad(mask)
+
+            # logger.info(f"final forward pad size: {pad_image.shape}")
+
+            image, mask = self.forward_pre_process(image, mask, config)
+
+            if self.batcher is not None and self.supports_batch:
+                result = self.batcher.forward(self, pad_image, pad_mask, config)
+            else:
+                with stage("model_forward"):
+                    result = self.forward(pad_image, pad_mask, config)
+            return self._unpad_result(result, image, mask, config)
+
+    def _pad_forward_batch(self, images, masks, config: InpaintRequest):
+        """_pad_forward of several images, padded to the same bucket size and run as
+        one batched forward"""
+        with stage("pad_forward"):
+            pad_images = [self._pad(it) for it in images]
+            pad_masks = [self._pad(it) for it in masks]
+            inputs = [
+                self.forward_pre_process(image, mask, config)
+                for image, mask in zip(images, masks)
+            ]
+
+            if self.batcher is not None:
+                results = self.batcher.forward_many(self, pad_images, pad_masks, config)
+            else:
+                # multiples of pad_mod stay multiples(and square) when padded to the
+                # bucket size
+                pad_images = [
+                    pad_img_to_modulo(it, mod=self.crop_bucket_mod) for it in pad_images
+                ]
+                pad_masks = [
+                    pad_img_to_modulo(it, mod=self.crop_bucket_mod) for it in pad_masks
+                ]
+                with stage("model_forward"):
+                    results = self.forward_batch(pad_images, pad_masks, config)
+            return [
+                self._unpad_result(result, image, mask, config)
+                for result, (image, mask) in zip(results, inputs)
+            ]
+
+    def _unpad_result(self, result, image, mask, config: InpaintRequest):
+        origin_height, origin_width = image.shape[:2]
         result = result[0:origin_height, 0:origin_width, :]
 
         result, image, mask = self.forward_post_process(result, image, mask, config)
@@ -95,17 +159,31 @@ class InpaintModel:
         if config.hd_strategy == HDStrategy.CROP:
             if max(image.shape) > config.hd_strategy_crop_trigger_size:
                 logger.info("Run crop strategy")
-                boxes = boxes_from_mask(mask)
-                crop_result = []
-                for box in boxes:
-                    crop_image, crop_box = self._run_box(image, mask, box, config)
-                    crop_result.append((crop_image, crop_box))
-
-                inpaint_result = image[:, :, ::-1]
+                # crops larger than the trigger size gain nothing over no crop
+                boxes = self._merge_boxes(
+                    image,
+                    mask,
+                    boxes_from_mask(mask),
+                    config,
+                    max_size=config.hd_strategy_crop_trigger_size,
+                )
+                if self.supports_batch:
+                    crop_result = self._run_boxes(image, mask, boxes, config)
+                else:
+                    crop_result = [
+                        self._run_box(image, mask, box, config) for box in boxes
+                    ]
+
+                inpaint_result = image[:, :, ::-1].copy()
                 for crop_image, crop_box in crop_result:
                     x1, y1, x2, y2 = crop_box
                     inpaint_result[y1:y2, x1:x2, :] = crop_image
 
+        elif config.hd_strategy == HDStrategy.TILE:
+            if max(image.shape[:2]) > config.hd_strategy_tile_size:
+                logger.info("Run tile strategy")
+                inpaint_result = self._run_tiles(image, mask, config)
+
         elif config.hd_strategy == HDStrategy.RESIZE:
             if max(image.shape) > config.hd_strategy_resize_limit:
                 origin_size = image.shape[:2]
@@ -150,40 +228,7 @@ class InpaintModel:
         Returns:
             BGR IMAGE, (l, r, r, b)
         """
-        box_h = box[3] - box[1]
-        box_w = box[2] - box[0]
-        cx = (box[0] + box[2]) // 2
-        cy = (box[1] + box[3]) // 2
-        img_h, img_w = image.shape[:2]
-
-        w = box_w + config.hd_strategy_crop_margin * 2
-        h = box_h + config.hd_strategy_crop_margin * 2
-
-        _l = cx - w // 2
-        _r = cx + w // 2
-        _t = cy - h // 2
-        _b = cy + h // 2
-
-        l = max(_l, 0)
-        r = min(_r, img_w)
-        t = max(_t, 0)
-        b = min(_b, img_h)
-
-        # try to get more context when crop around image edge
-        if _l < 0:
-            r += abs(_l)
-        if _r > img_w:
-            l -= _r - img_w
-        if _t < 0:
-            b += abs(_t)
-        if _b > img_h:
-            t -= _b - img_h
-
-        l = max(l, 0)
-        r = min(r, img_w)
-        t = max(t, 0)
-        b = min(b, img_h)
-
+        l, t, r, b = crop_box(box, *image.shape[:2], config.hd_strategy_crop_margin)
         crop_img = image[t:b, l:r, :]
         crop_mask = mask[t:b, l:r]
 
@@ -269,12 +314,205 @@ class InpaintModel:
 
         return self._pad_forward(crop_img, crop_mask, config), [l, t, r, b]
 
+    def _run_boxes(self, image, mask, boxes, config: InpaintRequest):
+        """
+        _run_box of all boxes, crops falling into the same bucket size are run as
+        one batched forward
+
+        Returns:
+            list of (BGR IMAGE, [l, t, r, b]) in the order of boxes
+        """
+        crops = [self._crop_box(image, mask, box, config) for box in boxes]
+        buckets: Dict[tuple, List[int]] = {}
+        for i, (crop_img, _, _) in enumerate(crops):
+            height, width = self._pad(crop_img).shape[:2]
+            key = (
+                ceil_modulo(height, self.crop_bucket_mod),
+                ceil_modulo(width, self.crop_bucket_mod),
+            )
+            buckets.setdefault(key, []).append(i)
+
+        results = [None] * len(crops)
+        for key, indices in buckets.items():
+            for start in range(0, len(indices), self.crop_batch_size):
+                chunk = indices[start : start + self.crop_batch_size]
+                if len(chunk) == 1:
+                    crop_img, crop_mask, _ = crops[chunk[0]]
+                    outputs = [self._pad_forward(crop_img, crop_mask, config)]
+                else:
+                    logger.info(
+                        f"Run batched crops, batch size: {len(chunk)}, bucket: {key[0]}x{key[1]}"
+                    )
+                    outputs = self._pad_forward_batch(
+                        [crops[i][0] for i in chunk],
+                        [crops[i][1] for i in chunk],
+                        config,
+                    )
+                for i, output in zip(chunk, outputs):
+                    results[i] = (output, crops[i][2])
+        return results
+
+    def _run_tiles(self, image, mask, config: InpaintRequest):
+        """
+        Inpaint the overlapping tiles touching the mask, tiles have the same size and
+        run at most TILE_BATCH_SIZE at once. Where inpainted tiles overlap, their
+        outputs are averaged with weights feathered towards the tile edges.
+
+        Returns:
+            BGR IMAGE
+        """
+        rows = tile_boxes(
+            *image.shape[:2],
+            config.hd_strategy_tile_size,
+            config.hd_strategy_tile_overlap,
+        )
+        tiles = []
+        for i, row in enumerate(rows):
+            for j, (l, t, r, b) in enumerate(row):
+                if (mask[t:b, l:r] > 127).any():
+                    tiles.append((i, j))
+        logger.info(f"Inpaint {len(tiles)}/{len(rows) * len(rows[0])} tiles")
+
+        inpainted = set(tiles)
+        height, width = image.shape[:2]
+        weighted_sum = np.zeros((height, width, 3), dtype=np.float32)
+        weight_sum = np.zeros((height, width, 1), dtype=np.float32)
+        batch_size = TILE_BATCH_SIZE if self.supports_batch else 1
+        for start in range(0, len(tiles), batch_size):
+            chunk = tiles[start : start + batch_size]
+            crops = [self._crop_tile(image, mask, rows[i][j]) for i, j in chunk]
+            if len(chunk) == 1:
+                outputs = [self._pad_forward(*crops[0], config)]
+            else:
+                outputs = self._pad_forward_batch(
+                    [it[0] for it in crops], [it[1] for it in crops], config
+                )
+            for (i, j), output in zip(chunk, outputs):
+                l, t, r, b = rows[i][j]
+                weight = self._tile_weight(rows, inpainted, i, j)
+                weighted_sum[t:b, l:r] += output * weight
+                weight_sum[t:b, l:r] += weight
+
+        inpaint_result = image[:, :, ::-1].copy()
+        covered = weight_sum[:, :, 0] > 0
+        inpaint_result[covered] = np.rint(
+            weighted_sum[covered] / weight_sum[covered]
+        ).astype(np.uint8)
+        return inpaint_result
+
+    @staticmethod
+    def _tile_weight(rows, tiles, i: int, j: int):
+        """
+        Weight of tile (i, j) ramping down to 0 towards each edge overlapping another
+        inpainted tile, weights of the overlapping tiles sum up to 1 at every pixel
+        """
+        l, t, r, b = rows[i][j]
+        weight_y = np.ones(b - t, dtype=np.float32)
+        weight_x = np.ones(r - l, dtype=np.float32)
+
+        def ramp(overlap):
+            return np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+
+        if (i - 1, j) in tiles and rows[i - 1][j][3] > t:
+            overlap = rows[i - 1][j][3] - t
+            weight_y[:overlap] *= ramp(overlap)
+        if (i + 1, j) in tiles and rows[i + 1][j][1] < b:
+            overlap = b - rows[i + 1][j][1]
+            weight_y[-overlap:] *= ramp(overlap)[::-1]
+        if (i, j - 1) in tiles and rows[i][j - 1][2] > l:
+            overlap = rows[i][j - 1][2] - l
+            weight_x[:overlap] *= ramp(overlap)
+        if (i, j + 1) in tiles and rows[i][j + 1][0] < r:
+            overlap = r - rows[i][j + 1][0]
+            weight_x[-overlap:] *= ramp(overlap)[::-1]
+        return (weight_y[:, None] * weight_x[None, :])[:, :, None]
+
+    @staticmethod
+    def _crop_tile(image, mask, box):
+        l, t, r, b = box
+        return image[t:b, l:r, :], mask[t:b, l:r]
+
+    def _merge_boxes(
+        self,
+        image,
+        mask,
+        boxes,
+        config: InpaintRequest,
+        max_size: Optional[int] = None,
+    ):
+        """
+        merge_crop_boxes of the boxes of the image
+
+        Args:
+            max_size: crops are not merged beyond this size, e.g. the size crops
+                are resized to
+
+        Returns:
+            list of [left,top,right,bottom]
+        """
+        return merge_crop_boxes(
+            boxes, *image.shape[:2], config.hd_strategy_crop_margin, max_size
+        )
+
 
 class DiffusionInpaintModel(InpaintModel):
     def __init__(self, device, **kwargs):
         self.model_info = kwargs["model_info"]
         self.model_id_or_path = self.model_info.path
+        # ComponentRegistry shared by the pipelines of the ModelManager
+        self.components = kwargs.get("components", None)
+        self.component_keys: Dict[str, str] = {}
+        self._components_finalizer = None
+        self._scheduler_config: Optional[Dict] = None
         super().__init__(device, **kwargs)
+        # interactive editing keeps the same prompt for many strokes
+        prompt_embeds_cache.wrap(self.model)
+
+    def acquire_components(
+        self, names: List[str], torch_dtype, device, tag: str = "", **extra_keys
+    ) -> Dict:
+        """
+        Components of the pipeline already loaded by other pipelines, to pass to
+        from_pretrained/from_single_file instead of loading them again.
+
+        Args:
+            names: pipeline components in model_id_or_path, e.g. vae, unet
+            tag: tag of the components patched by this pipeline(unet)
+            extra_keys: component name -> key of components loaded from elsewhere
+        """
+        if self.components is None:
+            return {}
+        self.component_keys = {
+            name: component_key(
+                self.model_id_or_path,
+                name,
+                torch_dtype,
+                device,
+                tag=tag if name == "unet" else "",
+            )
+            for name in names
+        }
+        self.component_keys.update(extra_keys)
+        return self.components.lookup(self.component_keys)
+
+    def lookup_component(self, name: str, key: str):
+        """Loaded component to replace the pipeline's ``name`` component, or None"""
+        if self.components is None:
+            return None
+        self.component_keys[name] = key
+        return self.components.lookup({name: key}).get(name)
+
+    def register_components(self):
+        """Register the components of the loaded pipeline for other pipelines, again
+        after a component of the pipeline was replaced"""
+        if self.components is None:
+            return
+        if self._components_finalizer is not None:
+            # release the components registered before
+            self._components_finalizer()
+        self._components_finalizer = self.components.register(
+            self, self.component_keys, self.model
+        )
 
     @torch.no_grad()
     def __call__(self, image, mask, config: InpaintRequest):
@@ -287,7 +525,7 @@ class DiffusionInpaintModel(InpaintModel):
         if config.use_croper:
             crop_img, crop_mask, (l, t, r, b) = self._apply_cropper(image, mask, config)
             crop_image = self._scaled_pad_forward(crop_img, crop_mask, config)
-            inpaint_result = image[:, :, ::-1]
+            inpaint_result = image[:, :, ::-1].copy()
             inpaint_result[t:b, l:r, :] = crop_image
         elif config.use_extender:
             inpaint_result = self._do_outpainting(image, config)
@@ -379,14 +617,19 @@ class DiffusionInpaintModel(InpaintModel):
 
         return inpaint_result
 
+    def get_scheduler(self, sd_sampler: SDSampler):
+        if self._scheduler_config is None:
+            # config of the scheduler the pipeline was loaded with, schedulers are
+            # always built from it so they don't depend on the previous sampler
+            self._scheduler_config = dict(self.model.scheduler.config)
+        return scheduler_cache.get(sd_sampler, self._scheduler_config)
+
     def set_scheduler(self, config: InpaintRequest):
-        scheduler_config = self.model.scheduler.config
         sd_sampler = config.sd_sampler
         if config.sd_lcm_lora and self.model_info.support_lcm_lora:
             sd_sampler = SDSampler.lcm
             logger.info(f"LCM Lora enabled, use {sd_sampler} sampler")
-        scheduler = get_scheduler(sd_sampler, scheduler_config)
-        self.model.scheduler = scheduler
+        self.model.scheduler = self.get_scheduler(sd_sampler)
 
     def forward_pre_process(self, image, mask, config):
         if config.sd_mask_blur != 0:
@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+import torch
+from loguru import logger
+
+from iopaint.helper import ceil_modulo, pad_img_to_modulo
+
+
+class _BatchItem:
+    def __init__(self, model, image, mask, config, key):
+        self.model = model
+        self.image = image
+        self.mask = mask
+        self.config = config
+        self.key = key
+        self.created_at = time.time()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collect concurrent ``InpaintModel.forward`` calls into one batched forward.
+
+    Requests arriving within ``max_wait_ms`` of each other are grouped when they
+    target the same model and their padded images fall into the same size bucket.
+    Every image in a group is padded to the bucket size (a multiple of
+    ``bucket_mod``) with ``pad_img_to_modulo``, run through ``forward_batch`` and
+    cropped back to its own size.
+
+    A request alone in its group runs with the model's own padding, same as
+    without the batcher.
+
+    Only models with ``supports_batch = True`` use the batcher. Their forward must
+    not depend on per-request config, the config of the first request is used for
+    the whole batch.
+
+    Batched requests don't hold the api queue lock, the model is pinned in
+    ``model_cache`` while a batch runs so that a model switch can't demote it.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 5,
+        bucket_mod: int = 64,
+        model_cache=None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bucket_mod = bucket_mod
+        self.model_cache = model_cache
+
+        self._pending: List[_BatchItem] = []
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._worker_loop, name="iopaint-micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def bucket_size(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        return (
+            ceil_modulo(height, self.bucket_mod),
+            ceil_modulo(width, self.bucket_mod),
+        )
+
+    def forward(self, model, image, mask, config) -> np.ndarray:
+        """
+        image: [H, W, C] RGB, already padded by the model
+        mask: [H, W, 1]
+        return: BGR IMAGE
+        """
+        return self.forward_many(model, [image], [mask], config)[0]
+
+    def forward_many(self, model, images, masks, config) -> List[np.ndarray]:
+        """Queue several images of one request(e.g. crops) at once, they are batched
+        with each other and with concurrent requests"""
+        items = [
+            _BatchItem(model, image, mask, config, (id(model), self.bucket_size(image)))
+            for image, mask in zip(images, masks)
+        ]
+        with self._cond:
+            self._pending.extend(items)
+            self._cond.notify_all()
+        for item in items:
+            item.done.wait()
+        for item in items:
+            if item.error is not None:
+                raise item.error
+        return [item.result for item in items]
+
+    def _take_batch(self) -> List[_BatchItem]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            key = self._pending[0].key
+            deadline = self._pending[0].created_at + self.max_wait
+            while True:
+                same_key = [it for it in self._pending if it.key == key]
+                remaining = deadline - time.time()
+                if len(same_key) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = same_key[: self.max_batch_size]
+            self._pending = [it for it in self._pending if it not in batch]
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                results = self._run_batch(batch)
+                for item, result in zip(batch, results):
+                    item.result = result
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            finally:
+                for item in batch:
+                    item.done.set()
+
+    def _run_batch(self, batch: List[_BatchItem]) -> List[np.ndarray]:
+        model = batch[0].model
+        name = self.model_cache.pin(model) if self.model_cache is not None else None
+        try:
+            return self._forward_batch(model, batch)
+        finally:
+            if name is not None:
+                self.model_cache.release(name)
+
+    @torch.inference_mode()
+    def _forward_batch(self, model, batch: List[_BatchItem]) -> List[np.ndarray]:
+        if len(batch) == 1:
+            item = batch[0]
+            return [model.forward(item.image, item.mask, item.config)]
+
+        bucket_h, bucket_w = batch[0].key[1]
+
+        images = [pad_img_to_modulo(it.image, mod=self.bucket_mod) for it in batch]
+        masks = [pad_img_to_modulo(it.mask, mod=self.bucket_mod) for it in batch]
+
+        logger.info(
+            f"Run batched forward, batch size: {len(batch)}, bucket: {bucket_h}x{bucket_w}"
+        )
+        results = model.forward_batch(images, masks, batch[0].config)
+        return [
+            result[: item.image.shape[0], : item.image.shape[1], :]
+            for item, result in zip(batch, results)
+        ]
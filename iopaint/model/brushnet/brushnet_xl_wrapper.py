@@ -5,6 +5,7 @@ from loguru import logger
 import numpy as np
 
 from ..base import DiffusionInpaintModel
+from ..components import component_key
 from ..helper.cpu_text_encoder import CPUTextEncoderWrapper
 from ..original_sd_configs import get_config_files
 from ..utils import (
@@ -60,10 +61,24 @@ class BrushNetXLWrapper(DiffusionInpaintModel):
                 )
             )
 
-        logger.info(f"Loading BrushNet model from {self.brushnet_xl_method}")
-        brushnet = BrushNetModel.from_pretrained(
-            self.brushnet_xl_method, torch_dtype=torch_dtype
+        # the unet is patched with the brushnet forward, it's not shared with SD
+        shared_names = ["vae", "unet"]
+        if not kwargs["sd_cpu_textencoder"]:
+            shared_names += ["text_encoder", "text_encoder_2"]
+        shared = self.acquire_components(
+            shared_names,
+            torch_dtype,
+            device,
+            tag="brushnet",
+            brushnet=component_key(self.brushnet_xl_method, "", torch_dtype, device),
         )
+        brushnet = shared.pop("brushnet", None)
+        if brushnet is None:
+            logger.info(f"Loading BrushNet model from {self.brushnet_xl_method}")
+            brushnet = BrushNetModel.from_pretrained(
+                self.brushnet_xl_method, torch_dtype=torch_dtype
+            )
+        model_kwargs = {**shared, **model_kwargs}
 
         if self.model_info.is_single_file_diffusers:
             if self.model_info.model_type == ModelType.DIFFUSERS_SD:
@@ -136,15 +151,22 @@ class BrushNetXLWrapper(DiffusionInpaintModel):
                 up_block.forward = UpBlock2D_forward.__get__(
                     up_block, up_block.__class__
                 )
+        self.register_components()
 
     def switch_brushnet_method(self, new_method: str):
         self.brushnet_method = new_method
-        brushnet_xl = BrushNetModel.from_pretrained(
-            new_method,
-            local_files_only=self.local_files_only,
-            torch_dtype=self.torch_dtype,
-        ).to(self.model.device)
+        brushnet_xl = self.lookup_component(
+            "brushnet",
+            component_key(new_method, "", self.torch_dtype, self.device),
+        )
+        if brushnet_xl is None:
+            brushnet_xl = BrushNetModel.from_pretrained(
+                new_method,
+                local_files_only=self.local_files_only,
+                torch_dtype=self.torch_dtype,
+            ).to(self.model.device)
         self.model.brushnet = brushnet_xl
+        self.register_components()
 
     def forward(self, image, mask, config: InpaintRequest):
         """Input image and output image have same size
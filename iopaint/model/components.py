@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+import weakref
+from typing import Dict, List
+
+import torch
+from loguru import logger
+
+from iopaint.schema import SharedComponentInfo
+
+# weight files of a diffusers component folder, in the order diffusers loads them
+# with variant="fp16"
+WEIGHT_NAMES = [
+    "diffusion_pytorch_model.fp16.safetensors",
+    "diffusion_pytorch_model.safetensors",
+    "model.fp16.safetensors",
+    "model.safetensors",
+    "diffusion_pytorch_model.fp16.bin",
+    "diffusion_pytorch_model.bin",
+    "pytorch_model.fp16.bin",
+    "pytorch_model.bin",
+]
+
+
+def _file_fingerprint(path: str) -> str:
+    real_path = os.path.realpath(path)
+    # files in the huggingface cache are symlinks to blobs named by their hash
+    if os.path.basename(os.path.dirname(real_path)) == "blobs":
+        return os.path.basename(real_path)
+    stat = os.stat(real_path)
+    return hashlib.blake2b(
+        f"{real_path}:{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=20
+    ).hexdigest()
+
+
+def weights_fingerprint(path: str, subfolder: str) -> str:
+    """
+    Identify the weights of a pipeline component without reading them: the blob hash
+    of huggingface cache files, path/size/mtime of local files.
+
+    Args:
+        path: huggingface repo id, diffusers folder or single file checkpoint
+        subfolder: component folder, e.g. vae, text_encoder
+    """
+    if os.path.isfile(path):
+        # single file checkpoints contain all the components
+        return f"{_file_fingerprint(path)}/{subfolder}"
+
+    from huggingface_hub import try_to_load_from_cache
+
+    for name in WEIGHT_NAMES:
+        filename = f"{subfolder}/{name}" if subfolder else name
+        if os.path.isdir(path):
+            candidate = os.path.join(path, filename)
+            if not os.path.isfile(candidate):
+                continue
+        else:
+            candidate = try_to_load_from_cache(path, filename)
+            if not isinstance(candidate, str):
+                continue
+        return _file_fingerprint(candidate)
+    # not downloaded yet
+    return f"{path}/{subfolder}"
+
+
+def component_key(
+    path: str,
+    subfolder: str,
+    torch_dtype: torch.dtype,
+    device,
+    tag: str = "",
+) -> str:
+    """
+    Args:
+        tag: components patched by a pipeline(e.g. the unet of BrushNet) are only
+            shared between pipelines with the same tag
+    """
+    fingerprint = weights_fingerprint(path, subfolder)
+    return f"{fingerprint}|{subfolder}|{torch_dtype}|{device}|{tag}"
+
+
+class _Component:
+    def __init__(self, name: str, module: torch.nn.Module):
+        self.name = name
+        self.module = module
+        self.refs = 0
+
+
+class ComponentRegistry:
+    """
+    Diffusion pipeline components(vae, text encoders, unet, controlnet...) shared by
+    the loaded pipelines. Pipelines look up components with the same weights, dtype
+    and device before loading them from disk, and register the components they
+    use. A component is released when the last pipeline using it is garbage
+    collected.
+    """
+
+    def __init__(self):
+        # finalizers may run from the garbage collector while the lock is held
+        self._lock = threading.RLock()
+        self._components: Dict[str, _Component] = {}
+
+    def __len__(self) -> int:
+        return len(self._components)
+
+    def lookup(self, keys: Dict[str, str]) -> Dict[str, torch.nn.Module]:
+        """
+        Args:
+            keys: component name -> key
+
+        Returns:
+            component name -> module, for the components already loaded
+        """
+        with self._lock:
+            res = {
+                name: self._components[key].module
+                for name, key in keys.items()
+                if key in self._components
+            }
+        if res:
+            logger.info(f"Reuse loaded components: {list(res)}")
+        return res
+
+    def register(self, owner, keys: Dict[str, str], pipe) -> weakref.finalize:
+        """
+        Count ``owner`` as a user of the pipe's components until it is collected.
+        Call the returned finalizer to release them earlier.
+        """
+        registered = []
+        with self._lock:
+            for name, key in keys.items():
+                module = getattr(pipe, name, None)
+                if not isinstance(module, torch.nn.Module):
+                    continue
+                component = self._components.get(key)
+                if component is None:
+                    component = _Component(name, module)
+                    self._components[key] = component
+                elif component.module is not module:
+                    # loaded its own copy, the registered one is kept
+                    continue
+                component.refs += 1
+                registered.append(key)
+        return weakref.finalize(owner, self._release, registered)
+
+    def stats(self) -> List[SharedComponentInfo]:
+        with self._lock:
+            return [
+                SharedComponentInfo(
+                    name=it.name,
+                    key=key,
+                    refs=it.refs,
+                    bytes=sum(
+                        p.numel() * p.element_size() for p in it.module.parameters()
+                    ),
+                )
+                for key, it in self._components.items()
+            ]
+
+    def _release(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                component = self._components.get(key)
+                if component is None:
+                    continue
+                component.refs -= 1
+                if component.refs <= 0:
+                    del self._components[key]
@@ -6,6 +6,7 @@ from loguru import logger
 from iopaint.schema import InpaintRequest, ModelType
 
 from .base import DiffusionInpaintModel
+from .components import component_key
 from .helper.controlnet_preprocess import (
     make_canny_control_image,
     make_openpose_control_image,
@@ -15,7 +16,6 @@ from .helper.controlnet_preprocess import (
 from .helper.cpu_text_encoder import CPUTextEncoderWrapper
 from .original_sd_configs import get_config_files
 from .utils import (
-    get_scheduler,
     handle_from_pretrained_exceptions,
     get_torch_dtype,
     enable_low_mem,
@@ -92,11 +92,25 @@ class ControlNet(DiffusionInpaintModel):
 
             original_config_file_name = "xl"
 
-        controlnet = ControlNetModel.from_pretrained(
-            pretrained_model_name_or_path=controlnet_method,
-            local_files_only=model_kwargs["local_files_only"],
-            torch_dtype=self.torch_dtype,
+        shared_names = ["vae", "unet"]
+        if not kwargs["sd_cpu_textencoder"]:
+            shared_names.append("text_encoder")
+            if original_config_file_name == "xl":
+                shared_names.append("text_encoder_2")
+        shared = self.acquire_components(
+            shared_names,
+            torch_dtype,
+            device,
+            controlnet=component_key(controlnet_method, "", torch_dtype, device),
         )
+        controlnet = shared.pop("controlnet", None)
+        if controlnet is None:
+            controlnet = ControlNetModel.from_pretrained(
+                pretrained_model_name_or_path=controlnet_method,
+                local_files_only=model_kwargs["local_files_only"],
+                torch_dtype=self.torch_dtype,
+            )
+        model_kwargs = {**shared, **model_kwargs}
         if model_info.is_single_file_diffusers:
             if self.model_info.model_type == ModelType.DIFFUSERS_SD:
                 model_kwargs["num_in_channels"] = 4
@@ -133,17 +147,24 @@ class ControlNet(DiffusionInpaintModel):
                 self.model.text_encoder = CPUTextEncoderWrapper(
                     self.model.text_encoder, torch_dtype
                 )
+        self.register_components()
 
         self.callback = kwargs.pop("callback", None)
 
     def switch_controlnet_method(self, new_method: str):
         self.controlnet_method = new_method
-        controlnet = ControlNetModel.from_pretrained(
-            new_method,
-            local_files_only=self.local_files_only,
-            torch_dtype=self.torch_dtype,
-        ).to(self.model.device)
+        controlnet = self.lookup_component(
+            "controlnet",
+            component_key(new_method, "", self.torch_dtype, self.device),
+        )
+        if controlnet is None:
+            controlnet = ControlNetModel.from_pretrained(
+                new_method,
+                local_files_only=self.local_files_only,
+                torch_dtype=self.torch_dtype,
+            ).to(self.model.device)
         self.model.controlnet = controlnet
+        self.register_components()
 
     def _get_control_image(self, image, mask):
         if "canny" in self.controlnet_method:
@@ -164,9 +185,7 @@ class ControlNet(DiffusionInpaintModel):
         mask: [H, W, 1] 255 means area to repaint
         return: BGR IMAGE
         """
-        scheduler_config = self.model.scheduler.config
-        scheduler = get_scheduler(config.sd_sampler, scheduler_config)
-        self.model.scheduler = scheduler
+        self.model.scheduler = self.get_scheduler(config.sd_sampler)
 
         img_h, img_w = image.shape[:2]
         control_image = self._get_control_image(image, mask)
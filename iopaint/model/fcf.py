@@ -1674,9 +1674,11 @@ class FcF(InpaintModel):
         if image.shape[0] == 512 and image.shape[1] == 512:
             return self._pad_forward(image, mask, config)
 
-        boxes = boxes_from_mask(mask)
-        crop_result = []
         config.hd_strategy_crop_margin = 128
+        boxes = self._merge_boxes(
+            image, mask, boxes_from_mask(mask), config, max_size=512
+        )
+        crop_result = []
         for box in boxes:
             crop_image, crop_mask, crop_box = self._crop_box(image, mask, box, config)
             origin_size = crop_image.shape[:2]
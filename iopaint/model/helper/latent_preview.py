@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from iopaint.helper import pil_to_bytes
+
+# Linear approximation of the VAE decoder: each latent channel's contribution to
+# R, G and B. Values from https://discuss.huggingface.co/t/decoding-latents-to-rgb-without-upscaling/23204
+SD_LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+SD_LATENT_RGB_BIAS = [0.0, 0.0, 0.0]
+
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+
+def is_sdxl_pipeline(pipe) -> bool:
+    return getattr(pipe, "text_encoder_2", None) is not None
+
+
+@torch.no_grad()
+def latents_to_rgb(latents: torch.Tensor, sdxl: bool = False) -> np.ndarray:
+    """
+    Cheap preview of diffusion latents without running the VAE decoder.
+
+    Args:
+        latents: [B, 4, H/8, W/8], only the first image is used
+
+    Returns:
+        [H/8, W/8, 3] RGB uint8
+    """
+    if sdxl:
+        factors, bias = SDXL_LATENT_RGB_FACTORS, SDXL_LATENT_RGB_BIAS
+    else:
+        factors, bias = SD_LATENT_RGB_FACTORS, SD_LATENT_RGB_BIAS
+    latent = latents[0, :4].float()
+    factors = torch.tensor(factors, device=latent.device)
+    bias = torch.tensor(bias, device=latent.device)
+    rgb = torch.einsum("chw,cr->hwr", latent, factors) + bias
+    rgb = ((rgb + 1) / 2).clamp(0, 1) * 255
+    return rgb.byte().cpu().numpy()
+
+
+def latents_to_preview(latents: torch.Tensor, sdxl: bool = False) -> bytes:
+    """jpeg encoded latents preview"""
+    rgb = latents_to_rgb(latents, sdxl)
+    return pil_to_bytes(Image.fromarray(rgb), ext="jpeg", quality=80)
@@ -0,0 +1,135 @@
+import functools
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+# pipeline methods encoding prompts, _encode_prompt is PowerPaint's promptA/promptB
+# mixing by the task fitting degree
+ENCODE_PROMPT_METHODS = ["encode_prompt", "_encode_prompt"]
+TEXT_ENCODER_NAMES = ["text_encoder", "text_encoder_2", "text_encoder_brushnet"]
+
+
+def _normalize(value):
+    if isinstance(value, torch.Tensor):
+        # embeddings passed by the caller, nothing to cache
+        raise TypeError("tensor argument")
+    if isinstance(value, torch.device):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(it) for it in value)
+    hash(value)
+    return value
+
+
+def _clone(value):
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_clone(it) for it in value)
+    return value
+
+
+def _lora_state(encoder: torch.nn.Module):
+    # LoRA layers of the text encoder can be enabled, disabled, fused or reweighted
+    # between requests, e.g. LCM LoRA
+    for it in encoder.modules():
+        if hasattr(it, "disable_adapters") and hasattr(it, "scaling"):
+            return (
+                tuple(it.active_adapters),
+                it.disable_adapters,
+                tuple(it.merged_adapters),
+                tuple(sorted(it.scaling.items())),
+            )
+    return None
+
+
+class PromptEmbedsCache:
+    """
+    LRU cache of the prompt embeddings computed by diffusion pipelines, keyed by
+    the encode_prompt arguments(prompt, negative prompt, guidance, lora scale...)
+    and the identity, dtype and LoRA state of the pipeline's text encoders.
+
+    Pipelines sharing text encoders(see ComponentRegistry) share the cached
+    embeddings. Callers get copies, cached tensors are never modified.
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict" = OrderedDict()
+        self._tokens = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def wrap(self, pipe):
+        """Cache the embeddings computed by the pipeline's encode_prompt methods"""
+        pipe_ref = weakref.ref(pipe)
+        for name in ENCODE_PROMPT_METHODS:
+            method = getattr(pipe, name, None)
+            func = getattr(method, "__func__", None)
+            if func is None or getattr(method, "cached_prompt_embeds", False):
+                continue
+            setattr(pipe, name, self._cached(pipe_ref, name, func))
+
+    def invalidate(self, encoder: torch.nn.Module):
+        """Called after the weights of ``encoder`` changed, its embeddings are not
+        used anymore"""
+        with self._lock:
+            self._tokens[encoder] = next(self._counter)
+
+    def _cached(self, pipe_ref, name: str, func):
+        @functools.wraps(func)
+        def encode_prompt(*args, **kwargs):
+            pipe = pipe_ref()
+            key = self._key(pipe, name, args, kwargs)
+            if key is None:
+                return func(pipe, *args, **kwargs)
+            with self._lock:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+            if value is None:
+                value = func(pipe, *args, **kwargs)
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = _clone(value)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+                return value
+            return _clone(value)
+
+        encode_prompt.cached_prompt_embeds = True
+        return encode_prompt
+
+    def _key(self, pipe, name: str, args, kwargs) -> Optional[tuple]:
+        try:
+            arguments = (
+                _normalize(args),
+                tuple(sorted((k, _normalize(v)) for k, v in kwargs.items())),
+            )
+        except TypeError:
+            return None
+        encoders = []
+        for it in TEXT_ENCODER_NAMES:
+            encoder = getattr(pipe, it, None)
+            if not isinstance(encoder, torch.nn.Module):
+                continue
+            with self._lock:
+                if encoder not in self._tokens:
+                    self._tokens[encoder] = next(self._counter)
+                token = self._tokens[encoder]
+            dtype = str(getattr(encoder, "dtype", None))
+            encoders.append((it, token, dtype, _lora_state(encoder)))
+        return name, tuple(encoders), arguments
+
+
+prompt_embeds_cache = PromptEmbedsCache()
@@ -241,20 +241,23 @@ class LDM(InpaintModel):
 
     def __init__(self, device, fp16: bool = True, **kwargs):
         self.fp16 = fp16
-        super().__init__(device)
+        super().__init__(device, **kwargs)
         self.device = device
 
     def init_model(self, device, **kwargs):
+        half = self.fp16 and "cuda" in str(device)
+        # weights of frozen models are constants, they are not converted by half()
+        optimize = kwargs.get("jit_optimize", False) and not half
         self.diffusion_model = load_jit_model(
-            LDM_DIFFUSION_MODEL_URL, device, LDM_DIFFUSION_MODEL_MD5
+            LDM_DIFFUSION_MODEL_URL, device, LDM_DIFFUSION_MODEL_MD5, optimize
         )
         self.cond_stage_model_decode = load_jit_model(
-            LDM_DECODE_MODEL_URL, device, LDM_DECODE_MODEL_MD5
+            LDM_DECODE_MODEL_URL, device, LDM_DECODE_MODEL_MD5, optimize
         )
         self.cond_stage_model_encode = load_jit_model(
-            LDM_ENCODE_MODEL_URL, device, LDM_ENCODE_MODEL_MD5
+            LDM_ENCODE_MODEL_URL, device, LDM_ENCODE_MODEL_MD5, optimize
         )
-        if self.fp16 and "cuda" in str(device):
+        if half:
             self.diffusion_model = self.diffusion_model.half()
             self.cond_stage_model_decode = self.cond_stage_model_decode.half()
             self.cond_stage_model_encode = self.cond_stage_model_encode.half()
@@ -0,0 +1,204 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import torch
+from loguru import logger
+
+from iopaint.model.helper.prompt_cache import prompt_embeds_cache
+
+# pipeline components LoRAs are loaded into by diffusers' load_lora_weights
+LORA_COMPONENTS = ["unet", "text_encoder", "text_encoder_2"]
+
+# (path or repo id, weight file name, scale)
+Lora = Tuple[str, Optional[str], float]
+
+
+def lora_adapter_name(path: str, weight_name: Optional[str] = None) -> str:
+    digest = hashlib.blake2b(f"{path}/{weight_name}".encode(), digest_size=6)
+    return f"lora_{digest.hexdigest()}"
+
+
+def _lora_modules(pipe) -> Dict[str, torch.nn.Module]:
+    modules = {}
+    for component in LORA_COMPONENTS:
+        module = getattr(pipe, component, None)
+        if isinstance(module, torch.nn.Module):
+            modules[component] = module
+    return modules
+
+
+def _lora_layers(module: torch.nn.Module) -> Dict[str, torch.nn.Module]:
+    from peft.tuners.lora import LoraLayer
+
+    return {
+        name: it for name, it in module.named_modules() if isinstance(it, LoraLayer)
+    }
+
+
+def _delete_adapter(module: torch.nn.Module, name: str):
+    for layer in _lora_layers(module).values():
+        layer.delete_adapter(name)
+    getattr(module, "peft_config", {}).pop(name, None)
+
+
+class _LoraState:
+    """LoRAs of one pipeline component and the weights fused into its layers"""
+
+    def __init__(self):
+        # adapter name -> (path, weight name), least recently used first
+        self.adapters: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+        # host copies of the original weights of the layers ever fused
+        self.base: Dict[str, torch.Tensor] = {}
+        # ((adapter name, scale), ...) -> host copies of the fused weights
+        self.variants: "OrderedDict[tuple, Dict[str, torch.Tensor]]" = OrderedDict()
+        # None: unknown, the adapters were reloaded
+        self.current: Optional[tuple] = ()
+        self.fused_layers: Set[str] = set()
+
+
+class LoraManager:
+    """
+    Keeps up to ``max_loras`` LoRAs loaded in each diffusion pipeline and applies
+    the combination(adapters and scales) of every request.
+
+    The combination is fused into the weights of the layers it touches, the
+    unet runs without the adapter overhead. Fused weights of the last
+    ``max_variants`` combinations are kept in host memory, switching back to one
+    of them is a copy instead of summing the LoRA deltas again.
+
+    The state is tracked per LoRA target component(unet, text encoders), pipelines
+    sharing some of them(see ComponentRegistry) share their state. With
+    ``fuse=False``(e.g. cpu offload, weights are not on the module) the
+    adapters are applied by peft at runtime instead.
+    """
+
+    def __init__(self, max_loras: int = 8, max_variants: int = 2, fuse: bool = True):
+        self.max_loras = max_loras
+        self.max_variants = max_variants
+        self.fuse = fuse
+        self._lock = threading.Lock()
+        self._states = weakref.WeakKeyDictionary()
+
+    def current(self, pipe) -> Optional[tuple]:
+        """Combination applied to the pipeline, None if its components differ"""
+        currents = {
+            self._states[it].current if it in self._states else ()
+            for it in _lora_modules(pipe).values()
+        }
+        return currents.pop() if len(currents) == 1 else None
+
+    def apply(self, pipe, loras: List[Lora], local_files_only: bool = False):
+        with self._lock:
+            modules = _lora_modules(pipe)
+            states = {
+                component: self._states.setdefault(module, _LoraState())
+                for component, module in modules.items()
+            }
+            target = {}
+            for path, weight_name, scale in loras:
+                if scale == 0:
+                    continue
+                name = lora_adapter_name(path, weight_name)
+                target[name] = target.get(name, 0) + scale
+                if any(name not in it.adapters for it in states.values()):
+                    # load_lora_weights loads into all the components and fails on
+                    # the ones a pipeline sharing them already loaded it into
+                    for component, module in modules.items():
+                        if name in states[component].adapters:
+                            _delete_adapter(module, name)
+                            states[component].current = None
+                    logger.info(f"Load LoRA {path}")
+                    pipe.load_lora_weights(
+                        path,
+                        weight_name=weight_name,
+                        adapter_name=name,
+                        local_files_only=local_files_only,
+                    )
+                for state in states.values():
+                    state.adapters[name] = (path, weight_name)
+                    state.adapters.move_to_end(name)
+            target = tuple(sorted(target.items()))
+            for component, module in modules.items():
+                self._evict(module, states[component], target)
+
+            if all(it.current == target for it in states.values()):
+                return
+            if self.fuse:
+                for component, module in modules.items():
+                    if states[component].current != target:
+                        self._fuse(component, module, states[component], target)
+            elif target:
+                pipe.set_adapters(
+                    [name for name, _ in target],
+                    adapter_weights=[scale for _, scale in target],
+                )
+                pipe.enable_lora()
+            else:
+                pipe.disable_lora()
+            for state in states.values():
+                state.current = target
+
+    def _evict(self, module: torch.nn.Module, state: _LoraState, target: tuple):
+        names = {name for name, _ in target}
+        for name in list(state.adapters):
+            if len(state.adapters) <= self.max_loras:
+                break
+            if name in names:
+                continue
+            logger.info(f"Unload LoRA {state.adapters.pop(name)[0]}")
+            _delete_adapter(module, name)
+            for key in [it for it in state.variants if name in dict(it)]:
+                del state.variants[key]
+
+    @torch.no_grad()
+    def _fuse(
+        self, component: str, module: torch.nn.Module, state: _LoraState, target: tuple
+    ):
+        layers = _lora_layers(module)
+        for layer in layers.values():
+            # the fused weights replace the adapters
+            layer.enable_adapters(False)
+        target_layers = {
+            name
+            for name, layer in layers.items()
+            if any(adapter in layer.lora_A for adapter, _ in target)
+        }
+
+        changed = state.fused_layers | target_layers
+        for name in state.fused_layers - target_layers:
+            self._weight(layers[name]).copy_(state.base[name])
+
+        variant = state.variants.get(target)
+        if variant is not None:
+            state.variants.move_to_end(target)
+            for name, weight in variant.items():
+                self._weight(layers[name]).copy_(weight)
+        elif target:
+            variant = {}
+            for name in target_layers:
+                layer = layers[name]
+                weight = self._weight(layer)
+                if name not in state.base:
+                    state.base[name] = weight.to("cpu", copy=True)
+                fused = state.base[name].to(weight.device, torch.float32, copy=True)
+                for adapter, scale in target:
+                    if adapter in layer.lora_A:
+                        delta = layer.get_delta_weight(adapter)
+                        fused += delta.to(torch.float32) * scale
+                weight.copy_(fused)
+                variant[name] = weight.to("cpu", copy=True)
+            if self.max_variants > 0:
+                state.variants[target] = variant
+                while len(state.variants) > self.max_variants:
+                    state.variants.popitem(last=False)
+        state.fused_layers = target_layers
+
+        if component != "unet" and changed:
+            prompt_embeds_cache.invalidate(module)
+
+    @staticmethod
+    def _weight(layer) -> torch.Tensor:
+        return layer.get_base_layer().weight.data
@@ -35,11 +35,12 @@ class Manga(InpaintModel):
     is_erase_model = True
 
     def init_model(self, device, **kwargs):
+        optimize = kwargs.get("jit_optimize", False)
         self.inpaintor_model = load_jit_model(
-            MANGA_INPAINTOR_MODEL_URL, device, MANGA_INPAINTOR_MODEL_MD5
+            MANGA_INPAINTOR_MODEL_URL, device, MANGA_INPAINTOR_MODEL_MD5, optimize
         )
         self.line_model = load_jit_model(
-            MANGA_LINE_MODEL_URL, device, MANGA_LINE_MODEL_MD5
+            MANGA_LINE_MODEL_URL, device, MANGA_LINE_MODEL_MD5, optimize
         )
         self.seed = 42
 
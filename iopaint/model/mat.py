@@ -1881,6 +1881,7 @@ class MAT(InpaintModel):
     pad_mod = 512
     pad_to_square = True
     is_erase_model = True
+    supports_batch = True
 
     def init_model(self, device, **kwargs):
         seed = 240  # pick up a random number
@@ -1919,20 +1920,29 @@ class MAT(InpaintModel):
         return: BGR IMAGE
         """
 
-        image = norm_img(image)  # [0, 1]
-        image = image * 2 - 1  # [0, 1] -> [-1, 1]
+        return self.forward_batch([image], [mask], config)[0]
 
-        mask = (mask > 127) * 255
-        mask = 255 - mask
-        mask = norm_img(mask)
+    def forward_batch(self, images, masks, config: InpaintRequest):
+        """All images in the batch have same size
+        images: list of [H, W, C] RGB
+        masks: list of [H, W] mask area == 255
+        return: list of BGR IMAGE
+        """
+        image = np.stack([norm_img(it) for it in images])  # [0, 1]
+        image = image * 2 - 1  # [0, 1] -> [-1, 1]
+        mask = np.stack([norm_img(255 - (it > 127) * 255) for it in masks])
 
-        image = (
-            torch.from_numpy(image).unsqueeze(0).to(self.torch_dtype).to(self.device)
-        )
-        mask = torch.from_numpy(mask).unsqueeze(0).to(self.torch_dtype).to(self.device)
+        image = torch.from_numpy(image).to(self.torch_dtype).to(self.device)
+        mask = torch.from_numpy(mask).to(self.torch_dtype).to(self.device)
+        batch_size = image.shape[0]
 
         output = self.model(
-            image, mask, self.z, self.label, truncation_psi=1, noise_mode="none"
+            image,
+            mask,
+            self.z.expand(batch_size, -1),
+            self.label.expand(batch_size, -1),
+            truncation_psi=1,
+            noise_mode="none",
         )
         output = (
             (output.permute(0, 2, 3, 1) * 127.5 + 127.5)
@@ -1940,6 +1950,5 @@ class MAT(InpaintModel):
             .clamp(0, 255)
             .to(torch.uint8)
         )
-        output = output[0].cpu().numpy()
-        cur_res = cv2.cvtColor(output, cv2.COLOR_RGB2BGR)
-        return cur_res
+        output = output.cpu().numpy()
+        return [cv2.cvtColor(it, cv2.COLOR_RGB2BGR) for it in output]
@@ -1,6 +1,7 @@
 import os
 
 import cv2
+import numpy as np
 import torch
 
 from iopaint.helper import (
@@ -27,9 +28,15 @@ class MIGAN(InpaintModel):
     pad_mod = 512
     pad_to_square = True
     is_erase_model = True
+    supports_batch = True
 
     def init_model(self, device, **kwargs):
-        self.model = load_jit_model(MIGAN_MODEL_URL, device, MIGAN_MODEL_MD5).eval()
+        self.model = load_jit_model(
+            MIGAN_MODEL_URL,
+            device,
+            MIGAN_MODEL_MD5,
+            optimize=kwargs.get("jit_optimize", False),
+        ).eval()
 
     @staticmethod
     def download():
@@ -49,16 +56,28 @@ class MIGAN(InpaintModel):
         if image.shape[0] == 512 and image.shape[1] == 512:
             return self._pad_forward(image, mask, config)
 
-        boxes = boxes_from_mask(mask)
-        crop_result = []
         config.hd_strategy_crop_margin = 128
-        for box in boxes:
-            crop_image, crop_mask, crop_box = self._crop_box(image, mask, box, config)
-            origin_size = crop_image.shape[:2]
-            resize_image = resize_max_size(crop_image, size_limit=512)
-            resize_mask = resize_max_size(crop_mask, size_limit=512)
-            inpaint_result = self._pad_forward(resize_image, resize_mask, config)
+        boxes = self._merge_boxes(
+            image, mask, boxes_from_mask(mask), config, max_size=512
+        )
+        crops = [self._crop_box(image, mask, box, config) for box in boxes]
+        # crops are resized and padded to 512x512, they run as batched forwards
+        resize_images = [resize_max_size(it[0], size_limit=512) for it in crops]
+        resize_masks = [resize_max_size(it[1], size_limit=512) for it in crops]
+        inpaint_results = []
+        for start in range(0, len(crops), self.crop_batch_size):
+            end = start + self.crop_batch_size
+            inpaint_results.extend(
+                self._pad_forward_batch(
+                    resize_images[start:end], resize_masks[start:end], config
+                )
+            )
 
+        crop_result = []
+        for (crop_image, crop_mask, crop_box), inpaint_result in zip(
+            crops, inpaint_results
+        ):
+            origin_size = crop_image.shape[:2]
             # only paste masked area result
             inpaint_result = cv2.resize(
                 inpaint_result,
@@ -87,13 +106,20 @@ class MIGAN(InpaintModel):
         return: BGR IMAGE
         """
 
-        image = norm_img(image)  # [0, 1]
+        return self.forward_batch([image], [mask], config)[0]
+
+    def forward_batch(self, images, masks, config: InpaintRequest):
+        """All images in the batch have same size
+        images: list of [H, W, C] RGB
+        masks: list of [H, W] mask area == 255
+        return: list of BGR IMAGE
+        """
+        image = np.stack([norm_img(it) for it in images])  # [0, 1]
         image = image * 2 - 1  # [0, 1] -> [-1, 1]
-        mask = (mask > 120) * 255
-        mask = norm_img(mask)
+        mask = np.stack([norm_img((it > 120) * 255) for it in masks])
 
-        image = torch.from_numpy(image).unsqueeze(0).to(self.device)
-        mask = torch.from_numpy(mask).unsqueeze(0).to(self.device)
+        image = torch.from_numpy(image).to(self.device)
+        mask = torch.from_numpy(mask).to(self.device)
 
         erased_img = image * (1 - mask)
         input_image = torch.cat([0.5 - mask, erased_img], dim=1)
@@ -105,6 +131,5 @@ class MIGAN(InpaintModel):
             .clamp(0, 255)
             .to(torch.uint8)
         )
-        output = output[0].cpu().numpy()
-        cur_res = cv2.cvtColor(output, cv2.COLOR_RGB2BGR)
-        return cur_res
+        output = output.cpu().numpy()
+        return [cv2.cvtColor(it, cv2.COLOR_RGB2BGR) for it in output]
@@ -20,6 +20,9 @@ class PaintByExample(DiffusionInpaintModel):
 
         use_gpu, torch_dtype = get_torch_dtype(device, kwargs.get("no_half", False))
         model_kwargs = {
+            **self.acquire_components(
+                ["vae", "unet", "image_encoder"], torch_dtype, device
+            ),
             "local_files_only": is_local_files_only(**kwargs),
         }
 
@@ -40,6 +43,7 @@ class PaintByExample(DiffusionInpaintModel):
             self.model.enable_sequential_cpu_offload(gpu_id=0)
         else:
             self.model = self.model.to(device)
+        self.register_components()
 
     def forward(self, image, mask, config: InpaintRequest):
         """Input image and output image have same size
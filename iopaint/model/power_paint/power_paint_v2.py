@@ -9,6 +9,7 @@ from transformers import CLIPTextModel, CLIPTokenizer
 import numpy as np
 
 from ..base import DiffusionInpaintModel
+from ..components import component_key
 from ..helper.cpu_text_encoder import CPUTextEncoderWrapper
 from ..utils import (
     get_torch_dtype,
@@ -52,21 +53,46 @@ class PowerPaintV2(DiffusionInpaintModel):
                 )
             )
 
-        text_encoder_brushnet = CLIPTextModel.from_pretrained(
-            self.hf_model_id,
-            subfolder="text_encoder_brushnet",
-            variant="fp16",
-            torch_dtype=torch_dtype,
-            local_files_only=model_kwargs["local_files_only"],
+        # the unet is patched with the brushnet forward, it's not shared with SD
+        shared_names = ["vae", "unet"]
+        if not kwargs["sd_cpu_textencoder"]:
+            shared_names.append("text_encoder")
+        shared = self.acquire_components(
+            shared_names,
+            torch_dtype,
+            device,
+            tag="powerpaint_v2",
+            text_encoder_brushnet=component_key(
+                self.hf_model_id, "text_encoder_brushnet", torch_dtype, device
+            ),
+            brushnet=component_key(
+                self.hf_model_id, "PowerPaint_Brushnet", torch_dtype, device
+            ),
         )
+        text_encoder_brushnet = shared.pop("text_encoder_brushnet", None)
+        if text_encoder_brushnet is None:
+            text_encoder_brushnet = CLIPTextModel.from_pretrained(
+                self.hf_model_id,
+                subfolder="text_encoder_brushnet",
+                variant="fp16",
+                torch_dtype=torch_dtype,
+                local_files_only=model_kwargs["local_files_only"],
+            )
 
-        brushnet = BrushNetModel.from_pretrained(
-            self.hf_model_id,
-            subfolder="PowerPaint_Brushnet",
-            variant="fp16",
-            torch_dtype=torch_dtype,
-            local_files_only=model_kwargs["local_files_only"],
-        )
+        brushnet = shared.pop("brushnet", None)
+        if brushnet is None:
+            brushnet = BrushNetModel.from_pretrained(
+                self.hf_model_id,
+                subfolder="PowerPaint_Brushnet",
+                variant="fp16",
+                torch_dtype=torch_dtype,
+                local_files_only=model_kwargs["local_files_only"],
+            )
+        model_kwargs = {
+            **shared,
+            **kwargs.get("pipe_components", {}),
+            **model_kwargs,
+        }
 
         if self.model_info.is_single_file_diffusers:
             if self.model_info.model_type == ModelType.DIFFUSERS_SD:
@@ -140,6 +166,7 @@ class PowerPaintV2(DiffusionInpaintModel):
                 up_block.forward = UpBlock2D_forward.__get__(
                     up_block, up_block.__class__
                 )
+        self.register_components()
 
     def forward(self, image, mask, config: InpaintRequest):
         """Input image and output image have same size
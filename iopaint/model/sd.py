@@ -25,7 +25,11 @@ class SD(DiffusionInpaintModel):
 
         use_gpu, torch_dtype = get_torch_dtype(device, kwargs.get("no_half", False))
 
+        shared_names = ["vae", "unet"]
+        if not kwargs.get("sd_cpu_textencoder", False):
+            shared_names.append("text_encoder")
         model_kwargs = {
+            **self.acquire_components(shared_names, torch_dtype, device),
             **kwargs.get("pipe_components", {}),
             "local_files_only": is_local_files_only(**kwargs),
         }
@@ -76,6 +80,7 @@ class SD(DiffusionInpaintModel):
                 self.model.text_encoder = CPUTextEncoderWrapper(
                     self.model.text_encoder, torch_dtype
                 )
+        self.register_components()
 
         self.callback = kwargs.pop("callback", None)
 
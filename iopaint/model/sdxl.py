@@ -9,6 +9,7 @@ from loguru import logger
 from iopaint.schema import InpaintRequest, ModelType
 
 from .base import DiffusionInpaintModel
+from .components import component_key
 from .helper.cpu_text_encoder import CPUTextEncoderWrapper
 from .original_sd_configs import get_config_files
 from .utils import (
@@ -18,6 +19,8 @@ from .utils import (
     is_local_files_only,
 )
 
+SDXL_VAE_FP16_FIX = "madebyollin/sdxl-vae-fp16-fix"
+
 
 class SDXL(DiffusionInpaintModel):
     name = "diffusers/stable-diffusion-xl-1.0-inpainting-0.1"
@@ -36,22 +39,36 @@ class SDXL(DiffusionInpaintModel):
         else:
             num_in_channels = 9
 
+        shared_names = ["unet"]
+        if not kwargs.get("sd_cpu_textencoder", False):
+            shared_names += ["text_encoder", "text_encoder_2"]
         if os.path.isfile(self.model_id_or_path):
+            shared = self.acquire_components(
+                shared_names + ["vae"], torch_dtype, device
+            )
             self.model = StableDiffusionXLInpaintPipeline.from_single_file(
                 self.model_id_or_path,
                 torch_dtype=torch_dtype,
                 num_in_channels=num_in_channels,
                 load_safety_checker=False,
                 original_config_file=get_config_files()['xl'],
+                **shared,
             )
         else:
+            shared = self.acquire_components(
+                shared_names,
+                torch_dtype,
+                device,
+                vae=component_key(SDXL_VAE_FP16_FIX, "", torch_dtype, device),
+            )
             model_kwargs = {
+                **shared,
                 **kwargs.get("pipe_components", {}),
                 "local_files_only": is_local_files_only(**kwargs),
             }
             if "vae" not in model_kwargs:
                 vae = AutoencoderKL.from_pretrained(
-                    "madebyollin/sdxl-vae-fp16-fix", torch_dtype=torch_dtype
+                    SDXL_VAE_FP16_FIX, torch_dtype=torch_dtype
                 )
                 model_kwargs["vae"] = vae
             self.model = handle_from_pretrained_exceptions(
@@ -77,6 +94,7 @@ class SDXL(DiffusionInpaintModel):
                 self.model.text_encoder_2 = CPUTextEncoderWrapper(
                     self.model.text_encoder_2, torch_dtype
                 )
+        self.register_components()
 
         self.callback = kwargs.pop("callback", None)
 
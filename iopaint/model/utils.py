@@ -1,6 +1,10 @@
+import copy
 import gc
+import hashlib
+import json
 import math
 import random
+import threading
 import traceback
 from typing import Any
 
@@ -9,20 +13,6 @@ import numpy as np
 import collections
 from itertools import repeat
 
-from diffusers import (
-    DDIMScheduler,
-    PNDMScheduler,
-    LMSDiscreteScheduler,
-    EulerDiscreteScheduler,
-    EulerAncestralDiscreteScheduler,
-    DPMSolverMultistepScheduler,
-    UniPCMultistepScheduler,
-    LCMScheduler,
-    DPMSolverSinglestepScheduler,
-    KDPM2DiscreteScheduler,
-    KDPM2AncestralDiscreteScheduler,
-    HeunDiscreteScheduler,
-)
 from loguru import logger
 
 from iopaint.schema import SDSampler
@@ -932,6 +922,22 @@ def set_seed(seed: int):
 
 
 def get_scheduler(sd_sampler, scheduler_config):
+    # diffusers is slow to import, erase models and cli commands don't need it
+    from diffusers import (
+        DDIMScheduler,
+        PNDMScheduler,
+        LMSDiscreteScheduler,
+        EulerDiscreteScheduler,
+        EulerAncestralDiscreteScheduler,
+        DPMSolverMultistepScheduler,
+        UniPCMultistepScheduler,
+        LCMScheduler,
+        DPMSolverSinglestepScheduler,
+        KDPM2DiscreteScheduler,
+        KDPM2AncestralDiscreteScheduler,
+        HeunDiscreteScheduler,
+    )
+
     # https://github.com/huggingface/diffusers/issues/4167
     keys_to_pop = ["use_karras_sigmas", "algorithm_type"]
     scheduler_config = dict(scheduler_config)
@@ -971,6 +977,38 @@ def get_scheduler(sd_sampler, scheduler_config):
         raise ValueError(sd_sampler)
 
 
+class SchedulerCache:
+    """
+    Schedulers built by ``get_scheduler``, keyed by sampler and scheduler config.
+    Building a scheduler validates the config and computes its beta/alpha/sigma
+    tables, a copy of a cached one is much cheaper. Copies are handed out because
+    schedulers keep the state of the run(timesteps, step index, solver history).
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._schedulers: "collections.OrderedDict" = collections.OrderedDict()
+
+    def get(self, sd_sampler, scheduler_config):
+        config = json.dumps(dict(scheduler_config), sort_keys=True, default=str)
+        key = (sd_sampler, hashlib.sha1(config.encode()).hexdigest())
+        with self._lock:
+            scheduler = self._schedulers.get(key)
+            if scheduler is not None:
+                self._schedulers.move_to_end(key)
+        if scheduler is None:
+            scheduler = get_scheduler(sd_sampler, scheduler_config)
+            with self._lock:
+                self._schedulers[key] = scheduler
+                while len(self._schedulers) > self.max_size:
+                    self._schedulers.popitem(last=False)
+        return copy.deepcopy(scheduler)
+
+
+scheduler_cache = SchedulerCache()
+
+
 def is_local_files_only(**kwargs) -> bool:
     from huggingface_hub.constants import HF_HUB_OFFLINE
 
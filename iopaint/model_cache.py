@@ -0,0 +1,321 @@
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import torch
+from loguru import logger
+
+from iopaint.model.utils import torch_gc
+from iopaint.schema import CachedModelInfo, ModelCacheStats, ModelLocation
+
+_CPU = torch.device("cpu")
+
+
+def model_modules(model) -> List[torch.nn.Module]:
+    """torch modules held by an InpaintModel, including diffusers pipeline components"""
+    modules = {}
+    for value in vars(model).values():
+        if isinstance(value, torch.nn.Module):
+            candidates = [value]
+        elif isinstance(getattr(value, "components", None), dict):
+            candidates = value.components.values()
+        else:
+            continue
+        for it in candidates:
+            if isinstance(it, torch.nn.Module):
+                modules[id(it)] = it
+    return list(modules.values())
+
+
+def _module_device(module: torch.nn.Module) -> Optional[torch.device]:
+    tensor = next(itertools.chain(module.parameters(), module.buffers()), None)
+    return None if tensor is None else tensor.device
+
+
+def frozen_modules(model) -> List[torch.nn.Module]:
+    """TorchScript modules frozen by load_optimized_jit_model, their weights are
+    constants that can't be measured or moved"""
+    return [it for it in model_modules(model) if hasattr(it, "frozen_bytes")]
+
+
+def model_memory(model) -> Tuple[int, int]:
+    """
+    Returns:
+        bytes of the weights on the accelerator and in host memory
+    """
+    device_bytes, host_bytes = 0, 0
+    device = getattr(model, "device", None)
+    for it in frozen_modules(model):
+        if device is None or torch.device(device).type == "cpu":
+            host_bytes += it.frozen_bytes
+        else:
+            device_bytes += it.frozen_bytes
+    tensors = {}
+    for module in model_modules(model):
+        for it in itertools.chain(module.parameters(), module.buffers()):
+            tensors[id(it)] = it
+    for value in vars(model).values():
+        if isinstance(value, torch.Tensor):
+            tensors[id(value)] = value
+    for it in tensors.values():
+        nbytes = it.numel() * it.element_size()
+        if it.device.type == "cpu":
+            host_bytes += nbytes
+        else:
+            device_bytes += nbytes
+    return device_bytes, host_bytes
+
+
+class _Entry:
+    def __init__(self, model, device: torch.device, movable: bool, state: Dict):
+        self.model = model
+        self.device = device
+        # frozen models are evicted instead of moved to host memory
+        self.movable = movable and not frozen_modules(model)
+        self.state = state
+        self.device_bytes, self.host_bytes = model_memory(model)
+        self.location = ModelLocation.device
+        self.pins = 0
+        # modules and tensor attributes that live on the device, a sd_cpu_textencoder
+        # text encoder stays in host memory
+        self.device_modules = [
+            it
+            for it in model_modules(model)
+            if _module_device(it) not in (None, _CPU)
+        ]
+        self._device_tensors = [
+            k
+            for k, v in vars(model).items()
+            if isinstance(v, torch.Tensor) and v.device.type != "cpu"
+        ]
+
+    @property
+    def resident_device_bytes(self) -> int:
+        return self.device_bytes if self.location == ModelLocation.device else 0
+
+    @property
+    def resident_host_bytes(self) -> int:
+        if self.location == ModelLocation.host:
+            return self.host_bytes + self.device_bytes
+        return self.host_bytes
+
+    def demote(self, keep: Set[int]):
+        """
+        Args:
+            keep: ids of modules shared with models on the device, they are not moved
+        """
+        for it in self.device_modules:
+            if id(it) not in keep:
+                it.to(_CPU)
+        for k in self._device_tensors:
+            setattr(self.model, k, getattr(self.model, k).to(_CPU))
+        self.location = ModelLocation.host
+
+    def promote(self):
+        for it in self.device_modules:
+            it.to(self.device)
+        for k in self._device_tensors:
+            setattr(self.model, k, getattr(self.model, k).to(self.device))
+        self.location = ModelLocation.device
+
+
+class ModelCache:
+    """
+    Keep several loaded models resident, each tier limited by a byte budget.
+
+    When the accelerator budget is exceeded, the least recently used models are
+    demoted to host memory, when the host budget is exceeded they are dropped.
+    Demoted models are moved back to their device on the next use. Models in use
+    (pinned by ``acquire``) are never evicted and the most recently used model is
+    only evicted to make room for loading another one, so budgets of 0 keep a single
+    model loaded, same as switching models without a cache.
+
+    Modules shared with another model on the device(see ComponentRegistry) stay on
+    the device when a model is demoted. They count towards the memory of every model
+    using them.
+    """
+
+    def __init__(self, device_budget: int = 0, host_budget: int = 0):
+        self.device_budget = device_budget
+        self.host_budget = host_budget
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # memory of models loaded before, to make room before loading them again
+        self._known_sizes: Dict[str, Tuple[int, int]] = {}
+        self.hits = 0
+        self.loads = 0
+        self.promotions = 0
+        self.demotions = 0
+        self.evictions = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    @property
+    def device_bytes(self) -> int:
+        return sum(it.resident_device_bytes for it in self._entries.values())
+
+    @property
+    def host_bytes(self) -> int:
+        return sum(it.resident_host_bytes for it in self._entries.values())
+
+    def get(self, name: str):
+        """Returns the model on its device, None if it is not cached"""
+        with self._lock:
+            entry = self._use(name)
+            return None if entry is None else entry.model
+
+    def acquire(self, name: str):
+        """Same as get, the model is pinned until ``release``"""
+        with self._lock:
+            entry = self._use(name)
+            if entry is None:
+                return None
+            entry.pins += 1
+            return entry.model
+
+    def pin(self, model) -> Optional[str]:
+        """Pin a cached model object without using it, returns its name to
+        ``release``, None if it is not cached"""
+        with self._lock:
+            for name, entry in self._entries.items():
+                if entry.model is model:
+                    entry.pins += 1
+                    return name
+        return None
+
+    def release(self, name: str):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.pins > 0:
+                entry.pins -= 1
+                if entry.pins == 0:
+                    # a model replaced while it was in use can be evicted now
+                    self._trim(keep=next(reversed(self._entries)))
+
+    def state(self, name: str) -> Optional[Dict]:
+        entry = self._entries.get(name)
+        return None if entry is None else dict(entry.state)
+
+    def make_room(self, name: str):
+        """Evict models before loading ``name``, using its size from the last load"""
+        device_bytes, host_bytes = self._known_sizes.get(name, (0, 0))
+        with self._lock:
+            self._trim(keep=None, extra_device=device_bytes, extra_host=host_bytes)
+
+    def put(
+        self,
+        name: str,
+        model,
+        device: torch.device,
+        movable: bool = True,
+        state: Optional[Dict] = None,
+        pin: bool = False,
+        recent: bool = True,
+    ):
+        """
+        Args:
+            recent: add the model as the most recently used one, otherwise as the
+                least recently used one, it is demoted or evicted first when it
+                doesn't fit in the budgets
+        """
+        entry = _Entry(model, device, movable, state or {})
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                entry.pins = old.pins
+            else:
+                self.loads += 1
+            entry.pins += int(pin)
+            self._entries[name] = entry
+            if not recent:
+                self._entries.move_to_end(name, last=False)
+            self._known_sizes[name] = (entry.device_bytes, entry.host_bytes)
+            self._trim(keep=next(reversed(self._entries)))
+        logger.info(
+            f"Model cache: {name} uses {entry.device_bytes / 1024 / 1024:.0f}MB device "
+            f"memory, {entry.host_bytes / 1024 / 1024:.0f}MB host memory"
+        )
+
+    def stats(self, current: Optional[str] = None) -> ModelCacheStats:
+        with self._lock:
+            models = [
+                CachedModelInfo(
+                    name=name,
+                    device=str(it.device),
+                    location=it.location,
+                    device_bytes=it.device_bytes,
+                    host_bytes=it.host_bytes,
+                    in_use=it.pins,
+                    current=name == current,
+                )
+                for name, it in reversed(self._entries.items())
+            ]
+            return ModelCacheStats(
+                hits=self.hits,
+                loads=self.loads,
+                promotions=self.promotions,
+                demotions=self.demotions,
+                evictions=self.evictions,
+                device_bytes=self.device_bytes,
+                device_budget=self.device_budget,
+                host_bytes=self.host_bytes,
+                host_budget=self.host_budget,
+                models=models,
+            )
+
+    def _use(self, name: str) -> Optional[_Entry]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        self.hits += 1
+        self._entries.move_to_end(name)
+        if entry.location == ModelLocation.host:
+            self._trim(keep=name, extra_device=entry.device_bytes)
+            logger.info(f"Model cache: move {name} back to {entry.device}")
+            entry.promote()
+            self.promotions += 1
+        return entry
+
+    def _trim(
+        self, keep: Optional[str], extra_device: int = 0, extra_host: int = 0
+    ):
+        changed = False
+        # least recently used first
+        for name, entry in list(self._entries.items()):
+            if self.device_bytes + extra_device <= self.device_budget:
+                break
+            if name == keep or entry.pins or entry.resident_device_bytes == 0:
+                continue
+            if entry.movable:
+                logger.info(f"Model cache: move {name} to host memory")
+                entry.demote(keep=self._device_module_ids(exclude=name))
+                self.demotions += 1
+            else:
+                self._evict(name)
+            changed = True
+
+        for name, entry in list(self._entries.items()):
+            if self.host_bytes + extra_host <= self.host_budget:
+                break
+            if name == keep or entry.pins:
+                continue
+            self._evict(name)
+            changed = True
+
+        if changed:
+            torch_gc()
+
+    def _device_module_ids(self, exclude: str) -> Set[int]:
+        return {
+            id(module)
+            for name, it in self._entries.items()
+            if name != exclude and it.location == ModelLocation.device
+            for module in it.device_modules
+        }
+
+    def _evict(self, name: str):
+        logger.info(f"Model cache: unload {name}")
+        del self._entries[name]
+        self.evictions += 1
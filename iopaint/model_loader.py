@@ -0,0 +1,190 @@
+import contextlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from loguru import logger
+
+from iopaint.schema import ModelLoadInfo, ModelLoadStatus
+
+# finished loads kept for the load status API
+MAX_FINISHED_LOADS = 16
+
+
+class _Load:
+    def __init__(self, name: str, switch: bool):
+        self.name = name
+        self.switch = switch
+        self.status = ModelLoadStatus.queued
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in [ModelLoadStatus.ready, ModelLoadStatus.failed]
+
+    def info(self, expected: Optional[float]) -> ModelLoadInfo:
+        elapsed, progress = None, None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        if self.status == ModelLoadStatus.queued:
+            progress = 0
+        elif self.finished:
+            progress = 1
+        elif expected:
+            progress = min(elapsed / expected, 0.99)
+        return ModelLoadInfo(
+            name=self.name,
+            switch=self.switch,
+            status=self.status,
+            progress=progress,
+            elapsed=elapsed,
+            error=self.error,
+        )
+
+
+class ModelLoader:
+    """
+    Load models into the model cache in a background thread, the current model keeps
+    serving requests until a loaded model is swapped in.
+
+    Loads run one at a time in request order. When several switches are requested,
+    the last one wins: earlier models are still loaded into the cache but not
+    switched to. A prefetched model that doesn't fit in the model cache budgets is
+    evicted right after its load, the load is reported as failed.
+    """
+
+    def __init__(
+        self,
+        model_manager,
+        on_update: Optional[Callable[[ModelLoadInfo], None]] = None,
+        load_timer: Optional[Callable[..., ContextManager]] = None,
+    ):
+        self.model_manager = model_manager
+        self.on_update = on_update
+        self.load_timer = load_timer
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[_Load]" = queue.Queue()
+        self._loads: "OrderedDict[str, _Load]" = OrderedDict()
+        # last load time of each model, to estimate the progress
+        self._durations: Dict[str, float] = {}
+        self._switch_to: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self, name: str, switch: bool = False) -> ModelLoadInfo:
+        with self._lock:
+            if switch:
+                self._switch_to = name
+            load = self._loads.get(name)
+            if load is not None and not load.finished:
+                load.switch = load.switch or switch
+                return self._info(load)
+            load = _Load(name, switch)
+            self._loads.pop(name, None)
+            self._loads[name] = load
+            self._trim()
+            self._queue.put(load)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="iopaint-model-loader", daemon=True
+                )
+                self._thread.start()
+        self._notify(load)
+        return self._info(load)
+
+    def cancel_switch(self):
+        """Called when the model is switched synchronously, pending switches are
+        not applied"""
+        with self._lock:
+            self._switch_to = None
+
+    def info(self, name: str) -> Optional[ModelLoadInfo]:
+        with self._lock:
+            load = self._loads.get(name)
+            return None if load is None else self._info(load)
+
+    def infos(self) -> List[ModelLoadInfo]:
+        """Latest loads first"""
+        with self._lock:
+            return [self._info(it) for it in reversed(self._loads.values())]
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queued loads are finished, for tests"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                if all(it.finished for it in self._loads.values()):
+                    return True
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            load = self._queue.get()
+            with self._lock:
+                load.status = ModelLoadStatus.loading
+                load.started_at = time.time()
+                # a prefetched model is the first one evicted if it doesn't fit in
+                # the model cache budgets
+                recent = self._switch_to == load.name
+            self._notify(load)
+            kind = "switch" if load.switch else "prefetch"
+            try:
+                with self._timer(load.name, kind):
+                    self.model_manager.load(load.name, recent=recent)
+                with self._lock:
+                    switch = load.switch and self._switch_to == load.name
+                    if switch:
+                        self._switch_to = None
+                if switch:
+                    # the model is cached, switching only moves it to the device
+                    # if it was demoted meanwhile
+                    self.model_manager.switch(load.name)
+                    logger.info(f"Switched to model {load.name} in background")
+                    status = ModelLoadStatus.ready
+                elif load.name in self.model_manager.cache:
+                    status = ModelLoadStatus.ready
+                else:
+                    load.error = (
+                        f"Model {load.name} was evicted right after loading, it doesn't "
+                        f"fit in the model cache budgets"
+                    )
+                    logger.warning(load.error)
+                    status = ModelLoadStatus.failed
+            except Exception as e:
+                logger.exception(f"Background load of model {load.name} failed")
+                load.error = str(e)
+                status = ModelLoadStatus.failed
+            with self._lock:
+                load.finished_at = time.time()
+                load.status = status
+                if status == ModelLoadStatus.ready:
+                    self._durations[load.name] = load.finished_at - load.started_at
+            self._notify(load)
+
+    def _timer(self, name: str, kind: str) -> ContextManager:
+        if self.load_timer is None:
+            return contextlib.nullcontext()
+        return self.load_timer(model=name, kind=kind)
+
+    def _info(self, load: _Load) -> ModelLoadInfo:
+        return load.info(self._durations.get(load.name))
+
+    def _notify(self, load: _Load):
+        if self.on_update is None:
+            return
+        with self._lock:
+            info = self._info(load)
+        try:
+            self.on_update(info)
+        except Exception:
+            logger.exception("Failed to send model load progress")
+
+    def _trim(self):
+        finished = [k for k, v in self._loads.items() if v.finished]
+        for k in finished[: max(len(finished) - MAX_FINISHED_LOADS, 0)]:
+            del self._loads[k]
@@ -1,24 +1,61 @@
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 
 import torch
 from loguru import logger
 import numpy as np
 
-from iopaint.download import scan_models
+from iopaint.download import scan_loras, scan_models
 from iopaint.helper import switch_mps_device
-from iopaint.model import models, ControlNet, SD, SDXL
-from iopaint.model.brushnet.brushnet_wrapper import BrushNetWrapper
-from iopaint.model.brushnet.brushnet_xl_wrapper import BrushNetXLWrapper
-from iopaint.model.power_paint.power_paint_v2 import PowerPaintV2
-from iopaint.model.utils import torch_gc, is_local_files_only
-from iopaint.schema import InpaintRequest, ModelInfo, ModelType
+from iopaint.model import models
+from iopaint.model.batcher import MicroBatcher
+from iopaint.model.components import ComponentRegistry
+from iopaint.model.lora import LoraManager
+from iopaint.model.utils import is_local_files_only
+from iopaint.model_cache import ModelCache
+from iopaint.schema import InpaintRequest, ModelCacheStats, ModelInfo, ModelType
+
+# controlnet/brushnet/powerpaint state the model was built with, kept with the
+# cached model and restored when it becomes the current model again
+MODEL_STATE_ATTRS = [
+    "enable_controlnet",
+    "controlnet_method",
+    "enable_brushnet",
+    "brushnet_method",
+    "enable_powerpaint_v2",
+]
 
 
 class ModelManager:
     def __init__(self, name: str, device: torch.device, **kwargs):
         self.name = name
         self.device = device
+        batch_size = kwargs.pop("batch_size", 1)
+        batch_wait_ms = kwargs.pop("batch_wait_ms", 5)
+        self.cache = ModelCache(
+            device_budget=kwargs.pop("model_cache_device_budget", 0) * 1024 * 1024,
+            host_budget=kwargs.pop("model_cache_host_budget", 0) * 1024 * 1024,
+        )
         self.kwargs = kwargs
+        # fused weights live on the modules, not with cpu offload
+        self.loras = LoraManager(
+            max_variants=kwargs.pop("lora_cache_size", 2),
+            fuse=not kwargs.get("cpu_offload", False),
+        )
+        self.batcher = None
+        if batch_size > 1:
+            logger.info(
+                f"Enable micro-batching, max batch size: {batch_size}, max wait: {batch_wait_ms}ms"
+            )
+            self.batcher = MicroBatcher(
+                max_batch_size=batch_size,
+                max_wait_ms=batch_wait_ms,
+                model_cache=self.cache,
+            )
+        # serializes changes of the current model and its state
+        self._lock = threading.RLock()
+        # diffusion pipeline components shared by the cached models
+        self.components = ComponentRegistry()
         self.available_models: Dict[str, ModelInfo] = {}
         self.scan_models()
 
@@ -39,37 +76,157 @@ class ModelManager:
 
         self.model = self.init_model(name, device, **kwargs)
 
+    @property
+    def model(self):
+        return self._get_model()
+
+    @model.setter
+    def model(self, model):
+        self._put_model(model)
+
     @property
     def current_model(self) -> ModelInfo:
         return self.available_models[self.name]
 
-    def init_model(self, name: str, device, **kwargs):
+    @property
+    def is_batching(self) -> bool:
+        return self.is_batching_model(self.name)
+
+    def is_batching_model(self, name: str) -> bool:
+        return (
+            self.batcher is not None and name in models and models[name].supports_batch
+        )
+
+    def cache_stats(self) -> ModelCacheStats:
+        stats = self.cache.stats(current=self.name)
+        stats.components = self.components.stats()
+        return stats
+
+    def _model_state(self) -> Dict:
+        return {k: getattr(self, k) for k in MODEL_STATE_ATTRS}
+
+    def _set_model_state(self, state: Dict):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def _state_for(self, name: str) -> Dict:
+        state = self.cache.state(name)
+        if state is None:
+            state = self._model_state()
+            model_info = self.available_models[name]
+            if (
+                model_info.support_controlnet
+                and state["controlnet_method"] not in model_info.controlnets
+            ):
+                state["controlnet_method"] = model_info.controlnets[0]
+        return state
+
+    def _get_model(self, pin: bool = False):
+        """The current model, loaded again if it was evicted from the model cache"""
+        with self._lock:
+            if pin:
+                model = self.cache.acquire(self.name)
+            else:
+                model = self.cache.get(self.name)
+            if model is None:
+                self.cache.make_room(self.name)
+                model = self.init_model(
+                    self.name, switch_mps_device(self.name, self.device), **self.kwargs
+                )
+                self._put_model(model, pin=pin)
+            return model
+
+    def _put_model(
+        self,
+        model,
+        pin: bool = False,
+        name: Optional[str] = None,
+        state: Optional[Dict] = None,
+        recent: bool = True,
+    ):
+        name = name or self.name
+        self.cache.put(
+            name,
+            model,
+            switch_mps_device(name, self.device),
+            # models offloaded by accelerate hooks can't be moved as a whole
+            movable=not self.kwargs.get("cpu_offload", False),
+            state=state or self._model_state(),
+            pin=pin,
+            recent=recent,
+        )
+
+    def load(self, name: str, recent: bool = True):
+        """
+        Load a model into the model cache without switching to it, the current model
+        keeps serving requests meanwhile. Weights of both models are in memory
+        during the load.
+
+        Args:
+            recent: cache it as the most recently used model, e.g. before switching
+                to it. Otherwise it is the first one evicted when it doesn't fit in
+                the model cache budgets.
+        """
+        if name not in self.available_models:
+            raise NotImplementedError(
+                f"Unsupported model: {name}. Available models: {list(self.available_models.keys())}"
+            )
+        with self._lock:
+            if name in self.cache:
+                return
+            state = self._state_for(name)
+        model = self.init_model(
+            name, switch_mps_device(name, self.device), state=state, **self.kwargs
+        )
+        with self._lock:
+            self._put_model(model, name=name, state=state, recent=recent)
+
+    def init_model(self, name: str, device, state: Optional[Dict] = None, **kwargs):
+        """
+        Args:
+            state: controlnet/brushnet/powerpaint state to build the model with,
+                defaults to the current state
+        """
         logger.info(f"Loading model: {name}")
         if name not in self.available_models:
             raise NotImplementedError(
                 f"Unsupported model: {name}. Available models: {list(self.available_models.keys())}"
             )
 
+        state = state or self._model_state()
         model_info = self.available_models[name]
         kwargs = {
             **kwargs,
             "model_info": model_info,
-            "enable_controlnet": self.enable_controlnet,
-            "controlnet_method": self.controlnet_method,
-            "enable_brushnet": self.enable_brushnet,
-            "brushnet_method": self.brushnet_method,
+            "enable_controlnet": state["enable_controlnet"],
+            "controlnet_method": state["controlnet_method"],
+            "enable_brushnet": state["enable_brushnet"],
+            "brushnet_method": state["brushnet_method"],
+            "batcher": self.batcher,
+            "components": self.components,
         }
 
-        if model_info.support_controlnet and self.enable_controlnet:
+        # model code is imported here, only the loaded model pays for its imports
+        if model_info.support_controlnet and state["enable_controlnet"]:
+            from iopaint.model.controlnet import ControlNet
+
             return ControlNet(device, **kwargs)
 
-        if model_info.support_brushnet and self.enable_brushnet:
+        if model_info.support_brushnet and state["enable_brushnet"]:
             if model_info.model_type == ModelType.DIFFUSERS_SD:
+                from iopaint.model.brushnet.brushnet_wrapper import BrushNetWrapper
+
                 return BrushNetWrapper(device, **kwargs)
             elif model_info.model_type == ModelType.DIFFUSERS_SDXL:
+                from iopaint.model.brushnet.brushnet_xl_wrapper import (
+                    BrushNetXLWrapper,
+                )
+
                 return BrushNetXLWrapper(device, **kwargs)
 
-        if model_info.support_powerpaint_v2 and self.enable_powerpaint_v2:
+        if model_info.support_powerpaint_v2 and state["enable_powerpaint_v2"]:
+            from iopaint.model.power_paint.power_paint_v2 import PowerPaintV2
+
             return PowerPaintV2(device, **kwargs)
 
         if model_info.name in models:
@@ -79,12 +236,16 @@ class ModelManager:
             ModelType.DIFFUSERS_SD_INPAINT,
             ModelType.DIFFUSERS_SD,
         ]:
+            from iopaint.model.sd import SD
+
             return SD(device, **kwargs)
 
         if model_info.model_type in [
             ModelType.DIFFUSERS_SDXL_INPAINT,
             ModelType.DIFFUSERS_SDXL,
         ]:
+            from iopaint.model.sdxl import SDXL
+
             return SDXL(device, **kwargs)
 
         raise NotImplementedError(f"Unsupported model: {name}")
@@ -101,14 +262,40 @@ class ModelManager:
         Returns:
             BGR image
         """
+        name = config.model or self.name
+        if name not in self.available_models:
+            raise NotImplementedError(
+                f"Unsupported model: {name}. Available models: {list(self.available_models.keys())}"
+            )
+        with self._lock:
+            if name == self.name:
+                model = self._prepare(config)
+            else:
+                # run another model from the cache, the current model is not switched
+                current_name, current_state = self.name, self._model_state()
+                self.name = name
+                self._set_model_state(self._state_for(name))
+                try:
+                    model = self._prepare(config)
+                finally:
+                    self.name = current_name
+                    self._set_model_state(current_state)
+        try:
+            return model(image, mask, config).astype(np.uint8)
+        finally:
+            self.cache.release(name)
+
+    def _prepare(self, config: InpaintRequest):
+        """Apply the request's controlnet/brushnet/powerpaint/lora options, returns
+        the current model pinned in the cache"""
         if config.enable_controlnet:
             self.switch_controlnet_method(config)
         if config.enable_brushnet:
             self.switch_brushnet_method(config)
 
         self.enable_disable_powerpaint_v2(config)
-        self.enable_disable_lcm_lora(config)
-        return self.model(image, mask, config).astype(np.uint8)
+        self.apply_loras(config)
+        return self._get_model(pin=True)
 
     def scan_models(self) -> List[ModelInfo]:
         available_models = scan_models()
@@ -119,32 +306,21 @@ class ModelManager:
         if new_name == self.name:
             return
 
-        old_name = self.name
-        old_controlnet_method = self.controlnet_method
-        self.name = new_name
-
-        if (
-            self.available_models[new_name].support_controlnet
-            and self.controlnet_method
-            not in self.available_models[new_name].controlnets
-        ):
-            self.controlnet_method = self.available_models[new_name].controlnets[0]
-        try:
-            # TODO: enable/disable controlnet without reload model
-            del self.model
-            torch_gc()
-
-            self.model = self.init_model(
-                new_name, switch_mps_device(new_name, self.device), **self.kwargs
-            )
-        except Exception as e:
-            self.name = old_name
-            self.controlnet_method = old_controlnet_method
-            logger.info(f"Switch model from {old_name} to {new_name} failed, rollback")
-            self.model = self.init_model(
-                old_name, switch_mps_device(old_name, self.device), **self.kwargs
-            )
-            raise e
+        with self._lock:
+            old_name = self.name
+            old_state = self._model_state()
+            self.name = new_name
+            self._set_model_state(self._state_for(new_name))
+            try:
+                self._get_model()
+            except Exception as e:
+                self.name = old_name
+                self._set_model_state(old_state)
+                logger.info(
+                    f"Switch model from {old_name} to {new_name} failed, rollback"
+                )
+                self._get_model()
+                raise e
 
     def switch_brushnet_method(self, config):
         if not self.available_models[self.name].support_brushnet:
@@ -166,23 +342,10 @@ class ModelManager:
             self.enable_brushnet = config.enable_brushnet
             self.brushnet_method = config.brushnet_method
 
-            pipe_components = {
-                "vae": self.model.model.vae,
-                "text_encoder": self.model.model.text_encoder,
-                "unet": self.model.model.unet,
-            }
-            if hasattr(self.model.model, "text_encoder_2"):
-                pipe_components["text_encoder_2"] = self.model.model.text_encoder_2
-            if hasattr(self.model.model, "tokenizer"):
-                pipe_components["tokenizer"] = self.model.model.tokenizer
-            if hasattr(self.model.model, "tokenizer_2"):
-                pipe_components["tokenizer_2"] = self.model.model.tokenizer_2
-
+            # vae/text encoders/unet of the current pipeline are reused from
+            # the component registry
             self.model = self.init_model(
-                self.name,
-                switch_mps_device(self.name, self.device),
-                pipe_components=pipe_components,
-                **self.kwargs,
+                self.name, switch_mps_device(self.name, self.device), **self.kwargs
             )
 
             if not config.enable_brushnet:
@@ -209,19 +372,8 @@ class ModelManager:
             self.enable_controlnet = config.enable_controlnet
             self.controlnet_method = config.controlnet_method
 
-            pipe_components = {
-                "vae": self.model.model.vae,
-                "text_encoder": self.model.model.text_encoder,
-                "unet": self.model.model.unet,
-            }
-            if hasattr(self.model.model, "text_encoder_2"):
-                pipe_components["text_encoder_2"] = self.model.model.text_encoder_2
-
             self.model = self.init_model(
-                self.name,
-                switch_mps_device(self.name, self.device),
-                pipe_components=pipe_components,
-                **self.kwargs,
+                self.name, switch_mps_device(self.name, self.device), **self.kwargs
             )
             if not config.enable_controlnet:
                 logger.info("Disable controlnet")
@@ -234,35 +386,34 @@ class ModelManager:
 
         if self.enable_powerpaint_v2 != config.enable_powerpaint_v2:
             self.enable_powerpaint_v2 = config.enable_powerpaint_v2
-            pipe_components = {"vae": self.model.model.vae}
-
             self.model = self.init_model(
-                self.name,
-                switch_mps_device(self.name, self.device),
-                pipe_components=pipe_components,
-                **self.kwargs,
+                self.name, switch_mps_device(self.name, self.device), **self.kwargs
             )
             if config.enable_powerpaint_v2:
                 logger.info("Enable PowerPaintV2")
             else:
                 logger.info("Disable PowerPaintV2")
 
-    def enable_disable_lcm_lora(self, config: InpaintRequest):
-        if self.available_models[self.name].support_lcm_lora:
-            # TODO: change this if load other lora is supported
-            lcm_lora_loaded = bool(self.model.model.get_list_adapters())
-            if config.sd_lcm_lora:
-                if not lcm_lora_loaded:
-                    logger.info("Load LCM LORA")
-                    self.model.model.load_lora_weights(
-                        self.model.lcm_lora_id,
-                        weight_name="pytorch_lora_weights.safetensors",
-                        local_files_only=is_local_files_only(),
-                    )
-                else:
-                    logger.info("Enable LCM LORA")
-                    self.model.model.enable_lora()
-            else:
-                if lcm_lora_loaded:
-                    logger.info("Disable LCM LORA")
-                    self.model.model.disable_lora()
+    def apply_loras(self, config: InpaintRequest):
+        if not self.available_models[self.name].support_lcm_lora:
+            if config.sd_loras:
+                raise ValueError(f"Model {self.name} doesn't support LoRAs")
+            return
+        # the api resolves the paths, scan the lora folder for the other callers
+        lora_files = None
+        loras = []
+        for it in config.sd_loras:
+            path = it._path
+            if path is None:
+                lora_files = scan_loras() if lora_files is None else lora_files
+                if it.name not in lora_files:
+                    raise ValueError(f"LoRA {it.name} not found")
+                path = str(lora_files[it.name])
+            loras.append((path, None, it.scale))
+        if config.sd_lcm_lora:
+            loras.append(
+                (self.model.lcm_lora_id, "pytorch_lora_weights.safetensors", 1.0)
+            )
+        self.loras.apply(
+            self.model.model, loras, local_files_only=is_local_files_only()
+        )
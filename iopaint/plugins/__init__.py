@@ -1,15 +1,28 @@
+import importlib
 from typing import Dict
 
 from loguru import logger
 
-from .anime_seg import AnimeSeg
-from .gfpgan_plugin import GFPGANPlugin
-from .interactive_seg import InteractiveSeg
-from .realesrgan import RealESRGANUpscaler
-from .remove_bg import RemoveBG
-from .restoreformer import RestoreFormerPlugin
 from ..schema import InteractiveSegModel, Device, RealESRGANModel
 
+# Plugin model code(SAM, GFPGAN, BRIA...) is imported when the plugin is enabled
+# plugin class name -> module
+_PLUGIN_MODULES = {
+    "AnimeSeg": ".anime_seg",
+    "GFPGANPlugin": ".gfpgan_plugin",
+    "InteractiveSeg": ".interactive_seg",
+    "RealESRGANUpscaler": ".realesrgan",
+    "RemoveBG": ".remove_bg",
+    "RestoreFormerPlugin": ".restoreformer",
+}
+
+
+def __getattr__(name: str):
+    if name in _PLUGIN_MODULES:
+        module = importlib.import_module(_PLUGIN_MODULES[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def build_plugins(
     enable_interactive_seg: bool,
@@ -29,31 +42,44 @@ def build_plugins(
     no_half: bool,
 ) -> Dict:
     plugins = {}
+    # background upscaler of the face restoration plugins
+    upscaler = None
     if enable_interactive_seg:
+        from .interactive_seg import InteractiveSeg
+
         logger.info(f"Initialize {InteractiveSeg.name} plugin")
         plugins[InteractiveSeg.name] = InteractiveSeg(
             interactive_seg_model, interactive_seg_device
         )
 
     if enable_remove_bg:
+        from .remove_bg import RemoveBG
+
         logger.info(f"Initialize {RemoveBG.name} plugin")
         plugins[RemoveBG.name] = RemoveBG(remove_bg_model, remove_bg_device)
 
     if enable_anime_seg:
+        from .anime_seg import AnimeSeg
+
         logger.info(f"Initialize {AnimeSeg.name} plugin")
         plugins[AnimeSeg.name] = AnimeSeg()
 
     if enable_realesrgan:
+        from .realesrgan import RealESRGANUpscaler
+
         logger.info(
             f"Initialize {RealESRGANUpscaler.name} plugin: {realesrgan_model}, {realesrgan_device}"
         )
-        plugins[RealESRGANUpscaler.name] = RealESRGANUpscaler(
+        upscaler = RealESRGANUpscaler(
             realesrgan_model,
             realesrgan_device,
             no_half=no_half,
         )
+        plugins[RealESRGANUpscaler.name] = upscaler
 
     if enable_gfpgan:
+        from .gfpgan_plugin import GFPGANPlugin
+
         logger.info(f"Initialize {GFPGANPlugin.name} plugin")
         if enable_realesrgan:
             logger.info("Use realesrgan as GFPGAN background upscaler")
@@ -63,13 +89,15 @@ def build_plugins(
             )
         plugins[GFPGANPlugin.name] = GFPGANPlugin(
             gfpgan_device,
-            upscaler=plugins.get(RealESRGANUpscaler.name, None),
+            upscaler=upscaler,
         )
 
     if enable_restoreformer:
+        from .restoreformer import RestoreFormerPlugin
+
         logger.info(f"Initialize {RestoreFormerPlugin.name} plugin")
         plugins[RestoreFormerPlugin.name] = RestoreFormerPlugin(
             restoreformer_device,
-            upscaler=plugins.get(RealESRGANUpscaler.name, None),
+            upscaler=upscaler,
         )
     return plugins
@@ -473,9 +473,11 @@ def resize_image(image):
 def create_briarmbg_session():
     from huggingface_hub import hf_hub_download
 
+    from iopaint.helper import load_state_dict
+
     net = BriaRMBG()
     model_path = hf_hub_download("briaai/RMBG-1.4", "model.pth")
-    net.load_state_dict(torch.load(model_path, map_location="cpu"))
+    net.load_state_dict(load_state_dict(model_path))
     net.eval()
     return net
 
@@ -5,6 +5,8 @@ import torch
 from torchvision.transforms.functional import normalize
 from torch.hub import get_dir
 
+from iopaint.helper import load_state_dict
+
 from .facexlib.utils.face_restoration_helper import FaceRestoreHelper
 from .gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
 from .basicsr.img_util import img2tensor, tensor2img
@@ -78,14 +80,12 @@ class MyGFPGANer:
             model_rootpath=model_dir,
         )
 
-        loadnet = torch.load(model_path)
-        if "params_ema" in loadnet:
-            keyname = "params_ema"
-        else:
-            keyname = "params"
-        self.gfpgan.load_state_dict(loadnet[keyname], strict=True)
+        self.gfpgan.to(self.device)
+        loadnet = load_state_dict(
+            model_path, self.device, keys=["params_ema", "params"]
+        )
+        self.gfpgan.load_state_dict(loadnet, strict=True)
         self.gfpgan.eval()
-        self.gfpgan = self.gfpgan.to(self.device)
 
     @torch.no_grad()
     def enhance(
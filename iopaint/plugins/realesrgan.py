@@ -7,7 +7,7 @@ from torch import nn
 import torch.nn.functional as F
 from loguru import logger
 
-from iopaint.helper import download_model
+from iopaint.helper import download_model, load_state_dict
 from iopaint.plugins.base_plugin import BasePlugin
 from iopaint.schema import RunPluginRequest, RealESRGANModel
 
@@ -67,16 +67,19 @@ class RealESRGANer:
                 dni_weight
             ), "model_path and dni_weight should have the save length."
             loadnet = self.dni(model_path[0], model_path[1], dni_weight)
+            # prefer to use params_ema
+            if "params_ema" in loadnet:
+                keyname = "params_ema"
+            else:
+                keyname = "params"
+            model.load_state_dict(loadnet[keyname], strict=True)
         else:
-            # if the model_path starts with https, it will first download models to the folder: weights
-            loadnet = torch.load(model_path, map_location=torch.device("cpu"))
-
-        # prefer to use params_ema
-        if "params_ema" in loadnet:
-            keyname = "params_ema"
-        else:
-            keyname = "params"
-        model.load_state_dict(loadnet[keyname], strict=True)
+            model.to(self.device)
+            # prefer to use params_ema
+            state_dict = load_state_dict(
+                model_path, self.device, keys=["params_ema", "params"]
+            )
+            model.load_state_dict(state_dict, strict=True)
 
         model.eval()
         self.model = model.to(self.device)
@@ -0,0 +1,81 @@
+import asyncio
+import contextlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from socketio import AsyncServer
+
+
+class ProgressBus:
+    """
+    Hand socket.io events from compute threads to the server event loop.
+
+    ``emit`` never blocks the caller: events are stored per target and a drain
+    coroutine scheduled on the loop with ``run_coroutine_threadsafe`` sends them.
+    While an emit is in flight newer events with the same name replace the pending
+    one, so slow clients receive the latest step instead of a backlog.
+
+    Events are sent to the rooms set with ``scope`` in the current thread (a
+    client sid and/or a job id), or broadcast when no scope is set.
+    """
+
+    def __init__(self, sio: AsyncServer):
+        self.sio = sio
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[Optional[Tuple[str, ...]], OrderedDict] = {}
+        self._draining: Set[Optional[Tuple[str, ...]]] = set()
+        self._local = threading.local()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    @property
+    def rooms(self) -> Optional[Tuple[str, ...]]:
+        return getattr(self._local, "rooms", None)
+
+    @contextlib.contextmanager
+    def scope(self, rooms: Optional[List[str]]):
+        prev_rooms = self.rooms
+        self._local.rooms = tuple(rooms) if rooms else None
+        try:
+            yield
+        finally:
+            self._local.rooms = prev_rooms
+
+    def emit(self, event: str, data: Any = None):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            # no client connected yet
+            return
+        rooms = self.rooms
+        with self._lock:
+            pending = self._pending.setdefault(rooms, OrderedDict())
+            # move to the end, events keep the order they were last emitted in
+            pending.pop(event, None)
+            pending[event] = data
+            if rooms in self._draining:
+                return
+            self._draining.add(rooms)
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(rooms), loop)
+        except RuntimeError:
+            with self._lock:
+                self._pending.pop(rooms, None)
+                self._draining.discard(rooms)
+
+    async def _drain(self, rooms: Optional[Tuple[str, ...]]):
+        while True:
+            with self._lock:
+                pending = self._pending.get(rooms)
+                if not pending:
+                    self._pending.pop(rooms, None)
+                    self._draining.discard(rooms)
+                    return
+                event, data = pending.popitem(last=False)
+            try:
+                await self.sio.emit(event, data, to=list(rooms) if rooms else None)
+            except Exception:
+                logger.exception(f"Failed to emit {event}")
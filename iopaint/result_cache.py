@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from iopaint.schema import InpaintRequest, ResultCacheStats
+
+
+# request fields erase models(ModelType.INPAINT) read, the other fields(prompt,
+# sd_* ...) only change the output of diffusion models
+ERASE_MODEL_FIELDS = {
+    "ldm_steps",
+    "ldm_sampler",
+    "zits_wireframe",
+    "hd_strategy",
+    "hd_strategy_crop_trigger_size",
+    "hd_strategy_crop_margin",
+    "hd_strategy_resize_limit",
+    "hd_strategy_tile_size",
+    "hd_strategy_tile_overlap",
+    "sd_keep_unmasked_area",
+    "cv2_flag",
+    "cv2_radius",
+}
+
+
+def request_fields_json(config: InpaintRequest, erase_model: bool) -> str:
+    """
+    json of the request fields that change the result. image/mask and session
+    fields are excluded, so are the diffusion fields for erase models and the
+    seed the server picked for sd_seed=-1.
+    """
+    if erase_model:
+        return config.model_dump_json(include=ERASE_MODEL_FIELDS)
+    exclude = {"image", "mask", "session_id", "session_version"}
+    if config._random_seed:
+        exclude.add("sd_seed")
+    return config.model_dump_json(exclude=exclude)
+
+
+def result_cache_key(
+    model_name: str,
+    image: np.ndarray,
+    mask: np.ndarray,
+    config: InpaintRequest,
+    erase_model: bool = False,
+) -> str:
+    """
+    blake2b of the decoded pixels, the mask and request_fields_json. The same image
+    encoded differently share the cache entry.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(model_name.encode())
+    for arr in [image, mask]:
+        arr = np.ascontiguousarray(arr)
+        h.update(f"{arr.shape}{arr.dtype}".encode())
+        h.update(memoryview(arr).cast("B"))
+    h.update(request_fields_json(config, erase_model).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of inpaint results: an in-memory LRU and an optional on-disk
+    store, each limited by a byte budget. Entries evicted from memory stay on disk,
+    disk hits are promoted back to memory.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        disk_dir: Optional[Path] = None,
+        disk_budget: int = 0,
+    ):
+        self.memory_budget = memory_budget
+        self.disk_dir = None
+        if disk_dir is not None and disk_budget > 0:
+            self.disk_dir = Path(disk_dir)
+        self.disk_budget = disk_budget
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_budget > 0 or self.disk_dir is not None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                result = np.load(self._disk_path(key), allow_pickle=False)
+                os.utime(self._disk_path(key))
+            except (OSError, ValueError):
+                logger.warning(f"Failed to load cached result {key}, drop it")
+                with self._lock:
+                    self._remove_disk(key)
+            else:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.disk_hits += 1
+                    self._put_memory(key, result)
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: np.ndarray):
+        result = np.ascontiguousarray(result)
+        result.setflags(write=False)
+        with self._lock:
+            self._put_memory(key, result)
+            if self.disk_dir is None or key in self._disk:
+                return
+            if result.nbytes > self.disk_budget:
+                return
+
+        path = self._disk_path(key)
+        try:
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, result, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write result cache {path}: {e}")
+            return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = path.stat().st_size
+                self._disk_bytes += self._disk[key]
+            while self._disk_bytes > self.disk_budget and self._disk:
+                self._remove_disk(next(iter(self._disk)))
+
+    def stats(self) -> ResultCacheStats:
+        with self._lock:
+            return ResultCacheStats(
+                hits=self.memory_hits + self.disk_hits,
+                memory_hits=self.memory_hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                memory_items=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                memory_budget=self.memory_budget,
+                disk_items=len(self._disk),
+                disk_bytes=self._disk_bytes,
+                disk_budget=self.disk_budget if self.disk_dir is not None else 0,
+            )
+
+    def _put_memory(self, key: str, result: np.ndarray):
+        if result.nbytes > self.memory_budget:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = result
+        self._memory_bytes += result.nbytes
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _remove_disk(self, key: str):
+        self._disk_bytes -= self._disk.pop(key, 0)
+        try:
+            self._disk_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.npy"
+
+    def _load_disk_index(self):
+        files = sorted(self.disk_dir.glob("*.npy"), key=lambda it: it.stat().st_mtime)
+        for it in files:
+            self._disk[it.stem] = it.stat().st_size
+            self._disk_bytes += self._disk[it.stem]
+        while self._disk_bytes > self.disk_budget and self._disk:
+            self._remove_disk(next(iter(self._disk)))
+        if self._disk:
+            logger.info(
+                f"Load {len(self._disk)} cached results from {self.disk_dir}, "
+                f"{self._disk_bytes / 1024 / 1024:.2f}MB"
+            )
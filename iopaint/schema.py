@@ -16,7 +16,7 @@ from iopaint.const import (
     SD_BRUSHNET_CHOICES,
     SDXL_BRUSHNET_CHOICES
 )
-from pydantic import BaseModel, Field, computed_field, model_validator
+from pydantic import BaseModel, Field, PrivateAttr, computed_field, model_validator
 
 
 class ModelType(str, Enum):
@@ -212,6 +212,9 @@ class HDStrategy(str, Enum):
     RESIZE = "Resize"
     # Crop masking area(with a margin controlled by hd_strategy_crop_margin) from the original image to do inpainting
     CROP = "Crop"
+    # Split the image into overlapping tiles(hd_strategy_tile_size/hd_strategy_tile_overlap), only do inpainting
+    # on the tiles touching the mask and blend the seams. Memory is bounded by the tile size.
+    TILE = "Tile"
 
 
 class LDMSampler(str, Enum):
@@ -250,6 +253,13 @@ class PowerPaintTask(Choices):
     outpainting = "outpainting"
 
 
+class AdmissionPolicy(Choices):
+    # reject requests over the budgets
+    reject = "reject"
+    # run requests over the budgets at a lower resolution, reject if still too large
+    downscale = "downscale"
+
+
 class ApiConfig(BaseModel):
     host: str
     port: int
@@ -280,11 +290,53 @@ class ApiConfig(BaseModel):
     gfpgan_device: Device
     enable_restoreformer: bool
     restoreformer_device: Device
+    max_queue_size: int = 8
+    batch_size: int = 1
+    batch_wait_ms: float = 5
+    num_workers: int = 1
+    worker_devices: Optional[str] = None
+    result_cache_size: int = 256
+    result_cache_dir: Optional[Path] = None
+    result_cache_disk_size: int = 2048
+    session_cache_size: int = 1024
+    session_max_versions: int = 8
+    preview_interval: int = 0
+    admin_token: Optional[str] = None
+    profile_dir: Optional[Path] = None
+    admission_memory_budget: int = 0
+    admission_latency_budget: float = 0
+    admission_policy: AdmissionPolicy = AdmissionPolicy.downscale
+    warmup_sizes: Optional[str] = None
+    warmup_hd_strategies: str = "Original"
+    model_cache_device_budget: int = 0
+    model_cache_host_budget: int = 0
+    jit_optimize: bool = False
+    lora_cache_size: int = 2
+
+
+class SDLora(BaseModel):
+    name: str = Field(
+        ..., description="File name(without .safetensors) of a LoRA in the lora folder"
+    )
+    scale: float = Field(1.0, description="Weight of the LoRA")
+    # file in the lora folder, resolved once by the api, can't be set by clients
+    _path: Optional[str] = PrivateAttr(None)
 
 
 class InpaintRequest(BaseModel):
     image: Optional[str] = Field(None, description="base64 encoded image")
     mask: Optional[str] = Field(None, description="base64 encoded mask")
+    session_id: Optional[str] = Field(
+        None,
+        description="Image session id, use the session image instead of image, and the session mask if mask is empty",
+    )
+    session_version: Optional[int] = Field(
+        None, description="Version of the session image, latest version by default"
+    )
+    model: Optional[str] = Field(
+        None,
+        description="Model for this request, the current model by default. The model is loaded into the model cache, the current model is not switched",
+    )
 
     ldm_steps: int = Field(20, description="Steps for ldm model.")
     ldm_sampler: str = Field(LDMSampler.plms, description="Sampler for ldm model.")
@@ -304,6 +356,16 @@ class InpaintRequest(BaseModel):
     hd_strategy_resize_limit: int = Field(
         1280, description="Resize limit for hd_strategy=RESIZE"
     )
+    hd_strategy_tile_size: int = Field(
+        1024,
+        ge=64,
+        description="Tile size for hd_strategy=TILE, images whose longer side is not larger than this value are not tiled",
+    )
+    hd_strategy_tile_overlap: int = Field(
+        128,
+        ge=0,
+        description="Overlap of neighbouring tiles for hd_strategy=TILE, seams are blended over the overlap",
+    )
 
     prompt: str = Field("", description="Prompt for diffusion models.")
     negative_prompt: str = Field(
@@ -356,6 +418,8 @@ class InpaintRequest(BaseModel):
         description="Seed for diffusion model. -1 mean random seed",
         validate_default=True,
     )
+    # sd_seed was -1 and replaced by a random seed
+    _random_seed: bool = PrivateAttr(False)
     sd_match_histograms: bool = Field(
         False,
         description="Match histograms between inpainting area and original image.",
@@ -369,6 +433,11 @@ class InpaintRequest(BaseModel):
         description="Enable lcm-lora mode. https://huggingface.co/docs/diffusers/main/en/using-diffusers/inference_with_lcm#texttoimage",
     )
 
+    sd_loras: List[SDLora] = Field(
+        [],
+        description="LoRAs fused into the diffusion model, available LoRAs: /api/v1/loras",
+    )
+
     sd_keep_unmasked_area: bool = Field(
         True, description="Keep unmasked area unchanged"
     )
@@ -422,8 +491,14 @@ class InpaintRequest(BaseModel):
     def validate_field(cls, values: "InpaintRequest"):
         if values.sd_seed == -1:
             values.sd_seed = random.randint(1, 99999999)
+            values._random_seed = True
             logger.info(f"Generate random seed: {values.sd_seed}")
 
+        if values.hd_strategy_tile_overlap >= values.hd_strategy_tile_size:
+            raise ValueError(
+                "hd_strategy_tile_overlap must be smaller than hd_strategy_tile_size"
+            )
+
         if values.use_extender and values.enable_controlnet:
             logger.info("Extender is enabled, set controlnet_conditioning_scale=0")
             values.controlnet_conditioning_scale = 0
@@ -450,7 +525,13 @@ class InpaintRequest(BaseModel):
 
 class RunPluginRequest(BaseModel):
     name: str
-    image: str = Field(..., description="base64 encoded image")
+    image: Optional[str] = Field(None, description="base64 encoded image")
+    session_id: Optional[str] = Field(
+        None, description="Image session id, use the session image instead of image"
+    )
+    session_version: Optional[int] = Field(
+        None, description="Version of the session image, latest version by default"
+    )
     clicks: List[List[int]] = Field(
         [], description="Clicks for interactive seg, [[x,y,0/1], [x2,y2,0/1]]"
     )
@@ -491,10 +572,172 @@ class ServerConfigResponse(BaseModel):
     samplers: List[str]
 
 
+class ProfileMode(Choices):
+    # stage breakdown in Server-Timing response header
+    timing = "timing"
+    # also save a torch profiler trace, requires admin token
+    trace = "trace"
+
+
+class ResponseFormat(Choices):
+    # encoded image, same format as the input image
+    image = "image"
+    # uint8 pixel buffer in HWC order, shape in X-Width/X-Height/X-Channels headers
+    raw = "raw"
+
+
+class ImageSessionInfo(BaseModel):
+    session_id: str
+    width: int
+    height: int
+    ext: str
+    version: int
+    versions: List[int]
+    has_mask: bool
+
+
+class ResultCacheStats(BaseModel):
+    hits: int
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    memory_items: int
+    memory_bytes: int
+    memory_budget: int
+    disk_items: int
+    disk_bytes: int
+    disk_budget: int
+
+
+class JobStatus(Choices):
+    pending = "pending"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class WarmupStatus(Choices):
+    pending = "pending"
+    running = "running"
+    finished = "finished"
+    # all attempts failed, the server is ready but may be degraded
+    failed = "failed"
+
+
+class WarmupInfo(BaseModel):
+    ready: bool
+    status: WarmupStatus
+    duration: Optional[float] = Field(None, description="Warm-up time in seconds")
+    attempts: int = Field(0, description="Warm-up attempts, failed ones are retried")
+    error: Optional[str] = Field(None, description="Error of the last failed attempt")
+
+
+class RequestCost(BaseModel):
+    pixels: int = Field(description="Pixels the model runs on")
+    steps: int = Field(description="Denoising steps, 1 for erase models")
+    compute: float = Field(description="Megapixels * steps * extra network factor")
+    memory: float = Field(description="Estimated peak activation memory in MB")
+    latency: float = Field(description="Estimated process time in seconds")
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: JobStatus
+    queue_position: int = Field(0, description="Number of jobs ahead in the queue")
+    estimated_wait: float = Field(
+        0, description="Estimated seconds until the job is finished"
+    )
+    process_time: Optional[float] = Field(None, description="Process time in seconds")
+    error: Optional[str] = None
+
+
+class WorkerInfo(BaseModel):
+    worker_id: int
+    device: str
+    cpu_cores: Optional[List[int]] = None
+    pid: Optional[int] = None
+    alive: bool
+    ready: bool
+    in_flight: int
+    processed: int
+    restarts: int
+
+
+class ModelLocation(Choices):
+    device = "device"
+    host = "host"
+
+
+class CachedModelInfo(BaseModel):
+    name: str
+    device: str
+    location: ModelLocation
+    device_bytes: int
+    host_bytes: int
+    in_use: int
+    current: bool
+
+
+class SharedComponentInfo(BaseModel):
+    name: str
+    key: str
+    refs: int = Field(description="Number of loaded pipelines using the component")
+    bytes: int
+
+
+class ModelCacheStats(BaseModel):
+    hits: int
+    loads: int
+    promotions: int
+    demotions: int
+    evictions: int
+    device_bytes: int
+    device_budget: int
+    host_bytes: int
+    host_budget: int
+    models: List[CachedModelInfo] = Field(
+        [], description="Cached models, most recently used first"
+    )
+    components: List[SharedComponentInfo] = Field(
+        [], description="Diffusion pipeline components shared by the cached models"
+    )
+
+
 class SwitchModelRequest(BaseModel):
     name: str
 
 
+class ModelLoadRequest(BaseModel):
+    name: str
+    switch: bool = Field(
+        False,
+        description="Switch to the model once it is loaded, the current model keeps "
+        "serving requests meanwhile. Otherwise it is only loaded into the model cache, "
+        "as a hint for the next likely model",
+    )
+
+
+class ModelLoadStatus(Choices):
+    queued = "queued"
+    loading = "loading"
+    ready = "ready"
+    failed = "failed"
+
+
+class ModelLoadInfo(BaseModel):
+    name: str
+    switch: bool
+    status: ModelLoadStatus
+    progress: Optional[float] = Field(
+        None,
+        description="0-1, estimated from the last load time of the model, "
+        "None when it was not loaded before",
+    )
+    elapsed: Optional[float] = Field(None, description="Load time in seconds")
+    error: Optional[str] = None
+
+
 class SwitchPluginModelRequest(BaseModel):
     plugin_name: str
     model_name: str
@@ -504,8 +747,11 @@ AdjustMaskOperate = Literal["expand", "shrink", "reverse"]
 
 
 class AdjustMaskRequest(BaseModel):
-    mask: str = Field(
-        ..., description="base64 encoded mask. 255 means area to do inpaint"
+    mask: Optional[str] = Field(
+        None, description="base64 encoded mask. 255 means area to do inpaint"
+    )
+    session_id: Optional[str] = Field(
+        None, description="Image session id, adjust the session mask if mask is empty"
     )
     operate: AdjustMaskOperate = Field(..., description="expand/shrink/reverse")
     kernel_size: int = Field(5, description="Kernel size for expanding mask")
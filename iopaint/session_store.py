@@ -0,0 +1,160 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from iopaint.schema import ImageSessionInfo
+
+
+def _readonly(arr: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    # arrays are shared by concurrent requests, make accidental inplace writes fail
+    if arr is None:
+        return None
+    arr = np.ascontiguousarray(arr)
+    arr.setflags(write=False)
+    return arr
+
+
+class ImageVersion:
+    def __init__(
+        self,
+        version: int,
+        image: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        ext: str,
+    ):
+        self.version = version
+        # RGB
+        self.image = _readonly(image)
+        self.alpha_channel = _readonly(alpha_channel)
+        self.ext = ext
+
+    @property
+    def nbytes(self) -> int:
+        alpha_bytes = 0 if self.alpha_channel is None else self.alpha_channel.nbytes
+        return self.image.nbytes + alpha_bytes
+
+
+class ImageSession:
+    def __init__(self, session_id: str, infos: Dict):
+        self.session_id = session_id
+        self.infos = infos
+        self.versions: List[ImageVersion] = []
+        # last mask generated or adjusted in this session, 255 means area to inpaint
+        self.mask: Optional[np.ndarray] = None
+        self.last_access = time.time()
+
+    @property
+    def nbytes(self) -> int:
+        mask_bytes = 0 if self.mask is None else self.mask.nbytes
+        return sum(it.nbytes for it in self.versions) + mask_bytes
+
+    @property
+    def latest(self) -> ImageVersion:
+        return self.versions[-1]
+
+    def get_version(self, version: Optional[int] = None) -> ImageVersion:
+        if version is None:
+            return self.latest
+        for it in self.versions:
+            if it.version == version:
+                return it
+        raise KeyError(f"Version {version} of session {self.session_id} not found")
+
+    def info(self) -> ImageSessionInfo:
+        return ImageSessionInfo(
+            session_id=self.session_id,
+            width=self.latest.image.shape[1],
+            height=self.latest.image.shape[0],
+            ext=self.latest.ext,
+            version=self.latest.version,
+            versions=[it.version for it in self.versions],
+            has_mask=self.mask is not None,
+        )
+
+
+class SessionStore:
+    """
+    Keep decoded images on the server so clients upload a photo once and refer to
+    it by session id afterwards.
+
+    Each session holds the decoded RGB array, alpha channel and image infos of
+    every version, inpaint results are appended as new versions. At most
+    ``max_versions`` versions are kept per session. Whole sessions are evicted in
+    LRU order when the total size exceeds ``memory_budget`` bytes.
+    """
+
+    def __init__(self, memory_budget: int, max_versions: int = 8):
+        self.memory_budget = memory_budget
+        self.max_versions = max_versions
+        self._sessions: "OrderedDict[str, ImageSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_budget > 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(it.nbytes for it in self._sessions.values())
+
+    def create(
+        self,
+        image: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        infos: Dict,
+        ext: str,
+    ) -> ImageSession:
+        session = ImageSession(uuid.uuid4().hex, infos)
+        session.versions.append(ImageVersion(0, image, alpha_channel, ext))
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict()
+        return session
+
+    def get(self, session_id: str) -> ImageSession:
+        with self._lock:
+            session = self._sessions[session_id]
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.time()
+            return session
+
+    def add_version(
+        self,
+        session_id: str,
+        image: np.ndarray,
+        alpha_channel: Optional[np.ndarray],
+        ext: str,
+    ) -> ImageVersion:
+        with self._lock:
+            session = self._sessions[session_id]
+            version = ImageVersion(
+                session.latest.version + 1, image, alpha_channel, ext
+            )
+            session.versions.append(version)
+            del session.versions[: -self.max_versions]
+            self._evict(keep=session_id)
+            return version
+
+    def set_mask(self, session_id: str, mask: np.ndarray):
+        with self._lock:
+            self._sessions[session_id].mask = _readonly(mask)
+            self._evict(keep=session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            del self._sessions[session_id]
+
+    def _evict(self, keep: Optional[str] = None):
+        total = self.nbytes
+        for session_id in list(self._sessions.keys()):
+            if total <= self.memory_budget:
+                break
+            if session_id == keep:
+                continue
+            total -= self._sessions.pop(session_id).nbytes
+            logger.info(f"Evict image session {session_id}")
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from iopaint.job_queue import JobCancelledError
+
+
+def single_flight_key(*parts: Union[str, bytes, None]) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode()
+        # length prefix, ("ab", "c") and ("a", "bc") are different keys
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls: the first caller of a key runs ``fn``,
+    callers arriving while it runs wait and receive the same result or error.
+    Nothing is cached once the call finished.
+
+    If the first caller's job is cancelled, e.g. its client disconnected, waiting
+    callers don't share the cancellation, one of them runs ``fn`` again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            result of fn, and whether it was shared from another caller
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+            if leader:
+                return self._run(key, call, fn), False
+
+            call.done.wait()
+            if isinstance(call.error, JobCancelledError):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+    def _run(self, key: str, call: _Call, fn: Callable[[], Any]):
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from iopaint.admission import (
+    AdmissionController,
+    AdmissionRejectedError,
+    AdmissionTimeoutError,
+    CostModel,
+)
+from iopaint.const import TILE_BATCH_SIZE
+from iopaint.schema import (
+    AdmissionPolicy,
+    HDStrategy,
+    InpaintRequest,
+    ModelInfo,
+    ModelType,
+    RequestCost,
+)
+
+LAMA = ModelInfo(name="lama", path="lama", model_type=ModelType.INPAINT)
+SDXL = ModelInfo(name="sdxl", path="sdxl", model_type=ModelType.DIFFUSERS_SDXL_INPAINT)
+
+
+def _mask(h, w):
+    mask = np.zeros((h, w), dtype=np.uint8)
+    mask[h // 4 : h // 2, w // 4 : w // 2] = 255
+    return mask
+
+
+def test_cost_model():
+    cost_model = CostModel()
+    mask = _mask(2048, 2048)
+    original = cost_model.estimate(
+        LAMA, mask, InpaintRequest(hd_strategy=HDStrategy.ORIGINAL)
+    )
+    crop = cost_model.estimate(LAMA, mask, InpaintRequest(hd_strategy=HDStrategy.CROP))
+    assert original.pixels == 2048 * 2048
+    assert crop.pixels < original.pixels
+    # 4 of the 9 tiles touch the mask, peak memory is bounded by the tiles run at once
+    tile = cost_model.estimate(
+        LAMA, mask, InpaintRequest(hd_strategy=HDStrategy.TILE)
+    )
+    assert tile.pixels == 4 * 1024 * 1024
+    assert tile.memory == pytest.approx(
+        original.memory * TILE_BATCH_SIZE * 1024 * 1024 / original.pixels
+    )
+
+    sd = cost_model.estimate(SDXL, mask, InpaintRequest(sd_steps=50))
+    sd_scaled = cost_model.estimate(
+        SDXL, mask, InpaintRequest(sd_steps=50, sd_scale=0.5)
+    )
+    assert sd.steps == 50
+    assert sd_scaled.pixels == sd.pixels // 4
+    assert sd.latency > original.latency
+
+    # latency is recalibrated from observed process time
+    cost_model.observe("sdxl", sd, sd.latency * 2)
+    assert cost_model.estimate(SDXL, mask, InpaintRequest(sd_steps=50)).latency == (
+        pytest.approx(sd.latency * 2)
+    )
+
+
+def test_admission_downscale_and_reject():
+    mask = _mask(2048, 2048)
+    req = InpaintRequest(sd_steps=50)
+    controller = AdmissionController(memory_budget=4000)
+    admitted, cost = controller.admit(SDXL, mask, req)
+    assert admitted.sd_scale < 1
+    assert cost.memory <= 4000
+    # small requests are not changed
+    small, _ = controller.admit(SDXL, _mask(512, 512), req)
+    assert small is req
+
+    req = InpaintRequest(hd_strategy=HDStrategy.ORIGINAL)
+    admitted, cost = controller.admit(LAMA, _mask(4096, 4096), req)
+    assert admitted.hd_strategy == HDStrategy.RESIZE
+    assert admitted.hd_strategy_resize_limit < 4096
+
+    controller = AdmissionController(memory_budget=4000, policy=AdmissionPolicy.reject)
+    with pytest.raises(AdmissionRejectedError):
+        controller.admit(SDXL, mask, InpaintRequest(sd_steps=50))
+
+
+def test_admission_defer():
+    controller = AdmissionController(memory_budget=100, defer_timeout=0.2)
+    cost = RequestCost(pixels=1, steps=1, compute=1, memory=60, latency=1)
+    finished = []
+
+    def run():
+        with controller.reserve(cost):
+            finished.append(time.time())
+
+    with controller.reserve(cost):
+        # the second request waits until the first one releases its memory
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.1)
+        assert not finished
+        released_at = time.time()
+    thread.join()
+    assert finished[0] >= released_at
+
+    with controller.reserve(cost):
+        with pytest.raises(AdmissionTimeoutError):
+            with controller.reserve(cost):
+                pass
+    assert controller.reserved_memory == 0
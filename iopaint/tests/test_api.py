@@ -0,0 +1,453 @@
+import asyncio
+import base64
+import threading
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from iopaint import api as api_module
+from iopaint.database import connection
+from iopaint.helper import load_img, pil_to_bytes
+from iopaint.model.opencv2 import OpenCV2
+from iopaint.schema import (
+    AdmissionPolicy,
+    ApiConfig,
+    JobStatus,
+    ModelLoadStatus,
+    RequestCost,
+    WarmupStatus,
+)
+from iopaint.warmup import Warmup
+
+API_CONFIG = dict(
+    host="127.0.0.1",
+    port=8080,
+    inbrowser=False,
+    model="cv2",
+    no_half=False,
+    low_mem=False,
+    cpu_offload=False,
+    disable_nsfw_checker=False,
+    local_files_only=True,
+    cpu_textencoder=False,
+    device="cpu",
+    input=None,
+    mask_dir=None,
+    output_dir=None,
+    quality=95,
+    enable_interactive_seg=False,
+    interactive_seg_model="vit_b",
+    interactive_seg_device="cpu",
+    enable_remove_bg=False,
+    remove_bg_device="cpu",
+    remove_bg_model="briaai/RMBG-1.4",
+    enable_anime_seg=False,
+    enable_realesrgan=False,
+    realesrgan_device="cpu",
+    realesrgan_model="realesr-general-x4v3",
+    enable_gfpgan=False,
+    gfpgan_device="cpu",
+    enable_restoreformer=False,
+    restoreformer_device="cpu",
+)
+
+
+@pytest.fixture
+def make_api(tmp_path, monkeypatch):
+    # the database and the web app folder of the server, not created in the cwd
+    engine = create_engine(f"sqlite:///{tmp_path / 'iopaint.db'}")
+    monkeypatch.setattr(connection, "engine", engine)
+    monkeypatch.setattr(connection, "SessionLocal", sessionmaker(bind=engine))
+    web_app_dir = tmp_path / "web_app"
+    web_app_dir.mkdir()
+    monkeypatch.setattr(api_module, "WEB_APP_DIR", web_app_dir)
+
+    def make(**config):
+        api = api_module.Api(FastAPI(), ApiConfig(**{**API_CONFIG, **config}))
+        api.warmup.wait()
+        return api, TestClient(api.app)
+
+    return make
+
+
+def image_and_mask(height=120, width=160):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    mask[40:80, 40:100] = 255
+    return image, mask
+
+
+def png(np_img) -> bytes:
+    return pil_to_bytes(Image.fromarray(np_img), "png")
+
+
+def b64(np_img) -> str:
+    return base64.b64encode(png(np_img)).decode()
+
+
+def inpaint_body(**kwargs):
+    image, mask = image_and_mask()
+    return {"image": b64(image), "mask": b64(mask), **kwargs}
+
+
+def block_inpaint(api, monkeypatch):
+    """Inpaint jobs wait until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+    process_inpaint = api._process_inpaint
+
+    def blocked(*args, **kwargs):
+        started.set()
+        release.wait(10)
+        return process_inpaint(*args, **kwargs)
+
+    monkeypatch.setattr(api, "_process_inpaint", blocked)
+    return started, release
+
+
+def test_job_api(make_api, monkeypatch):
+    api, client = make_api()
+    started, release = block_inpaint(api, monkeypatch)
+    try:
+        running = client.post("/api/v1/jobs/inpaint", json=inpaint_body()).json()
+        assert started.wait(10)
+        pending = client.post("/api/v1/jobs/inpaint", json=inpaint_body()).json()
+        assert pending["status"] == JobStatus.pending
+        assert pending["queue_position"] == 0
+
+        res = client.get(f"/api/v1/jobs/{pending['job_id']}/result")
+        assert res.status_code == 409
+        assert "Retry-After" in res.headers
+
+        res = client.post(f"/api/v1/jobs/{pending['job_id']}/cancel")
+        assert res.json()["status"] == JobStatus.cancelled
+        res = client.get(f"/api/v1/jobs/{pending['job_id']}/result")
+        assert res.status_code == 409
+        assert client.get("/api/v1/jobs/unknown").status_code == 404
+    finally:
+        release.set()
+
+    job = api.job_queue.get(running["job_id"])
+    assert job.wait(10)
+    res = client.get(f"/api/v1/jobs/{running['job_id']}/result")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/png"
+
+
+def test_job_queue_full(make_api, monkeypatch):
+    api, client = make_api(max_queue_size=1)
+    started, release = block_inpaint(api, monkeypatch)
+    try:
+        client.post("/api/v1/jobs/inpaint", json=inpaint_body())
+        assert started.wait(10)
+        client.post("/api/v1/jobs/inpaint", json=inpaint_body())
+        res = client.post("/api/v1/jobs/inpaint", json=inpaint_body())
+        assert res.status_code == 429
+        assert int(res.headers["Retry-After"]) >= 0
+    finally:
+        release.set()
+
+
+def test_cancel_jobs_on_socket_disconnect(make_api, monkeypatch):
+    api, client = make_api()
+    started, release = block_inpaint(api, monkeypatch)
+    try:
+        running = client.post(
+            "/api/v1/jobs/inpaint", json=inpaint_body(), headers={"X-Socket-Id": "a"}
+        ).json()
+        assert started.wait(10)
+        owned = client.post(
+            "/api/v1/jobs/inpaint", json=inpaint_body(), headers={"X-Socket-Id": "a"}
+        ).json()
+        other = client.post(
+            "/api/v1/jobs/inpaint", json=inpaint_body(), headers={"X-Socket-Id": "b"}
+        ).json()
+
+        asyncio.run(api.sio_disconnect("a"))
+        res = client.get(f"/api/v1/jobs/{owned['job_id']}").json()
+        assert res["status"] == JobStatus.cancelled
+        res = client.get(f"/api/v1/jobs/{other['job_id']}").json()
+        assert res["status"] == JobStatus.pending
+    finally:
+        release.set()
+
+    # the running job of the socket stops at its next cancellation check
+    assert api.job_queue.get(running["job_id"]).cancel_requested
+
+
+def test_inpaint_bytes_raw_format(make_api):
+    api, client = make_api()
+    image, mask = image_and_mask()
+    files = {
+        "image": ("image.png", png(image), "image/png"),
+        "mask": ("mask.png", png(mask), "image/png"),
+    }
+    res = client.post("/api/v1/inpaint_bytes", files=files)
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/png"
+    encoded = load_img(res.content)[0]
+
+    res = client.post(
+        "/api/v1/inpaint_bytes", files=files, data={"response_format": "raw"}
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/octet-stream"
+    assert res.headers["X-Width"] == "160"
+    assert res.headers["X-Height"] == "120"
+    assert res.headers["X-Channels"] == "3"
+    raw = np.frombuffer(res.content, dtype=np.uint8).reshape(120, 160, 3)
+    assert np.array_equal(raw, encoded)
+
+    res = client.post("/api/v1/inpaint_bytes", files=files, data={"params": "{"})
+    assert res.status_code == 422
+
+
+def test_result_cache_random_seed(make_api):
+    api, client = make_api()
+    # default request of the web app
+    for _ in range(2):
+        res = client.post("/api/v1/inpaint", json=inpaint_body(sd_seed=-1))
+        assert res.status_code == 200
+    stats = client.get("/api/v1/result_cache").json()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["memory_items"] == 1
+
+
+def test_image_sessions(make_api):
+    api, client = make_api(session_max_versions=2)
+    image, mask = image_and_mask()
+    res = client.post(
+        "/api/v1/sessions",
+        files={"file": ("image.png", png(image), "image/png")},
+    )
+    info = res.json()
+    session_id = info["session_id"]
+    assert (info["width"], info["height"], info["version"]) == (160, 120, 0)
+
+    # the mask is required until the session has one
+    res = client.post("/api/v1/inpaint", json={"session_id": session_id})
+    assert res.status_code == 422
+
+    body = {"session_id": session_id, "mask": b64(mask)}
+    res = client.post("/api/v1/inpaint", json=body)
+    assert res.headers["X-Session-Version"] == "1"
+    result = load_img(res.content)[0]
+    res = client.get(f"/api/v1/sessions/{session_id}/image")
+    assert res.headers["X-Session-Version"] == "1"
+    assert np.array_equal(load_img(res.content)[0], result)
+    res = client.get(f"/api/v1/sessions/{session_id}/image", params={"version": 0})
+    assert np.array_equal(load_img(res.content)[0], image)
+
+    # inpaint an older version, the result is appended as the latest version
+    res = client.post("/api/v1/inpaint", json={**body, "session_version": 0})
+    assert res.headers["X-Session-Version"] == "2"
+    assert client.get(f"/api/v1/sessions/{session_id}").json()["versions"] == [1, 2]
+    res = client.post("/api/v1/inpaint", json={**body, "session_version": 0})
+    assert res.status_code == 404
+
+    assert client.delete(f"/api/v1/sessions/{session_id}").status_code == 200
+    assert client.get(f"/api/v1/sessions/{session_id}").status_code == 404
+    res = client.post("/api/v1/inpaint", json=body)
+    assert res.status_code == 404
+
+
+def test_cancel_running_job(make_api, monkeypatch):
+    api, client = make_api()
+    started, release = threading.Event(), threading.Event()
+    forward = OpenCV2.forward
+
+    def slow_forward(self, image, mask, config):
+        started.set()
+        release.wait(10)
+        # diffusion models check for cancellation in the step callback
+        api_module.diffuser_callback(None, 0, 0)
+        return forward(self, image, mask, config)
+
+    monkeypatch.setattr(OpenCV2, "forward", slow_forward)
+    try:
+        job = client.post("/api/v1/jobs/inpaint", json=inpaint_body()).json()
+        assert started.wait(10)
+        res = client.post(f"/api/v1/jobs/{job['job_id']}/cancel")
+        assert res.json()["status"] == JobStatus.running
+    finally:
+        release.set()
+
+    assert api.job_queue.get(job["job_id"]).wait(10)
+    assert client.get(f"/api/v1/jobs/{job['job_id']}").json()["status"] == (
+        JobStatus.cancelled
+    )
+    assert client.get(f"/api/v1/jobs/{job['job_id']}/result").status_code == 409
+
+
+def test_metrics_endpoint(make_api):
+    api, client = make_api()
+    assert client.post("/api/v1/inpaint", json=inpaint_body()).status_code == 200
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'iopaint_inpaint_requests_total{model="cv2",status="finished"} 1.0' in (
+        res.text
+    )
+    assert 'iopaint_inpaint_stage_seconds_count{stage="forward",model="cv2"' in (
+        res.text
+    )
+    assert "iopaint_job_queue_depth 0" in res.text
+    assert "iopaint_ready 1" in res.text
+
+
+def test_profile_requests(make_api, tmp_path):
+    api, client = make_api(admin_token="secret", profile_dir=tmp_path / "profiles")
+    url = "/api/v1/inpaint"
+    res = client.post(url, params={"profile": "timing"}, json=inpaint_body())
+    assert res.status_code == 200
+    assert "forward;dur=" in res.headers["Server-Timing"]
+    assert "X-Profile-Trace" not in res.headers
+
+    # torch profiler traces are for admins only
+    res = client.post(url, params={"profile": "trace"}, json=inpaint_body())
+    assert res.status_code == 403
+    res = client.post(
+        url,
+        params={"profile": "trace"},
+        json=inpaint_body(),
+        headers={"X-Admin-Token": "wrong"},
+    )
+    assert res.status_code == 403
+    res = client.post(
+        url,
+        params={"profile": "trace"},
+        json=inpaint_body(),
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert res.status_code == 200
+    trace_url = res.headers["X-Profile-Trace"]
+    assert client.get(trace_url).status_code == 403
+    res = client.get(trace_url, headers={"X-Admin-Token": "secret"})
+    assert res.status_code == 200
+    assert "traceEvents" in res.json()
+    res = client.get(
+        "/api/v1/profiles/missing.json", headers={"X-Admin-Token": "secret"}
+    )
+    assert res.status_code == 404
+
+
+def test_profile_trace_without_profile_dir(make_api):
+    api, client = make_api(admin_token="secret")
+    res = client.post(
+        "/api/v1/inpaint",
+        params={"profile": "trace"},
+        json=inpaint_body(),
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert res.status_code == 422
+
+
+def test_admission(make_api):
+    api, client = make_api(admission_memory_budget=100)
+    image, mask = image_and_mask(1000, 1000)
+    big = {"image": b64(image), "mask": b64(mask), "hd_strategy": "Original"}
+    res = client.post("/api/v1/inpaint", json=big)
+    assert res.status_code == 200
+    assert res.headers["X-Admission"] == "downscaled"
+    # the full size result is still 1000x1000
+    assert load_img(res.content)[0].shape == (1000, 1000, 3)
+    res = client.post("/api/v1/inpaint", json=inpaint_body())
+    assert res.headers["X-Admission"] == "admitted"
+
+    # no memory budget left while other requests run
+    api.admission.defer_timeout = 0.2
+    running = RequestCost(pixels=0, steps=1, compute=0, memory=100, latency=0)
+    with api.admission.reserve(running):
+        res = client.post("/api/v1/inpaint", json=inpaint_body(cv2_radius=5))
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+
+    api.admission.policy = AdmissionPolicy.reject
+    res = client.post("/api/v1/inpaint", json=big)
+    assert res.status_code == 413
+
+
+def test_coalesce_identical_requests(make_api, monkeypatch):
+    api, client = make_api()
+    started, release = threading.Event(), threading.Event()
+    forward, calls = OpenCV2.forward, []
+
+    def slow_forward(self, image, mask, config):
+        calls.append(config.sd_seed)
+        started.set()
+        release.wait(10)
+        return forward(self, image, mask, config)
+
+    monkeypatch.setattr(OpenCV2, "forward", slow_forward)
+    entered = threading.Semaphore(0)
+    do = api.single_flight.do
+
+    def counted_do(key, fn):
+        entered.release()
+        return do(key, fn)
+
+    monkeypatch.setattr(api.single_flight, "do", counted_do)
+
+    # double click in the web app, both requests ask for a random seed
+    responses = []
+
+    def post():
+        body = inpaint_body(sd_seed=-1)
+        responses.append(client.post("/api/v1/inpaint", json=body))
+
+    first = threading.Thread(target=post)
+    first.start()
+    assert started.wait(10)
+    second = threading.Thread(target=post)
+    second.start()
+    assert entered.acquire(timeout=10) and entered.acquire(timeout=10)
+    release.set()
+    first.join(10)
+    second.join(10)
+
+    assert len(calls) == 1
+    assert [it.status_code for it in responses] == [200, 200]
+    assert responses[0].content == responses[1].content
+    text = client.get("/metrics").text
+    assert 'iopaint_coalesced_requests_total{endpoint="inpaint"} 1.0' in text
+
+
+def test_health_after_failed_warmup(make_api, monkeypatch):
+    def broken_forward(self, image, mask, config):
+        raise RuntimeError("CUDA out of memory")
+
+    monkeypatch.setattr(Warmup, "retry_delay", 0)
+    monkeypatch.setattr(OpenCV2, "forward", broken_forward)
+    api, client = make_api(warmup_sizes="64")
+    live = client.get("/api/v1/health/live").json()
+    assert live["status"] == WarmupStatus.failed
+    assert live["attempts"] == Warmup.retries + 1
+    assert live["error"] == "CUDA out of memory"
+    # not restarted by the orchestrator, the failure is reported in the status
+    res = client.get("/api/v1/health/ready")
+    assert res.status_code == 200
+    assert res.json()["ready"]
+
+
+def test_prefetch_with_default_model_cache_budgets(make_api, monkeypatch):
+    api, client = make_api()
+    available_models = dict(api.model_manager.available_models)
+    available_models["other"] = available_models["cv2"]
+    monkeypatch.setattr(api.model_manager, "available_models", available_models)
+
+    res = client.post("/api/v1/model/load", json={"name": "other", "switch": False})
+    assert res.status_code == 409
+    assert "--model-cache-device-budget" in res.json()["detail"]
+    assert api.model_loader.infos() == []
+
+    # the current model stays cached
+    res = client.post("/api/v1/model/load", json={"name": "cv2", "switch": False})
+    assert res.status_code == 200
+    assert api.model_loader.wait(5)
+    assert api.model_loader.info("cv2").status == ModelLoadStatus.ready
@@ -0,0 +1,182 @@
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+from iopaint.admission import _crop_pixels
+from iopaint.helper import boxes_from_mask
+from iopaint.model.batcher import MicroBatcher
+from iopaint.model.opencv2 import OpenCV2
+from iopaint.model_cache import ModelCache
+from iopaint.schema import HDStrategy, InpaintRequest
+from iopaint.tests.utils import get_config, get_data
+
+
+class BatchOpenCV2(OpenCV2):
+    supports_batch = True
+
+    def init_model(self, device, **kwargs):
+        self.batch_sizes = []
+
+    def forward_batch(self, images, masks, config):
+        self.batch_sizes.append(len(images))
+        return super().forward_batch(images, masks, config)
+
+
+def test_micro_batcher():
+    batcher = MicroBatcher(max_batch_size=4, max_wait_ms=200)
+    model = BatchOpenCV2(torch.device("cpu"), batcher=batcher)
+    # 256x256 is already a multiple of bucket size, batched result equal to non-batched result
+    img, mask = get_data()
+    cfg = get_config(strategy=HDStrategy.ORIGINAL)
+    expected = OpenCV2(torch.device("cpu"))(img, mask, cfg)
+
+    results = [None] * 4
+
+    def run(i):
+        results[i] = model(img, mask, cfg)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(model.batch_sizes) == 4
+    assert max(model.batch_sizes) > 1
+    for res in results:
+        assert np.array_equal(res, expected)
+
+
+def test_micro_batcher_bucket():
+    batcher = MicroBatcher(max_batch_size=4, max_wait_ms=0, bucket_mod=64)
+    model = BatchOpenCV2(torch.device("cpu"), batcher=batcher)
+    img, mask = get_data(fx=0.9, fy=0.7)
+    assert batcher.bucket_size(img) == (192, 256)
+
+    cfg = get_config(strategy=HDStrategy.ORIGINAL)
+    res = model(img, mask, cfg)
+    assert res.shape == img.shape
+    # a single request is not padded to the bucket size
+    assert model.batch_sizes == []
+    assert np.array_equal(res, OpenCV2(torch.device("cpu"))(img, mask, cfg))
+
+
+def scattered_mask(height, width, boxes):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for l, t, r, b in boxes:
+        mask[t:b, l:r] = 255
+    return mask
+
+
+def test_merge_crop_boxes():
+    model = OpenCV2(torch.device("cpu"))
+    image = np.zeros((600, 800, 3), dtype=np.uint8)
+    # two letters next to each other and one far away
+    boxes = [(100, 100, 120, 130), (125, 100, 145, 130), (600, 400, 620, 430)]
+    mask = scattered_mask(600, 800, boxes)
+    cfg = get_config(strategy=HDStrategy.CROP)
+
+    merged = model._merge_boxes(image, mask, boxes_from_mask(mask), cfg)
+    assert sorted(list(map(int, it)) for it in merged) == [
+        [100, 100, 145, 130],
+        [600, 400, 620, 430],
+    ]
+    # merged crop would be larger than max_size
+    merged = model._merge_boxes(
+        image, mask, boxes_from_mask(mask), cfg, max_size=64
+    )
+    assert len(merged) == 3
+
+
+def test_merge_crop_boxes_max_size():
+    # scattered text all over the image, the crops of neighbours overlap
+    boxes = [
+        (40 + 110 * i, 40 + 110 * j, 60 + 110 * i, 60 + 110 * j)
+        for i in range(17)
+        for j in range(17)
+    ]
+    mask = scattered_mask(2000, 2000, boxes)
+    image = np.zeros((2000, 2000, 3), dtype=np.uint8)
+    cfg = InpaintRequest(hd_strategy=HDStrategy.CROP)
+    model = OpenCV2(torch.device("cpu"))
+
+    merged = model._merge_boxes(
+        image,
+        mask,
+        boxes_from_mask(mask),
+        cfg,
+        max_size=cfg.hd_strategy_crop_trigger_size,
+    )
+    crops = [model._crop_box(image, mask, box, cfg)[2] for box in merged]
+    assert 1 < len(crops) < len(boxes)
+    assert max(max(r - l, b - t) for l, t, r, b in crops) <= 800
+    # admission estimates the same crops
+    assert _crop_pixels(mask, cfg) == sum((r - l) * (b - t) for l, t, r, b in crops)
+
+
+def test_batched_crops():
+    model = BatchOpenCV2(torch.device("cpu"))
+    img, _ = get_data()
+    img = cv2.resize(img, (800, 600))
+    boxes = [
+        (50 + 150 * i, 50 + 120 * (i % 3), 70 + 150 * i, 80 + 120 * (i % 3))
+        for i in range(5)
+    ]
+    mask = scattered_mask(600, 800, boxes)
+    cfg = get_config(strategy=HDStrategy.CROP)
+
+    res = model(img, mask, cfg)
+    assert res.shape == img.shape
+    # all 5 crops fall into the same bucket
+    assert model.batch_sizes == [5]
+
+    # batch size is limited
+    model.batch_sizes = []
+    model.crop_batch_size = 2
+    batched = model(img, mask, cfg)
+    assert model.batch_sizes == [2, 2]
+    assert np.array_equal(batched, res)
+    # unmasked area is kept
+    keep = mask < 127
+    assert np.array_equal(res[keep], img[:, :, ::-1][keep])
+
+
+def test_batched_crops_micro_batcher():
+    batcher = MicroBatcher(max_batch_size=4, max_wait_ms=0)
+    model = BatchOpenCV2(torch.device("cpu"), batcher=batcher)
+    img, _ = get_data()
+    img = cv2.resize(img, (800, 600))
+    boxes = [(50 + 150 * i, 50, 70 + 150 * i, 80) for i in range(5)]
+    mask = scattered_mask(600, 800, boxes)
+
+    res = model(img, mask, get_config(strategy=HDStrategy.CROP))
+    assert res.shape == img.shape
+    # crops of one request are queued at once and batched by the batcher
+    assert model.batch_sizes == [4]
+
+
+def test_micro_batcher_pins_model():
+    cache = ModelCache()
+    batcher = MicroBatcher(max_batch_size=2, max_wait_ms=200, model_cache=cache)
+    model = BatchOpenCV2(torch.device("cpu"), batcher=batcher)
+    cache.put("cv2", model, torch.device("cpu"))
+    pins = []
+    forward_batch = model.forward_batch
+
+    def pinned_forward_batch(images, masks, config):
+        pins.append(cache.stats().models[0].in_use)
+        return forward_batch(images, masks, config)
+
+    model.forward_batch = pinned_forward_batch
+    img, mask = get_data()
+    cfg = get_config(strategy=HDStrategy.ORIGINAL)
+    threads = [threading.Thread(target=model, args=(img, mask, cfg)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert pins == [1]
+    assert cache.stats().models[0].in_use == 0
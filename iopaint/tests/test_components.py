@@ -0,0 +1,78 @@
+import gc
+import os
+from types import SimpleNamespace
+
+import torch
+
+from iopaint.model.components import (
+    ComponentRegistry,
+    component_key,
+    weights_fingerprint,
+)
+
+
+class Owner:
+    pass
+
+
+def test_weights_fingerprint(tmp_path):
+    blob = tmp_path / "blobs" / "0123abcd"
+    blob.parent.mkdir()
+    blob.write_bytes(b"weights")
+    vae_dir = tmp_path / "snapshot" / "vae"
+    vae_dir.mkdir(parents=True)
+    os.symlink(blob, vae_dir / "diffusion_pytorch_model.fp16.safetensors")
+    assert weights_fingerprint(str(tmp_path / "snapshot"), "vae") == "0123abcd"
+
+    unet_dir = tmp_path / "snapshot" / "unet"
+    unet_dir.mkdir()
+    (unet_dir / "diffusion_pytorch_model.safetensors").write_bytes(b"unet")
+    fingerprint = weights_fingerprint(str(tmp_path / "snapshot"), "unet")
+    assert fingerprint == weights_fingerprint(str(tmp_path / "snapshot"), "unet")
+    assert fingerprint != "0123abcd"
+
+    key = component_key(str(tmp_path / "snapshot"), "vae", torch.float16, "cuda")
+    assert key != component_key(
+        str(tmp_path / "snapshot"), "vae", torch.float32, "cuda"
+    )
+    assert key != component_key(
+        str(tmp_path / "snapshot"), "vae", torch.float16, "cuda", tag="brushnet"
+    )
+
+
+def test_component_registry_refcount():
+    registry = ComponentRegistry()
+    keys = {"vae": "vae-key", "unet": "unet-key"}
+    vae, unet = torch.nn.Linear(2, 2), torch.nn.Linear(2, 2)
+    owner1 = Owner()
+    registry.register(owner1, keys, SimpleNamespace(vae=vae, unet=unet))
+    assert registry.lookup({"vae": "vae-key", "text_encoder": "te-key"}) == {
+        "vae": vae
+    }
+
+    owner2 = Owner()
+    other_unet = torch.nn.Linear(2, 2)
+    registry.register(owner2, keys, SimpleNamespace(vae=vae, unet=other_unet))
+    refs = {it.name: it.refs for it in registry.stats()}
+    # owner2 loaded its own unet, only the registered one is shared
+    assert refs == {"vae": 2, "unet": 1}
+
+    del owner1
+    gc.collect()
+    assert {it.name: it.refs for it in registry.stats()} == {"vae": 1}
+    del owner2
+    gc.collect()
+    assert len(registry) == 0
+
+
+def test_component_registry_register_again():
+    registry = ComponentRegistry()
+    owner = Owner()
+    old, new = torch.nn.Linear(2, 2), torch.nn.Linear(2, 2)
+    finalizer = registry.register(
+        owner, {"controlnet": "a"}, SimpleNamespace(controlnet=old)
+    )
+    finalizer()
+    registry.register(owner, {"controlnet": "b"}, SimpleNamespace(controlnet=new))
+    assert registry.lookup({"controlnet": "a"}) == {}
+    assert registry.lookup({"controlnet": "b"}) == {"controlnet": new}
@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ["torch", "diffusers", "transformers"]
+
+
+def _imported_modules(*modules: str) -> dict:
+    code = "; ".join(
+        [f"import {it}" for it in modules]
+        + [
+            "import sys, json",
+            f"print(json.dumps({{m: m in sys.modules for m in {HEAVY_MODULES}}}))",
+        ]
+    )
+    out = subprocess.check_output([sys.executable, "-c", code], text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_cli_import_is_light():
+    res = _imported_modules(
+        "iopaint.cli", "iopaint.download", "iopaint.model", "iopaint.plugins"
+    )
+    assert not any(res.values()), res
+
+
+def test_model_manager_import_without_diffusers():
+    res = _imported_modules("iopaint.model_manager")
+    assert not res["diffusers"]
+    assert not res["transformers"]
+
+
+def test_lazy_model_registry():
+    from iopaint.model import models, erase_models, LaMa
+
+    assert "lama" in erase_models
+    assert "runwayml/stable-diffusion-inpainting" not in erase_models
+    assert set(erase_models) < set(models)
+    assert models["lama"] is LaMa
+    assert models["cv2"].name == "cv2"
+    assert erase_models["cv2"].is_erase_model
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+import torch
+
+from iopaint.helper import jit_cache_path, load_jit_model
+from iopaint.model_cache import ModelCache, model_memory
+
+
+@pytest.fixture(autouse=True)
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "models"))
+
+
+class Net(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 8, 3, padding=1)
+        self.bn = torch.nn.BatchNorm2d(8)
+        self.out = torch.nn.Conv2d(8, 3, 3, padding=1)
+
+    def forward(self, image, mask):
+        x = torch.relu(self.bn(self.conv(torch.cat([image, mask], dim=1))))
+        return self.out(x)
+
+
+def save_jit_model(tmp_path) -> str:
+    (tmp_path / "checkpoints").mkdir()
+    model_path = str(tmp_path / "checkpoints" / "net.pt")
+    torch.jit.save(torch.jit.script(Net().eval()), model_path)
+    return model_path
+
+
+def test_load_optimized_jit_model(tmp_path, monkeypatch):
+    model_path = save_jit_model(tmp_path)
+    image, mask = torch.rand(1, 3, 32, 32), torch.rand(1, 1, 32, 32)
+    plain = load_jit_model(model_path, "cpu", None)
+    optimized = load_jit_model(model_path, "cpu", None, optimize=True)
+    assert os.path.exists(jit_cache_path(model_path, "cpu"))
+    # nothing is written next to the checkpoint
+    assert os.listdir(tmp_path / "checkpoints") == ["net.pt"]
+    with torch.inference_mode():
+        assert torch.allclose(plain(image, mask), optimized(image, mask), atol=1e-5)
+
+    def no_freeze(*args, **kwargs):
+        raise AssertionError("frozen model should be loaded from the cache")
+
+    monkeypatch.setattr(torch.jit, "freeze", no_freeze)
+    cached = load_jit_model(model_path, "cpu", None, optimize=True)
+    with torch.inference_mode():
+        assert torch.allclose(plain(image, mask), cached(image, mask), atol=1e-5)
+
+
+def test_load_jit_model_optimize_fallback(tmp_path, monkeypatch):
+    model_path = save_jit_model(tmp_path)
+
+    def broken_freeze(*args, **kwargs):
+        raise RuntimeError("freeze failed")
+
+    monkeypatch.setattr(torch.jit, "freeze", broken_freeze)
+    model = load_jit_model(model_path, "cpu", None, optimize=True)
+    assert not os.path.exists(jit_cache_path(model_path, "cpu"))
+    output = model(torch.rand(1, 3, 8, 8), torch.rand(1, 1, 8, 8))
+    assert output.shape == (1, 3, 8, 8)
+
+
+def test_load_jit_model_cache_not_writable(tmp_path):
+    model_path = save_jit_model(tmp_path)
+    # a file where the cache folder should be
+    (tmp_path / "models").write_text("")
+    model = load_jit_model(model_path, "cpu", None, optimize=True)
+    assert not hasattr(model, "frozen_bytes")
+    output = model(torch.rand(1, 3, 8, 8), torch.rand(1, 1, 8, 8))
+    assert output.shape == (1, 3, 8, 8)
+
+
+def test_jit_cache_path():
+    path = jit_cache_path("/models/net.pt", "cpu", "md5")
+    assert path == jit_cache_path("/other/net.pt", "cpu", "md5")
+    assert path != jit_cache_path("/models/net.pt", "cuda", "md5")
+    assert path != jit_cache_path("/models/net.pt", "cpu", "other")
+
+
+class JitModel:
+    def __init__(self, model, device):
+        self.device = torch.device(device)
+        self.model = model
+
+
+def test_frozen_model_in_model_cache(tmp_path):
+    model_path = save_jit_model(tmp_path)
+    size = os.path.getsize(model_path)
+    optimized = load_jit_model(model_path, "cpu", None, optimize=True)
+    # frozen weights are constants, the checkpoint size is accounted instead
+    assert model_memory(JitModel(optimized, "cpu")) == (0, size)
+    assert model_memory(JitModel(optimized, "cuda")) == (size, 0)
+
+    # frozen models can't be moved to host memory, they are evicted
+    cache = ModelCache(device_budget=size, host_budget=size * 4)
+    cache.put("a", JitModel(optimized, "cuda"), torch.device("cuda"))
+    cache.put("b", JitModel(optimized, "cuda"), torch.device("cuda"))
+    assert "a" not in cache and "b" in cache
+    assert cache.stats().demotions == 0
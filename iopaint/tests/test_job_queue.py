@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from iopaint.job_queue import (
+    JobCancelledError,
+    JobQueue,
+    QueueFullError,
+    raise_if_cancelled,
+)
+from iopaint.schema import JobStatus
+
+
+def test_job_queue_run_in_order():
+    queue = JobQueue(max_queue_size=8)
+    results = []
+    jobs = [queue.submit(results.append, i) for i in range(5)]
+    for job in jobs:
+        assert job.wait(timeout=5)
+        assert job.status == JobStatus.finished
+    assert results == list(range(5))
+    assert queue.get(jobs[0].job_id) is jobs[0]
+
+
+def test_job_queue_failed_job():
+    queue = JobQueue(max_queue_size=8)
+
+    def fail():
+        raise ValueError("boom")
+
+    job = queue.submit(fail)
+    assert job.wait(timeout=5)
+    assert job.status == JobStatus.failed
+    assert isinstance(job.error, ValueError)
+    assert "boom" in queue.info(job).error
+
+
+def test_job_queue_full():
+    queue = JobQueue(max_queue_size=2)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    running = queue.submit(block)
+    assert started.wait(timeout=5)
+    pending = [queue.submit(block), queue.submit(block)]
+    assert queue.info(pending[1]).queue_position == 1
+
+    with pytest.raises(QueueFullError) as e:
+        queue.submit(block)
+    assert e.value.retry_after > 0
+
+    release.set()
+    for job in [running, *pending]:
+        assert job.wait(timeout=5)
+    assert queue.depth == 0
+
+
+def test_job_queue_cancel():
+    queue = JobQueue(max_queue_size=8)
+    started = threading.Event()
+    steps = []
+
+    def long_job():
+        started.set()
+        while True:
+            raise_if_cancelled()
+            steps.append(1)
+            time.sleep(0.01)
+
+    running = queue.submit(long_job)
+    pending = queue.submit(long_job)
+    assert started.wait(timeout=5)
+
+    queue.cancel(pending.job_id)
+    assert pending.done
+    assert pending.status == JobStatus.cancelled
+    assert queue.depth == 0
+
+    queue.cancel(running.job_id)
+    assert running.wait(timeout=5)
+    assert running.status == JobStatus.cancelled
+    assert isinstance(running.error, JobCancelledError)
+    assert queue.active_jobs() == []
@@ -0,0 +1,18 @@
+import io
+
+import torch
+from PIL import Image
+
+from iopaint.model.helper.latent_preview import latents_to_preview, latents_to_rgb
+
+
+def test_latents_to_rgb():
+    latents = torch.randn(2, 4, 64, 80, dtype=torch.float16)
+    for sdxl in [False, True]:
+        rgb = latents_to_rgb(latents, sdxl=sdxl)
+        assert rgb.shape == (64, 80, 3)
+        assert rgb.dtype.name == "uint8"
+
+    preview = Image.open(io.BytesIO(latents_to_preview(latents)))
+    assert preview.format == "JPEG"
+    assert preview.size == (80, 64)
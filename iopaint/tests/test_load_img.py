@@ -1,4 +1,13 @@
-from iopaint.helper import load_img
+import base64
+
+import numpy as np
+
+from iopaint.helper import (
+    load_img,
+    decode_base64_to_image,
+    decode_bytes_to_image,
+    numpy_to_raw_bytes,
+)
 from iopaint.tests.utils import current_dir
 
 png_img_p = current_dir / "image.png"
@@ -17,3 +26,19 @@ def test_load_jpg_image():
         np_img, alpha_channel = load_img(f.read())
     assert np_img.shape == (394, 448, 3)
     assert alpha_channel is None
+
+
+def test_decode_bytes_to_image():
+    with open(png_img_p, "rb") as f:
+        image_bytes = f.read()
+    np_img, alpha_channel, _, ext = decode_bytes_to_image(image_bytes)
+    b64_img, b64_alpha, _, _ = decode_base64_to_image(
+        base64.b64encode(image_bytes).decode()
+    )
+    assert ext == "png"
+    assert np.array_equal(np_img, b64_img)
+    assert np.array_equal(alpha_channel, b64_alpha)
+
+    content, headers = numpy_to_raw_bytes(np_img)
+    assert headers == {"X-Width": "256", "X-Height": "256", "X-Channels": "3"}
+    assert np.array_equal(np.frombuffer(content, np.uint8).reshape(256, 256, 3), np_img)
@@ -0,0 +1,139 @@
+import pytest
+import torch
+
+from iopaint.model.lora import LoraManager, lora_adapter_name
+from iopaint.model_manager import ModelManager
+from iopaint.schema import InpaintRequest, SDLora
+
+peft = pytest.importorskip("peft")
+
+
+class UNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.to_q = torch.nn.Linear(8, 8)
+        self.to_k = torch.nn.Linear(8, 8)
+
+    def forward(self, x):
+        return self.to_k(self.to_q(x))
+
+
+class FakePipeline:
+    """load_lora_weights of diffusers' LoraLoaderMixin"""
+
+    def __init__(self, unet=None, text_encoder=None):
+        torch.manual_seed(0)
+        self.unet = unet or UNet()
+        self.text_encoder = text_encoder
+        self.loaded = []
+
+    def load_lora_weights(self, path, weight_name=None, adapter_name=None, **kwargs):
+        modules = [it for it in [self.unet, self.text_encoder] if it is not None]
+        for module in modules:
+            if adapter_name in getattr(module, "peft_config", {}):
+                raise ValueError(f"Adapter name {adapter_name} already in use")
+        torch.manual_seed(len(self.loaded))
+        config = peft.LoraConfig(
+            r=2, target_modules=[path], init_lora_weights=False
+        )
+        for module in modules:
+            peft.inject_adapter_in_model(config, module, adapter_name)
+        self.loaded.append(path)
+
+
+def peft_output(x, loras):
+    """Output of the same unet with the adapters applied by peft"""
+    pipe = FakePipeline()
+    for path, weight_name, _ in loras:
+        pipe.load_lora_weights(path, weight_name, lora_adapter_name(path, weight_name))
+    for it in pipe.unet.modules():
+        if isinstance(it, peft.tuners.lora.LoraLayer):
+            it.enable_adapters(True)
+            names = [lora_adapter_name(p, w) for p, w, _ in loras]
+            it.set_adapter([n for n in names if n in it.lora_A])
+            for (path, weight_name, scale), name in zip(loras, names):
+                if name in it.lora_A:
+                    it.scaling[name] = scale * it.lora_alpha[name] / it.r[name]
+    with torch.no_grad():
+        return pipe.unet(x)
+
+
+def test_fused_loras(monkeypatch):
+    pipe = FakePipeline()
+    manager = LoraManager(max_variants=2)
+    x = torch.randn(2, 8)
+    with torch.no_grad():
+        base = pipe.unet(x)
+    loras = [("to_q", None, 0.5), ("to_k", None, 1.0)]
+
+    manager.apply(pipe, loras)
+    assert pipe.loaded == ["to_q", "to_k"]
+    with torch.no_grad():
+        fused = pipe.unet(x)
+    assert not torch.allclose(fused, base)
+    assert torch.allclose(fused, peft_output(x, loras), atol=1e-5)
+
+    manager.apply(pipe, loras[:1])
+    with torch.no_grad():
+        assert torch.allclose(
+            pipe.unet(x), peft_output(x, loras[:1]), atol=1e-5
+        )
+
+    # fused weights of the combination are cached, the adapters are not loaded again
+    def no_delta(*args, **kwargs):
+        raise AssertionError("fused weights should be cached")
+
+    monkeypatch.setattr(peft.tuners.lora.Linear, "get_delta_weight", no_delta)
+    manager.apply(pipe, loras)
+    with torch.no_grad():
+        assert torch.allclose(pipe.unet(x), fused)
+    assert pipe.loaded == ["to_q", "to_k"]
+
+    manager.apply(pipe, [])
+    with torch.no_grad():
+        assert torch.equal(pipe.unet(x), base)
+
+
+def test_lora_eviction():
+    pipe = FakePipeline()
+    manager = LoraManager(max_loras=1)
+    manager.apply(pipe, [("to_q", None, 1.0)])
+    manager.apply(pipe, [("to_k", None, 1.0)])
+    assert [n for n in pipe.unet.to_q.lora_A] == []
+    assert list(pipe.unet.to_k.lora_A) == [lora_adapter_name("to_k")]
+    assert manager.current(pipe) == ((lora_adapter_name("to_k"), 1.0),)
+
+
+def test_shared_unet_different_text_encoders():
+    unet = UNet()
+    pipe_a = FakePipeline(unet=unet, text_encoder=UNet())
+    pipe_b = FakePipeline(unet=unet, text_encoder=UNet())
+    manager = LoraManager()
+    x = torch.randn(2, 8)
+    with torch.no_grad():
+        base = pipe_b.text_encoder(x)
+    loras = [("to_q", None, 1.0)]
+
+    manager.apply(pipe_a, loras)
+    with torch.no_grad():
+        fused_unet = unet(x)
+    manager.apply(pipe_b, loras)
+    assert pipe_b.loaded == ["to_q"]
+    assert manager.current(pipe_a) == manager.current(pipe_b)
+    with torch.no_grad():
+        assert not torch.allclose(pipe_b.text_encoder(x), base)
+        assert torch.allclose(unet(x), fused_unet)
+
+    manager.apply(pipe_b, [])
+    assert manager.current(pipe_a) is None
+    with torch.no_grad():
+        assert torch.equal(pipe_b.text_encoder(x), base)
+    manager.apply(pipe_a, loras)
+    with torch.no_grad():
+        assert torch.allclose(unet(x), fused_unet)
+
+
+def test_loras_on_unsupported_model():
+    model = ModelManager(name="cv2", device=torch.device("cpu"))
+    with pytest.raises(ValueError):
+        model.apply_loras(InpaintRequest(sd_loras=[SDLora(name="lora")]))
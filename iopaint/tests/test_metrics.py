@@ -0,0 +1,60 @@
+import sys
+
+from iopaint import metrics as metrics_module
+from iopaint.metrics import (
+    Metrics,
+    StageTimer,
+    current_timer,
+    process_rss,
+    size_bucket,
+    stage,
+)
+from iopaint.schema import HDStrategy
+
+
+def test_metrics_render():
+    metrics = Metrics()
+    timer = StageTimer()
+    timer.add("decode", 0.02)
+    timer.add("forward", 1.5)
+    timer.add("forward", 1.5)
+    metrics.observe_stages(timer, "lama", HDStrategy.CROP, size_bucket(600, 800))
+    metrics.inpaint_requests.inc(model="lama", status="finished")
+
+    text = metrics.render()
+    labels = 'stage="forward",model="lama",hd_strategy="Crop",size="le1024"'
+    assert f'iopaint_inpaint_stage_seconds_bucket{{{labels},le="2.5"}} 0' in text
+    assert f'iopaint_inpaint_stage_seconds_bucket{{{labels},le="5.0"}} 1' in text
+    assert f'iopaint_inpaint_stage_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f"iopaint_inpaint_stage_seconds_sum{{{labels}}} 3.0" in text
+    assert 'iopaint_inpaint_requests_total{model="lama",status="finished"} 1.0' in text
+    assert "# TYPE process_resident_memory_bytes gauge" in text
+
+
+def test_metrics_without_process_rss(monkeypatch):
+    def no_procfs(*args, **kwargs):
+        raise FileNotFoundError("/proc/self/statm")
+
+    # no psutil and no procfs, e.g. windows
+    monkeypatch.setitem(sys.modules, "psutil", None)
+    monkeypatch.setattr(metrics_module, "open", no_procfs, raising=False)
+    assert process_rss() is None
+    text = Metrics().render()
+    assert "process_resident_memory_bytes" not in text
+    assert "# TYPE iopaint_inpaint_requests_total counter" in text
+
+
+def test_stage_timer_bind():
+    timer = StageTimer()
+    # no timer bound, not recorded
+    with stage("forward"):
+        pass
+    with timer.bind():
+        assert current_timer() is timer
+        with stage("forward"):
+            pass
+        with stage("forward"):
+            pass
+    assert current_timer() is None
+    assert list(timer.durations) == ["forward"]
+    assert timer.server_timing().startswith("forward;dur=")
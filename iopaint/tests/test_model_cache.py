@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import torch
+
+from iopaint.model_cache import ModelCache, model_memory
+from iopaint.model_manager import ModelManager
+from iopaint.schema import InpaintRequest, ModelLocation
+from iopaint.tests.utils import check_device
+
+
+class FakeModel:
+    def __init__(self, device: str = "cpu", size: int = 1024):
+        self.device = torch.device(device)
+        self.model = torch.nn.Linear(size // 4, 1, bias=False).to(self.device)
+        self.z = torch.zeros(4, device=self.device)
+
+
+def test_model_memory():
+    model = FakeModel(size=1024)
+    assert model_memory(model) == (0, 1024 + 4 * 4)
+
+
+def test_model_cache_evict_lru():
+    size = model_memory(FakeModel())[1]
+    cache = ModelCache(host_budget=size * 2)
+    for name in ["a", "b", "c"]:
+        cache.put(name, FakeModel(), torch.device("cpu"))
+    assert "a" not in cache
+    assert cache.get("b") is not None
+
+    cache.put("d", FakeModel(), torch.device("cpu"))
+    assert "c" not in cache
+    assert "b" in cache and "d" in cache
+    stats = cache.stats(current="d")
+    assert [it.name for it in stats.models] == ["d", "b"]
+    assert stats.models[0].current
+    assert stats.evictions == 2
+    assert stats.host_bytes == size * 2
+
+
+def test_model_cache_pinned_model_is_not_evicted():
+    cache = ModelCache()
+    cache.put("a", FakeModel(), torch.device("cpu"))
+    model = cache.acquire("a")
+    cache.make_room("b")
+    cache.put("b", FakeModel(), torch.device("cpu"))
+    assert cache.get("a") is model
+
+    cache.release("a")
+    cache.make_room("c")
+    assert "a" not in cache and "b" not in cache
+
+
+def test_model_cache_put_least_recent():
+    cache = ModelCache()
+    cache.put("a", FakeModel(), torch.device("cpu"))
+    # a prefetched model that doesn't fit is evicted instead of the current one
+    cache.put("b", FakeModel(), torch.device("cpu"), recent=False)
+    assert "a" in cache and "b" not in cache
+
+
+@pytest.mark.parametrize("device", ["cuda"])
+def test_model_cache_demote_to_host(device):
+    check_device(device)
+    size = model_memory(FakeModel(device))[0]
+    cache = ModelCache(device_budget=size, host_budget=size * 4)
+    a = FakeModel(device)
+    cache.put("a", a, torch.device(device))
+    cache.put("b", FakeModel(device), torch.device(device))
+    assert cache.stats().models[1].location == ModelLocation.host
+    assert a.model.weight.device.type == "cpu" and a.z.device.type == "cpu"
+
+    assert cache.get("a") is a
+    assert a.model.weight.device.type == device and a.z.device.type == device
+    assert cache.stats().models[1].name == "b"
+    assert cache.stats().models[1].location == ModelLocation.host
+
+
+def test_model_manager_request_model():
+    model = ModelManager(name="cv2", device=torch.device("cpu"))
+    image = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    mask[16:32, 16:32] = 255
+
+    res = model(image, mask, InpaintRequest(model="cv2"))
+    assert res.shape == image.shape
+    assert model.cache_stats().models[0].in_use == 0
+
+    with pytest.raises(NotImplementedError):
+        model(image, mask, InpaintRequest(model="not-exist"))
+    assert model.name == "cv2"
+
+    # already cached
+    model.load("cv2")
+    assert model.cache_stats().loads == 1
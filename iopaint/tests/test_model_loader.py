@@ -0,0 +1,85 @@
+import threading
+
+from iopaint.model_loader import ModelLoader
+from iopaint.schema import ModelLoadStatus
+
+
+class FakeModelManager:
+    def __init__(self):
+        self.name = "a"
+        self.loaded = []
+        # models evicted right after their load, as with model cache budgets of 0
+        self.evicted = set()
+        self.can_load = threading.Event()
+
+    @property
+    def cache(self):
+        return [it for it in self.loaded if it not in self.evicted]
+
+    def load(self, name: str, recent: bool = True):
+        assert self.can_load.wait(5)
+        if name == "broken":
+            raise ValueError("broken weights")
+        self.loaded.append(name)
+
+    def switch(self, name: str):
+        self.name = name
+
+
+def test_model_loader_prefetch():
+    manager = FakeModelManager()
+    updates = []
+    loader = ModelLoader(manager, on_update=updates.append)
+    info = loader.load("b")
+    assert info.status == ModelLoadStatus.queued and info.progress == 0
+    # the current model keeps serving while loading
+    assert manager.name == "a"
+
+    manager.can_load.set()
+    assert loader.wait(5)
+    assert manager.loaded == ["b"] and manager.name == "a"
+    info = loader.info("b")
+    assert info.status == ModelLoadStatus.ready and info.progress == 1
+    assert [it.status for it in updates] == [
+        ModelLoadStatus.queued,
+        ModelLoadStatus.loading,
+        ModelLoadStatus.ready,
+    ]
+
+
+def test_model_loader_last_switch_wins():
+    manager = FakeModelManager()
+    loader = ModelLoader(manager)
+    loader.load("b", switch=True)
+    loader.load("c", switch=True)
+    manager.can_load.set()
+    assert loader.wait(5)
+    assert manager.loaded == ["b", "c"]
+    assert manager.name == "c"
+    assert [it.name for it in loader.infos()] == ["c", "b"]
+
+
+def test_model_loader_failed():
+    manager = FakeModelManager()
+    manager.can_load.set()
+    loader = ModelLoader(manager)
+    loader.load("broken", switch=True)
+    assert loader.wait(5)
+    info = loader.info("broken")
+    assert info.status == ModelLoadStatus.failed
+    assert info.error == "broken weights"
+    assert manager.name == "a"
+
+
+
+def test_model_loader_prefetch_evicted():
+    manager = FakeModelManager()
+    manager.evicted.add("b")
+    manager.can_load.set()
+    loader = ModelLoader(manager)
+    loader.load("b")
+    assert loader.wait(5)
+    info = loader.info("b")
+    assert info.status == ModelLoadStatus.failed
+    assert "model cache budgets" in info.error
+    assert manager.name == "a"
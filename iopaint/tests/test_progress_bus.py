@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+from iopaint.progress_bus import ProgressBus
+
+
+class SlowSio:
+    def __init__(self):
+        self.emitted = []
+
+    async def emit(self, event, data=None, to=None):
+        await asyncio.sleep(0.05)
+        self.emitted.append((event, data, to))
+
+
+def _wait_idle(bus: ProgressBus, timeout=5):
+    deadline = time.time() + timeout
+    while bus._draining and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_progress_bus_coalesce_and_scope():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    sio = SlowSio()
+    bus = ProgressBus(sio)
+    # no loop bound, dropped
+    bus.emit("diffusion_progress", {"step": -1})
+    bus.bind_loop(loop)
+
+    with bus.scope(["sid1", "job1"]):
+        for step in range(20):
+            bus.emit("diffusion_progress", {"step": step})
+        bus.emit("diffusion_finish")
+    bus.emit("diffusion_progress", {"step": 100})
+    _wait_idle(bus)
+
+    scoped = [it for it in sio.emitted if it[2] == ["sid1", "job1"]]
+    steps = [it[1]["step"] for it in scoped if it[0] == "diffusion_progress"]
+    # steps emitted while the first one was sending are coalesced to the latest
+    assert steps[-1] == 19
+    assert len(steps) < 20
+    assert scoped[-1][0] == "diffusion_finish"
+    assert ("diffusion_progress", {"step": 100}, None) in sio.emitted
+    assert all(it[1] != {"step": -1} for it in sio.emitted)
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
@@ -0,0 +1,64 @@
+import torch
+
+from iopaint.model.helper.prompt_cache import PromptEmbedsCache
+
+
+class FakePipeline:
+    def __init__(self, text_encoder=None):
+        self.text_encoder = text_encoder or torch.nn.Linear(2, 2)
+        self.calls = []
+
+    def encode_prompt(self, prompt, device, negative_prompt=None, prompt_embeds=None):
+        self.calls.append(prompt)
+        return torch.full((1, 2), len(prompt), dtype=torch.float32), None
+
+    def _encode_prompt(self, promptA, promptB, t, device):
+        self.calls.append((promptA, promptB, t))
+        return torch.tensor([t])
+
+
+def test_prompt_embeds_cache():
+    cache = PromptEmbedsCache(max_size=2)
+    pipe = FakePipeline()
+    cache.wrap(pipe)
+    cache.wrap(pipe)
+
+    embeds, negative = pipe.encode_prompt("a cat", torch.device("cpu"))
+    embeds.add_(1)
+    again, _ = pipe.encode_prompt("a cat", torch.device("cpu"))
+    assert pipe.calls == ["a cat"] and negative is None
+    # callers get copies of the cached embeddings
+    assert again.tolist() == [[5, 5]]
+
+    pipe.encode_prompt("a cat", "cpu", negative_prompt="blurry")
+    pipe.encode_prompt("a cat", "cpu", prompt_embeds=torch.zeros(1))
+    assert pipe.calls == ["a cat", "a cat", "a cat"]
+
+    # powerpaint task prompts are mixed by the fitting degree
+    pipe._encode_prompt("P_obj", "P_ctxt", 1.0, "cpu")
+    pipe._encode_prompt("P_obj", "P_ctxt", 1.0, "cpu")
+    pipe._encode_prompt("P_obj", "P_ctxt", 0.5, "cpu")
+    assert pipe.calls[3:] == [("P_obj", "P_ctxt", 1.0), ("P_obj", "P_ctxt", 0.5)]
+    assert len(cache) == 2
+
+
+def test_prompt_embeds_cache_text_encoder():
+    cache = PromptEmbedsCache()
+    text_encoder = torch.nn.Linear(2, 2)
+    pipe, other = FakePipeline(text_encoder), FakePipeline(text_encoder)
+    cache.wrap(pipe)
+    cache.wrap(other)
+    pipe.encode_prompt("a dog", "cpu")
+    # pipelines sharing the text encoder share the embeddings
+    other.encode_prompt("a dog", "cpu")
+    assert other.calls == []
+
+    cache.invalidate(text_encoder)
+    other.encode_prompt("a dog", "cpu")
+    assert other.calls == ["a dog"]
+
+    FakePipeline().encode_prompt("a dog", "cpu")
+    third = FakePipeline()
+    cache.wrap(third)
+    third.encode_prompt("a dog", "cpu")
+    assert third.calls == ["a dog"]
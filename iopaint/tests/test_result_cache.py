@@ -0,0 +1,76 @@
+import numpy as np
+
+from iopaint.result_cache import ResultCache, result_cache_key
+from iopaint.schema import InpaintRequest
+
+
+def _result(value):
+    return np.full((32, 32, 3), value, dtype=np.uint8)
+
+
+def test_result_cache_key():
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    mask = np.zeros((32, 32), dtype=np.uint8)
+    req = InpaintRequest(sd_seed=42)
+    key = result_cache_key("lama", image, mask, req)
+    # encoded image/mask are not part of the key
+    encoded_req = req.model_copy(update={"image": "x"})
+    assert key == result_cache_key("lama", image, mask, encoded_req)
+    assert key != result_cache_key("mat", image, mask, req)
+    assert key != result_cache_key("lama", image, mask, InpaintRequest(sd_seed=43))
+    mask[0, 0] = 255
+    assert key != result_cache_key("lama", image, mask, req)
+
+
+def test_result_cache_key_random_seed():
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    mask = np.zeros((32, 32), dtype=np.uint8)
+    # erase models don't read the seed or the other diffusion fields
+    key = result_cache_key(
+        "lama", image, mask, InpaintRequest(sd_seed=-1), erase_model=True
+    )
+    assert key == result_cache_key(
+        "lama", image, mask, InpaintRequest(sd_seed=-1), erase_model=True
+    )
+    assert key == result_cache_key(
+        "lama", image, mask, InpaintRequest(prompt="cat"), erase_model=True
+    )
+    req = InpaintRequest(sd_keep_unmasked_area=False)
+    assert key != result_cache_key("lama", image, mask, req, erase_model=True)
+    # the random seed of diffusion models is not part of the key
+    key = result_cache_key("sd", image, mask, InpaintRequest(sd_seed=-1))
+    assert key == result_cache_key("sd", image, mask, InpaintRequest(sd_seed=-1))
+
+
+def test_result_cache_memory_lru():
+    cache = ResultCache(memory_budget=_result(0).nbytes * 2)
+    cache.put("a", _result(1))
+    cache.put("b", _result(2))
+    assert cache.get("a") is not None
+    cache.put("c", _result(3))
+    # b is the least recently used
+    assert cache.get("b") is None
+    assert np.array_equal(cache.get("c"), _result(3))
+
+    stats = cache.stats()
+    assert stats.memory_items == 2
+    assert stats.memory_hits == 2
+    assert stats.misses == 1
+
+
+def test_result_cache_disk(tmp_path):
+    cache = ResultCache(
+        memory_budget=_result(0).nbytes, disk_dir=tmp_path, disk_budget=1024 * 1024
+    )
+    cache.put("a", _result(1))
+    cache.put("b", _result(2))
+    # a was evicted from memory, loaded from disk and promoted back
+    assert np.array_equal(cache.get("a"), _result(1))
+    assert cache.stats().disk_hits == 1
+    assert cache.get("a") is not None
+    assert cache.stats().memory_hits == 1
+
+    # disk entries survive restart
+    cache = ResultCache(memory_budget=0, disk_dir=tmp_path, disk_budget=1024 * 1024)
+    assert cache.stats().disk_items == 2
+    assert np.array_equal(cache.get("b"), _result(2))
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+import torch
+
+from iopaint.helper import (
+    load_model,
+    load_state_dict,
+    md5sum,
+    safetensors_cache_path,
+)
+
+
+@pytest.fixture(autouse=True)
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "models"))
+
+
+def make_net():
+    return torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 2))
+
+
+def test_load_model_from_safetensors_cache(tmp_path, monkeypatch):
+    net = make_net()
+    model_path = str(tmp_path / "net.pth")
+    torch.save(net.state_dict(), model_path)
+    model_md5 = md5sum(model_path)
+
+    loaded = load_model(make_net(), model_path, "cpu", model_md5)
+    cache_path = safetensors_cache_path(model_path, model_md5)
+    assert cache_path.startswith(str(tmp_path / "models" / "safetensors"))
+    assert os.path.exists(cache_path)
+    # nothing is written next to the checkpoint, e.g. in a HuggingFace snapshot
+    assert sorted(os.listdir(tmp_path)) == ["models", "net.pth"]
+    assert torch.equal(loaded[0].weight, net[0].weight)
+
+    def no_torch_load(*args, **kwargs):
+        raise AssertionError("checkpoint should be loaded from the safetensors copy")
+
+    monkeypatch.setattr(torch, "load", no_torch_load)
+    loaded = load_model(make_net(), model_path, "cpu", model_md5)
+    assert torch.equal(loaded[1].bias, net[1].bias)
+
+
+def test_load_state_dict_keys_and_shared_tensors(tmp_path):
+    weight = torch.randn(4, 4)
+    model_path = str(tmp_path / "net.pth")
+    torch.save({"params": {"a": weight, "b": weight[:2]}, "iter": 1}, model_path)
+
+    state_dict = load_state_dict(model_path, keys=["params_ema", "params"])
+    assert os.path.exists(safetensors_cache_path(model_path))
+    assert torch.equal(state_dict["a"], weight)
+    assert torch.equal(state_dict["b"], weight[:2])
+
+
+def test_stale_or_unverified_safetensors_cache(tmp_path):
+    model_path = str(tmp_path / "net.pth")
+    torch.save({"a": torch.zeros(2)}, model_path)
+    load_state_dict(model_path)
+
+    # the checkpoint is replaced, the copy is converted again
+    torch.save({"a": torch.ones(3)}, model_path)
+    assert torch.equal(load_state_dict(model_path)["a"], torch.ones(3))
+
+    # checkpoints not matching the expected md5 are not converted
+    state_dict = load_state_dict(model_path, model_md5="0" * 32)
+    assert torch.equal(state_dict["a"], torch.ones(3))
+    assert not os.path.exists(safetensors_cache_path(model_path, "0" * 32))
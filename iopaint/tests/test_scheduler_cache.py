@@ -0,0 +1,43 @@
+import pytest
+
+from iopaint.model import utils
+from iopaint.model.utils import SchedulerCache
+from iopaint.schema import SDSampler
+
+pytest.importorskip("diffusers")
+
+
+def test_scheduler_cache(monkeypatch):
+    from diffusers import DDIMScheduler
+
+    built = []
+    get_scheduler = utils.get_scheduler
+
+    def counting_get_scheduler(sd_sampler, scheduler_config):
+        built.append(sd_sampler)
+        return get_scheduler(sd_sampler, scheduler_config)
+
+    monkeypatch.setattr(utils, "get_scheduler", counting_get_scheduler)
+    cache = SchedulerCache(max_size=2)
+    config = DDIMScheduler().config
+
+    a = cache.get(SDSampler.dpm_plus_plus_2m_karras, config)
+    b = cache.get(SDSampler.dpm_plus_plus_2m_karras, dict(config))
+    assert built == [SDSampler.dpm_plus_plus_2m_karras]
+    assert a is not b and a.config == b.config
+    assert a.config.use_karras_sigmas
+
+    # copies don't share the state of the run
+    a.set_timesteps(4)
+    b.set_timesteps(8)
+    assert len(a.timesteps) == 4 and len(b.timesteps) == 8
+
+    cache.get(SDSampler.lcm, config)
+    cache.get(SDSampler.euler, config)
+    cache.get(SDSampler.dpm_plus_plus_2m_karras, config)
+    assert built == [
+        SDSampler.dpm_plus_plus_2m_karras,
+        SDSampler.lcm,
+        SDSampler.euler,
+        SDSampler.dpm_plus_plus_2m_karras,
+    ]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+
+from iopaint.model_manager import ModelManager
+from iopaint.schema import HDStrategy, InpaintRequest
+from iopaint.session_store import SessionStore
+
+
+def _image(value=0):
+    return np.full((64, 64, 3), value, dtype=np.uint8)
+
+
+def test_session_versions():
+    store = SessionStore(memory_budget=1024 * 1024, max_versions=3)
+    session = store.create(_image(), None, {}, "png")
+    for i in range(1, 5):
+        version = store.add_version(session.session_id, _image(i), None, "png")
+        assert version.version == i
+
+    session = store.get(session.session_id)
+    # only the last max_versions versions are kept
+    assert session.info().versions == [2, 3, 4]
+    assert session.latest.image[0, 0, 0] == 4
+    assert session.get_version(3).image[0, 0, 0] == 3
+    with pytest.raises(KeyError):
+        session.get_version(0)
+    with pytest.raises(ValueError):
+        session.latest.image[0, 0, 0] = 1
+
+
+def test_session_lru_eviction():
+    store = SessionStore(memory_budget=_image().nbytes * 2)
+    s1 = store.create(_image(), None, {}, "png")
+    s2 = store.create(_image(), None, {}, "png")
+    store.get(s1.session_id)
+    store.create(_image(), None, {}, "png")
+    # s2 is the least recently used
+    with pytest.raises(KeyError):
+        store.get(s2.session_id)
+    assert store.get(s1.session_id) is s1
+
+
+def test_inpaint_session_image_with_crop_strategy():
+    store = SessionStore(memory_budget=16 * 1024 * 1024)
+    image = np.random.RandomState(0).randint(0, 255, (900, 900, 3), dtype=np.uint8)
+    session = store.create(image, None, {}, "png")
+    mask = np.zeros((900, 900), dtype=np.uint8)
+    mask[100:150, 600:700] = 255
+
+    # session images are read-only, models must not write into them
+    model = ModelManager(name="cv2", device=torch.device("cpu"))
+    res = model(session.latest.image, mask, InpaintRequest(hd_strategy=HDStrategy.CROP))
+    assert res.shape == image.shape
+    assert np.array_equal(session.latest.image, image)
+    keep = mask < 127
+    assert np.array_equal(res[keep], image[:, :, ::-1][keep])
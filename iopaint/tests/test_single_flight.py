@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from iopaint.job_queue import JobCancelledError
+from iopaint.single_flight import SingleFlight, single_flight_key
+
+
+def _run_concurrently(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_single_flight_share_result():
+    single_flight = SingleFlight()
+    calls = []
+    results = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    def request():
+        results.append(single_flight.do("key", fn))
+
+    _run_concurrently(4, request)
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == "result" for result, _ in results)
+    assert single_flight.in_flight == 0
+
+    # finished calls are not cached
+    assert single_flight.do("key", fn) == ("result", False)
+    assert single_flight_key("ab", "c") != single_flight_key("a", "bc")
+
+
+def test_single_flight_errors():
+    single_flight = SingleFlight()
+    errors = []
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("failed")
+
+    def request():
+        with pytest.raises(ValueError):
+            single_flight.do("key", fail)
+        errors.append(1)
+
+    _run_concurrently(3, request)
+    assert len(errors) == 3
+
+    # cancellation of the first call is not shared, the waiting call runs again
+    calls = []
+
+    def cancelled_then_ok():
+        calls.append(1)
+        time.sleep(0.2)
+        if len(calls) == 1:
+            raise JobCancelledError("job")
+        return "result"
+
+    results = []
+
+    def request_cancelled():
+        try:
+            results.append(single_flight.do("key", cancelled_then_ok))
+        except JobCancelledError:
+            results.append("cancelled")
+
+    _run_concurrently(2, request_cancelled)
+    assert sorted(map(str, results)) == ["('result', False)", "cancelled"]
+    assert len(calls) == 2
@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from pydantic import ValidationError
+
+from iopaint.helper import tile_boxes
+from iopaint.model import base
+from iopaint.model.opencv2 import OpenCV2
+from iopaint.schema import HDStrategy
+from iopaint.tests.utils import get_config, get_data
+
+
+class ConstantTiles(OpenCV2):
+    """Each forward returns a flat image, brighter than the previous one"""
+
+    def init_model(self, device, **kwargs):
+        self.value = 0
+
+    def forward(self, image, mask, config):
+        self.value += 60
+        return np.full(image.shape, self.value, dtype=np.uint8)
+
+
+class BatchOpenCV2(OpenCV2):
+    supports_batch = True
+
+    def init_model(self, device, **kwargs):
+        self.batch_shapes = []
+
+    def forward_batch(self, images, masks, config):
+        self.batch_shapes.append([it.shape[:2] for it in images])
+        return super().forward_batch(images, masks, config)
+
+
+def test_tile_boxes():
+    rows = tile_boxes(600, 1000, 256, 32)
+    lefts = [int(it[0]) for it in rows[0]]
+    tops = [int(row[0][1]) for row in rows]
+    assert lefts == [0, 224, 448, 672, 744]
+    assert tops == [0, 224, 344]
+    assert all(r - l == 256 and b - t == 256 for row in rows for l, t, r, b in row)
+
+    # smaller than the tile on one side
+    rows = tile_boxes(200, 600, 256, 32)
+    assert [list(map(int, it)) for it in rows[0]] == [
+        [0, 0, 256, 200],
+        [224, 0, 480, 200],
+        [344, 0, 600, 200],
+    ]
+
+
+def test_tile_strategy(monkeypatch):
+    img, _ = get_data()
+    img = cv2.resize(img, (1000, 600))
+    mask = np.zeros((600, 1000), dtype=np.uint8)
+    # crosses the seams of the first two tiles
+    mask[100:140, 200:260] = 255
+    cfg = get_config(
+        strategy=HDStrategy.TILE, hd_strategy_tile_size=256, hd_strategy_tile_overlap=32
+    )
+
+    model = BatchOpenCV2(torch.device("cpu"))
+    res = model(img, mask, cfg)
+    assert res.shape == img.shape
+    # only the 2 tiles touching the mask run, one at a time by default
+    assert model.batch_shapes == []
+    monkeypatch.setattr(base, "TILE_BATCH_SIZE", 8)
+    assert np.array_equal(model(img, mask, cfg), res)
+    assert model.batch_shapes == [[(256, 256), (256, 256)]]
+
+    keep = mask < 127
+    assert np.array_equal(res[keep], img[:, :, ::-1][keep])
+    expected = OpenCV2(torch.device("cpu"))(
+        img, mask, get_config(strategy=HDStrategy.ORIGINAL)
+    )
+    diff = np.abs(res.astype(int) - expected.astype(int))[~keep]
+    assert diff.mean() < 5
+
+    # image not larger than the tile size runs as is
+    model.batch_shapes = []
+    small = get_config(strategy=HDStrategy.TILE, hd_strategy_tile_size=1000)
+    assert np.array_equal(model(img, mask, small), expected)
+    assert model.batch_shapes == []
+
+
+def test_tile_seams():
+    img = np.zeros((480, 480, 3), dtype=np.uint8)
+    mask = np.full((480, 480), 255, dtype=np.uint8)
+    cfg = get_config(
+        strategy=HDStrategy.TILE, hd_strategy_tile_size=256, hd_strategy_tile_overlap=32
+    )
+    res = ConstantTiles(torch.device("cpu"))(img, mask, cfg).astype(int)
+    # 2x2 tiles of 60, 120, 180 and 240
+    assert res[0, 0, 0] == 60 and res[0, -1, 0] == 120
+    assert res[-1, 0, 0] == 180 and res[-1, -1, 0] == 240
+    # outputs are blended over the whole overlap in both directions, no seams
+    step = 120 / 33 + 1
+    assert np.abs(np.diff(res, axis=0)).max() <= step
+    assert np.abs(np.diff(res, axis=1)).max() <= step
+
+
+@pytest.mark.parametrize(
+    "tile_size, overlap", [(0, 0), (32, 0), (256, -1), (256, 256), (256, 512)]
+)
+def test_invalid_tile_config(tile_size, overlap):
+    with pytest.raises(ValidationError):
+        get_config(
+            strategy=HDStrategy.TILE,
+            hd_strategy_tile_size=tile_size,
+            hd_strategy_tile_overlap=overlap,
+        )
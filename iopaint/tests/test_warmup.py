@@ -0,0 +1,74 @@
+import contextlib
+
+import pytest
+
+from iopaint.model_manager import ModelManager
+from iopaint.schema import HDStrategy, WarmupStatus
+from iopaint.warmup import Warmup, parse_warmup_hd_strategies, parse_warmup_sizes
+
+
+def test_parse_warmup_options():
+    assert parse_warmup_sizes(None) == []
+    assert parse_warmup_sizes("512, 1024x768") == [(512, 512), (1024, 768)]
+    with pytest.raises(ValueError):
+        parse_warmup_sizes("large")
+    assert parse_warmup_hd_strategies("Original,Crop") == [
+        HDStrategy.ORIGINAL,
+        HDStrategy.CROP,
+    ]
+
+
+def test_warmup():
+    model = ModelManager(name="cv2", device="cpu")
+    warmup = Warmup(
+        model,
+        {},
+        [(256, 256), (1024, 768)],
+        [HDStrategy.ORIGINAL, HDStrategy.CROP],
+        contextlib.nullcontext,
+    )
+    assert not warmup.ready
+    warmup.start()
+    warmup.wait()
+    info = warmup.info()
+    assert info.ready and info.status == WarmupStatus.finished
+    assert info.duration > 0
+
+    # nothing to warm up, ready at once
+    warmup = Warmup(model, {}, [], [], contextlib.nullcontext)
+    warmup.start()
+    assert warmup.ready
+
+
+class FlakyModel:
+    name = "flaky"
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, image, mask, config):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("CUDA out of memory")
+
+
+def test_warmup_retry(monkeypatch):
+    monkeypatch.setattr(Warmup, "retry_delay", 0)
+    model = FlakyModel(failures=1)
+    warmup = Warmup(model, {}, [(64, 64)], [], contextlib.nullcontext)
+    warmup.start()
+    warmup.wait()
+    info = warmup.info()
+    assert info.ready and info.status == WarmupStatus.finished
+    assert info.attempts == 2 and info.error is None
+
+    # retries are bounded, the server reports ready with the error
+    model = FlakyModel(failures=10)
+    warmup = Warmup(model, {}, [(64, 64)], [], contextlib.nullcontext)
+    warmup.start()
+    warmup.wait()
+    info = warmup.info()
+    assert model.calls == Warmup.retries + 1
+    assert info.ready and info.status == WarmupStatus.failed
+    assert info.error == "CUDA out of memory"
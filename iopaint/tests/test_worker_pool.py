@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+
+from iopaint.model_manager import ModelManager
+from iopaint.schema import HDStrategy
+from iopaint.tests.utils import get_config, get_data, current_dir
+from iopaint.worker_pool import WorkerPool, WorkerCrashedError, WorkerError
+
+img_p = current_dir / "overture-creations-5sI6fQgYIuo.png"
+mask_p = current_dir / "overture-creations-5sI6fQgYIuo_mask.png"
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = WorkerPool(name="cv2", devices=["cpu", "cpu"], health_check_interval=0.5)
+    yield pool
+    pool.close()
+
+
+def test_worker_pool_inpaint(pool):
+    img, mask = get_data(img_p=img_p, mask_p=mask_p)
+    cfg = get_config(strategy=HDStrategy.ORIGINAL)
+    expected = ModelManager(name="cv2", device=torch.device("cpu"))(img, mask, cfg)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: pool(img, mask, cfg), range(4)))
+    for res in results:
+        assert np.array_equal(res, expected)
+
+    infos = pool.workers_info()
+    assert len(infos) == 2
+    assert sum(it.processed for it in infos) == 4
+    # least-loaded routing spread requests over both workers
+    assert all(it.processed > 0 for it in infos)
+    assert not set(infos[0].cpu_cores or []) & set(infos[1].cpu_cores or [])
+
+
+def test_worker_pool_restart_crashed_worker(pool):
+    worker = pool.workers[0]
+    old_pid = worker.process.pid
+    with pool._lock:
+        worker.process.kill()
+        worker.process.join()
+        task = pool._send(worker, "inpaint", ())
+
+    with pytest.raises(WorkerCrashedError):
+        # a task sent to the dead worker is failed by the monitor
+        pool._wait(task)
+
+    deadline = time.time() + 120
+    while not (worker.alive and worker.ready.is_set()) and time.time() < deadline:
+        time.sleep(0.5)
+    assert worker.alive
+    assert worker.process.pid != old_pid
+    assert pool.workers_info()[0].restarts == 1
+
+    img, mask = get_data(img_p=img_p, mask_p=mask_p)
+    res = pool(img, mask, get_config(strategy=HDStrategy.ORIGINAL))
+    assert res.shape == img.shape
+
+
+def test_worker_pool_unknown_task(pool):
+    with pool._lock:
+        task = pool._send(pool.workers[1], "unknown", ())
+    with pytest.raises(WorkerError, match="Unknown worker task"):
+        pool._wait(task)
+
+
+def test_worker_pool_worker_exits_before_ready(monkeypatch):
+    def start_exiting_worker(self, worker):
+        worker.ready.clear()
+        worker.task_queue = self._ctx.Queue()
+        worker.process = self._ctx.Process(target=os._exit, args=(3,), daemon=True)
+        worker.process.start()
+
+    monkeypatch.setattr(WorkerPool, "_start_worker", start_exiting_worker)
+    started = time.time()
+    with pytest.raises(WorkerError, match="exited with code 3"):
+        WorkerPool(name="cv2", devices=["cpu"], health_check_interval=0.5)
+    assert time.time() - started < 60
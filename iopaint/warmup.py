@@ -0,0 +1,177 @@
+import threading
+import time
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from iopaint.model.utils import torch_gc
+from iopaint.plugins.base_plugin import BasePlugin
+from iopaint.schema import (
+    HDStrategy,
+    InpaintRequest,
+    RunPluginRequest,
+    WarmupInfo,
+    WarmupStatus,
+)
+
+# a few steps are enough to select the kernels of the unet
+WARMUP_SD_STEPS = 2
+
+
+def parse_warmup_sizes(sizes: Optional[str]) -> List[Tuple[int, int]]:
+    """ "512,1024x768" -> [(512, 512), (1024, 768)], sizes are width x height"""
+    res = []
+    for it in (sizes or "").split(","):
+        it = it.strip().lower()
+        if not it:
+            continue
+        try:
+            if "x" in it:
+                width, height = [int(v) for v in it.split("x")]
+            else:
+                width = height = int(it)
+        except ValueError:
+            raise ValueError(f"Invalid warmup size: {it}, expected 512 or 1024x768")
+        res.append((width, height))
+    return res
+
+
+def parse_warmup_hd_strategies(hd_strategies: str) -> List[HDStrategy]:
+    return [HDStrategy(it.strip()) for it in hd_strategies.split(",") if it.strip()]
+
+
+def warmup_inputs(width: int, height: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Synthetic RGB image and a mask in the center"""
+    image = np.full((height, width, 3), 127, dtype=np.uint8)
+    image[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    image[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    mask[height // 4 : height * 3 // 4, width // 4 : width * 3 // 4] = 255
+    return image, mask
+
+
+class Warmup:
+    """
+    Run synthetic forwards through the loaded model and the enabled plugins in a
+    background thread, so the first real request doesn't pay for jit profiling,
+    cudnn/onednn algorithm selection and allocator growth.
+
+    A failed warm-up is retried ``retries`` times, ``retry_delay`` seconds apart
+    and longer each time. If it still fails the server reports ready with status
+    failed: it may serve requests, the error is in the health endpoints.
+    """
+
+    retries = 2
+    retry_delay = 10
+
+    def __init__(
+        self,
+        model_manager,
+        plugins: Dict[str, BasePlugin],
+        sizes: List[Tuple[int, int]],
+        hd_strategies: List[HDStrategy],
+        model_lock: Callable[[], ContextManager],
+    ):
+        self.model_manager = model_manager
+        self.plugins = plugins
+        self.sizes = sizes
+        self.hd_strategies = hd_strategies or [HDStrategy.ORIGINAL]
+        self.model_lock = model_lock
+        self.status = WarmupStatus.pending
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status in [WarmupStatus.finished, WarmupStatus.failed]
+
+    def start(self):
+        if not self.sizes:
+            self.status = WarmupStatus.finished
+            return
+        self._thread = threading.Thread(
+            target=self.run, name="iopaint-warmup", daemon=True
+        )
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        self.status = WarmupStatus.running
+        self.started_at = time.time()
+        while True:
+            self.attempts += 1
+            try:
+                self._warmup()
+                self.status = WarmupStatus.finished
+                self.error = None
+                break
+            except Exception as e:
+                logger.exception(f"Warm-up attempt {self.attempts} failed")
+                self.error = str(e)
+                if self.attempts > self.retries:
+                    self.status = WarmupStatus.failed
+                    break
+            finally:
+                torch_gc()
+            time.sleep(self.retry_delay * self.attempts)
+        self.finished_at = time.time()
+        logger.info(
+            f"Warm-up {self.status.value} in {self.finished_at - self.started_at:.2f}s"
+        )
+
+    def _warmup(self):
+        for width, height in self.sizes:
+            for hd_strategy in self.hd_strategies:
+                self._warmup_model(width, height, hd_strategy)
+        # plugins have no tiling strategy, the smallest size is enough
+        self._warmup_plugins(*min(self.sizes, key=lambda it: it[0] * it[1]))
+
+    def _warmup_model(self, width: int, height: int, hd_strategy: HDStrategy):
+        image, mask = warmup_inputs(width, height)
+        req = InpaintRequest(hd_strategy=hd_strategy, sd_steps=WARMUP_SD_STEPS)
+        start = time.time()
+        with self.model_lock():
+            self.model_manager(image, mask, req)
+        logger.info(
+            f"Warm-up {self.model_manager.name} {width}x{height} {hd_strategy.value}: "
+            f"{time.time() - start:.2f}s"
+        )
+
+    def _warmup_plugins(self, width: int, height: int):
+        image, _ = warmup_inputs(width, height)
+        for name, plugin in self.plugins.items():
+            req = RunPluginRequest(
+                name=name,
+                image=f"warmup-{width}x{height}",
+                clicks=[[width // 2, height // 2, 1]],
+            )
+            start = time.time()
+            try:
+                if plugin.support_gen_mask:
+                    plugin.gen_mask(image, req)
+                if plugin.support_gen_image:
+                    plugin.gen_image(image, req)
+            except Exception:
+                # a plugin is not critical, the server can still serve inpaint
+                logger.exception(f"Warm-up plugin {name} failed")
+                continue
+            logger.info(f"Warm-up plugin {name}: {time.time() - start:.2f}s")
+
+    def info(self) -> WarmupInfo:
+        duration = None
+        if self.started_at is not None:
+            duration = (self.finished_at or time.time()) - self.started_at
+        return WarmupInfo(
+            ready=self.ready,
+            status=self.status,
+            duration=duration,
+            attempts=self.attempts,
+            error=self.error,
+        )
@@ -0,0 +1,356 @@
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from iopaint.download import scan_models
+from iopaint.schema import InpaintRequest, ModelInfo, WorkerInfo
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerCrashedError(WorkerError):
+    pass
+
+
+def _worker_main(
+    worker_id: int,
+    name: str,
+    device: str,
+    cpu_cores: Optional[List[int]],
+    model_kwargs: Dict,
+    task_queue,
+    result_queue,
+):
+    if cpu_cores:
+        os.sched_setaffinity(0, cpu_cores)
+
+    import torch
+
+    if cpu_cores:
+        torch.set_num_threads(len(cpu_cores))
+
+    from iopaint.model_manager import ModelManager
+
+    try:
+        model_manager = ModelManager(
+            name=name, device=torch.device(device), **model_kwargs
+        )
+    except Exception:
+        result_queue.put((worker_id, None, "error", traceback.format_exc()))
+        return
+    result_queue.put((worker_id, None, "ready", None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, method, args = task
+        try:
+            if method == "inpaint":
+                res = model_manager(*args)
+            elif method == "switch":
+                model_manager.switch(*args)
+                res = None
+            else:
+                result_queue.put(
+                    (worker_id, task_id, "error", f"Unknown worker task: {method}")
+                )
+                continue
+            result_queue.put((worker_id, task_id, "ok", res))
+        except Exception as e:
+            logger.exception(f"Worker {worker_id} task {method} failed")
+            result_queue.put((worker_id, task_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class _Task:
+    def __init__(self, task_id: int, method: str, args):
+        self.task_id = task_id
+        self.method = method
+        self.args = args
+        self.result = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class _Worker:
+    def __init__(self, worker_id: int, device: str, cpu_cores: Optional[List[int]]):
+        self.worker_id = worker_id
+        self.device = device
+        self.cpu_cores = cpu_cores
+        self.process = None
+        self.task_queue = None
+        self.ready = threading.Event()
+        self.start_error: Optional[str] = None
+        self.tasks: Dict[int, _Task] = {}
+        self.restarts = 0
+        self.processed = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class WorkerPool:
+    """
+    Run N ModelManager replicas in separate processes.
+
+    Each worker is pinned to a device and, on CPU, to its own set of cores.
+    Requests are routed to the ready worker with the fewest in-flight tasks. A
+    monitor thread restarts workers whose process died, tasks that were running on
+    a crashed worker fail with ``WorkerCrashedError``.
+
+    Workers that are not ready within ``start_timeout`` seconds or exit before they
+    are ready fail the startup.
+
+    Diffusion progress callbacks are not forwarded from worker processes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        devices: List[str],
+        split_cpu_cores: bool = True,
+        health_check_interval: float = 2,
+        start_timeout: float = 600,
+        **model_kwargs,
+    ):
+        self.name = name
+        self.model_kwargs = {
+            k: v
+            for k, v in model_kwargs.items()
+            if k not in ["callback", "batch_size", "batch_wait_ms"]
+        }
+        self.health_check_interval = health_check_interval
+        self.available_models: Dict[str, ModelInfo] = {}
+        self.scan_models()
+        # only used by api_server_config, controlnet is switched per request inside workers
+        self.enable_controlnet = model_kwargs.get("enable_controlnet", False)
+        self.controlnet_method = model_kwargs.get("controlnet_method", None)
+
+        self._ctx = mp.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+
+        cpu_core_sets = [None] * len(devices)
+        if split_cpu_cores and hasattr(os, "sched_getaffinity"):
+            cpu_devices = [i for i, d in enumerate(devices) if d == "cpu"]
+            if cpu_devices:
+                cores = sorted(os.sched_getaffinity(0))
+                for n, i in enumerate(cpu_devices):
+                    cpu_core_sets[i] = cores[n :: len(cpu_devices)] or None
+
+        self.workers = [
+            _Worker(i, device, cores)
+            for i, (device, cores) in enumerate(zip(devices, cpu_core_sets))
+        ]
+        for worker in self.workers:
+            self._start_worker(worker)
+
+        self._collector = threading.Thread(
+            target=self._collect_results, name="iopaint-pool-collector", daemon=True
+        )
+        self._collector.start()
+        self._monitor = threading.Thread(
+            target=self._monitor_workers, name="iopaint-pool-monitor", daemon=True
+        )
+        self._monitor.start()
+
+        deadline = time.time() + start_timeout
+        for worker in self.workers:
+            try:
+                self._wait_ready(worker, deadline)
+            except WorkerError:
+                self.close()
+                raise
+
+    def _wait_ready(self, worker: _Worker, deadline: float):
+        while not worker.ready.wait(min(self.health_check_interval, 1)):
+            if not worker.alive:
+                # the ready message may be in flight when the worker exits right after
+                if worker.ready.wait(1):
+                    break
+                raise WorkerError(
+                    f"Model worker {worker.worker_id} exited with code "
+                    f"{worker.process.exitcode} before it was ready"
+                )
+            if time.time() > deadline:
+                raise WorkerError(f"Model worker {worker.worker_id} start timeout")
+        if worker.start_error is not None:
+            raise WorkerError(
+                f"Model worker {worker.worker_id} failed to start:\n{worker.start_error}"
+            )
+
+    @property
+    def current_model(self) -> ModelInfo:
+        return self.available_models[self.name]
+
+    @property
+    def is_batching(self) -> bool:
+        return False
+
+    def scan_models(self) -> List[ModelInfo]:
+        available_models = scan_models()
+        self.available_models = {it.name: it for it in available_models}
+        return available_models
+
+    def __call__(self, image: np.ndarray, mask: np.ndarray, config: InpaintRequest):
+        """
+
+        Args:
+            image: [H, W, C] RGB
+            mask: [H, W, 1] 255 means area to repaint
+            config:
+
+        Returns:
+            BGR image
+        """
+        with self._lock:
+            workers = [
+                it
+                for it in self.workers
+                if it.ready.is_set() and it.start_error is None and it.alive
+            ]
+            if not workers:
+                raise WorkerError("No model worker available")
+            worker = min(workers, key=lambda it: len(it.tasks))
+            task = self._send(worker, "inpaint", (image, mask, config))
+        return self._wait(task)
+
+    def switch(self, new_name: str):
+        if new_name == self.name:
+            return
+        with self._lock:
+            tasks = [self._send(it, "switch", (new_name,)) for it in self.workers]
+        for task in tasks:
+            self._wait(task)
+        self.name = new_name
+
+    def workers_info(self) -> List[WorkerInfo]:
+        return [
+            WorkerInfo(
+                worker_id=it.worker_id,
+                device=it.device,
+                cpu_cores=it.cpu_cores,
+                pid=it.process.pid if it.process else None,
+                alive=it.alive,
+                ready=it.ready.is_set(),
+                in_flight=len(it.tasks),
+                processed=it.processed,
+                restarts=it.restarts,
+            )
+            for it in self.workers
+        ]
+
+    def close(self):
+        self._closed = True
+        for worker in self.workers:
+            if worker.alive:
+                worker.task_queue.put(None)
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+
+    def _start_worker(self, worker: _Worker):
+        worker.ready.clear()
+        worker.task_queue = self._ctx.Queue()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker.worker_id,
+                self.name,
+                worker.device,
+                worker.cpu_cores,
+                self.model_kwargs,
+                worker.task_queue,
+                self._result_queue,
+            ),
+            name=f"iopaint-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        logger.info(
+            f"Start model worker {worker.worker_id}: pid={worker.process.pid}, "
+            f"device={worker.device}, cpu_cores={worker.cpu_cores}"
+        )
+
+    def _send(self, worker: _Worker, method: str, args) -> _Task:
+        task = _Task(next(self._task_ids), method, args)
+        worker.tasks[task.task_id] = task
+        worker.task_queue.put((task.task_id, method, args))
+        return task
+
+    def _wait(self, task: _Task):
+        task.done.wait()
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def _collect_results(self):
+        while not self._closed:
+            try:
+                worker_id, task_id, status, payload = self._result_queue.get()
+            except (EOFError, OSError):
+                break
+            worker = self.workers[worker_id]
+            if task_id is None:
+                if status == "ready":
+                    logger.info(f"Model worker {worker_id} ready")
+                    worker.start_error = None
+                else:
+                    logger.error(f"Model worker {worker_id} failed to start:\n{payload}")
+                    worker.start_error = payload
+                worker.ready.set()
+                continue
+
+            with self._lock:
+                task = worker.tasks.pop(task_id, None)
+            if task is None:
+                continue
+            if status == "ok":
+                task.result = payload
+                worker.processed += 1
+            else:
+                task.error = WorkerError(payload)
+            task.done.set()
+
+    def _monitor_workers(self):
+        while not self._closed:
+            time.sleep(self.health_check_interval)
+            for worker in self.workers:
+                if self._closed or worker.alive or worker.start_error is not None:
+                    continue
+                if not worker.ready.is_set():
+                    # a restarted worker died while loading the model, don't restart
+                    # it in a loop
+                    worker.start_error = (
+                        f"exited with code {worker.process.exitcode} before it was ready"
+                    )
+                    logger.error(f"Model worker {worker.worker_id} {worker.start_error}")
+                    worker.ready.set()
+                    continue
+                logger.error(
+                    f"Model worker {worker.worker_id} exited with code {worker.process.exitcode}, restarting"
+                )
+                with self._lock:
+                    tasks = list(worker.tasks.values())
+                    worker.tasks.clear()
+                    worker.restarts += 1
+                    self._start_worker(worker)
+                for task in tasks:
+                    task.error = WorkerCrashedError(
+                        f"Model worker {worker.worker_id} crashed"
+                    )
+                    task.done.set()